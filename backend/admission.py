@@ -0,0 +1,217 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+from metrics import record
+
+# Questions answered at once (embedding, search and LLM call)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", 8))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 100))
+# Shed a question at once when its estimated wait is longer than this
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 10))
+# Total time a question may take, time spent in the queue included
+QUERY_DEADLINE = float(os.getenv("QUERY_DEADLINE", 30))
+# Service time assumed before any question was answered
+INITIAL_SERVICE_TIME = 2.0
+SERVICE_TIME_ALPHA = 0.2
+WAIT_WINDOW = 500
+
+
+class AdmissionRejected(Exception):
+    """The question was shed; the client should retry after ``retry_after`` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class DeadlineExceeded(Exception):
+    """The question was admitted but not answered before its deadline."""
+
+
+class Ticket:
+    """A slot held by one question."""
+
+    def __init__(self, key: str, deadline: float, wait: float):
+        self.key = key
+        self.deadline = deadline
+        self.wait = wait
+        self.admitted_at = time.monotonic()
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class _Waiter:
+    def __init__(self, future: asyncio.Future, deadline: float):
+        self.future = future
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """Bounded, per-session fair admission of questions.
+
+    At most ``max_concurrency`` questions run at once; the others wait in one
+    FIFO queue per session, and a freed slot goes to the next session in
+    round-robin order, so a client sending a burst only delays its own
+    questions. A question is shed with a ``Retry-After`` hint when the queue
+    is full or when its estimated wait (its position in the round-robin
+    order times the observed service time) exceeds ``max_wait``. A question
+    still waiting when too little of its deadline is left to be answered
+    leaves the queue the same way.
+    """
+
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY, max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_wait: float = ADMISSION_MAX_WAIT, deadline: float = QUERY_DEADLINE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.deadline = deadline
+        self.in_flight = 0
+        self.service_time = INITIAL_SERVICE_TIME
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._waits: Deque[float] = deque(maxlen=WAIT_WINDOW)
+        self.admitted = 0
+        self.queued = 0
+        self.shed_full = 0
+        self.shed_wait = 0
+        self.expired = 0
+        self.timeouts = 0
+
+    def depth(self) -> int:
+        return sum(len(waiters) for waiters in self._queues.values())
+
+    def estimated_wait(self, key: str) -> float:
+        """Expected wait of a new question from ``key`` under round-robin service."""
+        if self.in_flight < self.max_concurrency and not self._queues:
+            return 0.0
+        # Each other session is served at most as many times as this one before its turn
+        own = len(self._queues.get(key, ())) + 1
+        ahead = own + sum(min(len(waiters), own) for other, waiters in self._queues.items() if other != key)
+        return ahead * self.service_time / self.max_concurrency
+
+    async def acquire(self, key: str) -> Ticket:
+        now = time.monotonic()
+        deadline = now + self.deadline
+        if self.in_flight < self.max_concurrency and not self._queues:
+            return self._admit(key, deadline, 0.0)
+
+        estimate = self.estimated_wait(key)
+        if self.depth() >= self.max_queue:
+            self.shed_full += 1
+            raise AdmissionRejected("File d'attente pleine", estimate)
+        if estimate > self.max_wait:
+            self.shed_wait += 1
+            raise AdmissionRejected(f"Attente estimée {estimate:.0f}s", estimate)
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), deadline)
+        self._queues.setdefault(key, deque()).append(waiter)
+        self.queued += 1
+        # Leave the queue once there is no longer time to answer
+        patience = max(0.0, deadline - now - self.service_time)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), patience)
+        except asyncio.TimeoutError:
+            self._forget(key, waiter)
+            if waiter.future.done():
+                # Granted just as the timer fired
+                return self._granted(key, waiter)
+            waiter.future.cancel()
+            self.expired += 1
+            raise AdmissionRejected("Délai dépassé dans la file d'attente", self.estimated_wait(key))
+        except BaseException:
+            self._forget(key, waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._vacate()
+            else:
+                waiter.future.cancel()
+            raise
+        return self._granted(key, waiter)
+
+    def _admit(self, key: str, deadline: float, wait: float) -> Ticket:
+        self.in_flight += 1
+        return self._ticket(key, deadline, wait)
+
+    def _granted(self, key: str, waiter: _Waiter) -> Ticket:
+        # The slot was handed over by release(): in_flight already counts it
+        return self._ticket(key, waiter.deadline, time.monotonic() - waiter.enqueued_at)
+
+    def _ticket(self, key: str, deadline: float, wait: float) -> Ticket:
+        self.admitted += 1
+        self._waits.append(wait)
+        record("queue_wait", wait)
+        return Ticket(key, deadline, wait)
+
+    def _forget(self, key: str, waiter: _Waiter):
+        waiters = self._queues.get(key)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._queues[key]
+
+    def release(self, ticket: Ticket):
+        """Free the slot of ``ticket`` and hand it to the next session in turn."""
+        elapsed = time.monotonic() - ticket.admitted_at
+        self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+        self._vacate()
+
+    def _vacate(self):
+        self.in_flight -= 1
+        while self._queues and self.in_flight < self.max_concurrency:
+            key, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            if not waiter.future.done():
+                self.in_flight += 1
+                waiter.future.set_result(None)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Admit a question, then wait for ``fn()`` until its deadline.
+
+        Past the deadline the caller gets :class:`DeadlineExceeded` but the
+        work goes on (holding its slot) so its answer can still be cached.
+        """
+        ticket = await self.acquire(key)
+        task = asyncio.ensure_future(fn())
+
+        def done(task: asyncio.Future):
+            self.release(ticket)
+            if not task.cancelled():
+                task.exception()
+
+        task.add_done_callback(done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), ticket.remaining())
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise DeadlineExceeded(f"Pas de réponse en {self.deadline:.0f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.depth(),
+            "sessions_waiting": len(self._queues),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed_full": self.shed_full,
+            "shed_wait": self.shed_wait,
+            "expired_in_queue": self.expired,
+            "deadline_exceeded": self.timeouts,
+            "service_time": round(self.service_time, 3),
+            "avg_wait": round(sum(waits) / len(waits), 4) if waits else 0.0,
+            "p95_wait": round(waits[int(0.95 * (len(waits) - 1))], 4) if waits else 0.0,
+        }
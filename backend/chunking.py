@@ -0,0 +1,236 @@
+import hashlib
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 256))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
+TOKEN_ENCODING = "cl100k_base"
+
+# Short lines at the top or bottom of a page that reappear at the same edge
+# of later pages are running headers/footers
+BOILERPLATE_MAX_CHARS = 120
+BOILERPLATE_EDGE_LINES = 2
+
+_HEADING_RE = re.compile(
+    r"^\s*(?:"
+    r"(?:titre|chapitre|section|sous-section|article|annexe)\b"
+    r"|dispositions\s+(?:applicables|g[ée]n[ée]rales|communes)\b"
+    r"|zones?\s+(?-i:\d?[A-Z]{1,4}[a-z]?\d?)\b"
+    r"|(?-i:[A-Z]{1,4}\s?\d{1,2})\s*[-–:.]"
+    r")",
+    re.IGNORECASE,
+)
+# Zone or title headings: sections on either side are never packed together
+_MAJOR_HEADING_RE = re.compile(
+    r"^\s*(?:titre|chapitre|dispositions\s|zones?\s)", re.IGNORECASE
+)
+_SENTENCE_RE = re.compile(r"(?<=[.;:!?])\s+")
+_DIGITS_RE = re.compile(r"\d+")
+
+
+@lru_cache(maxsize=None)
+def _encoding():
+    """tiktoken encoding, loaded on first use (None if unavailable)."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception:
+        # Not installed, or no network to fetch the BPE file: use the estimate
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken, or a word-based estimate without it."""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return int(len(text.split()) * 1.3) + 1
+
+
+def split_tokens(text: str, max_tokens: int) -> List[str]:
+    """Hard-split a text with no usable boundary into ``max_tokens`` pieces."""
+    encoding = _encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+    words = text.split()
+    step = max(1, int(max_tokens / 1.3))
+    return [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+
+
+def is_heading(line: str) -> bool:
+    """Short title-like line ("ARTICLE UB 10 - HAUTEUR", "ZONE N"), not a sentence."""
+    return (
+        len(line) <= BOILERPLATE_MAX_CHARS
+        and not line.endswith((".", ";"))
+        and bool(_HEADING_RE.match(line))
+    )
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(" ".join(text.lower().split()).encode()).hexdigest()
+
+
+class StructuredChunker:
+    """Splits a document on its structure (titles, zones, articles).
+
+    Fed one page at a time like the extraction pipeline produces them.
+    Consecutive sections of the same zone or title are packed whole into
+    chunks of at most ``max_tokens``; a section too long for one chunk is split on sentence
+    boundaries, each part starting with the section heading and repeating
+    ``overlap_tokens`` of the previous part. Short lines repeated at the top
+    or bottom of later pages (running headers, footers, page numbers) are
+    dropped, and a chunk whose content hash was already emitted is skipped.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 count: Callable[[str], int] = count_tokens):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.count = count
+        # Current section
+        self._heading: Optional[str] = None
+        self._heading_tokens = 0
+        self._units: List[Tuple[str, int, int]] = []  # (text, page, tokens)
+        self._fresh = 0  # units not yet part of an emitted chunk
+        self._split = False
+        # Whole sections waiting to be packed together
+        self._packed: List[Tuple[str, int]] = []
+        self._packed_tokens = 0
+        self._packed_zone = 0
+        self._zone = 0  # incremented on each zone or title heading
+        self._seen_lines: Dict[str, int] = {}
+        self._seen_chunks: Set[str] = set()
+        self.duplicates = 0
+        self.boilerplate_lines = 0
+
+    def feed(self, page_number: int, text: str) -> List[Tuple[str, int]]:
+        """Add a page and return the chunks that are now complete."""
+        chunks: List[Tuple[str, int]] = []
+        lines = [" ".join(line.split()) for line in text.splitlines()]
+        lines = [line for line in lines if line]
+        for i, line in enumerate(lines):
+            if i < BOILERPLATE_EDGE_LINES:
+                edge = "top"
+            elif i >= len(lines) - BOILERPLATE_EDGE_LINES:
+                edge = "bottom"
+            else:
+                edge = None
+            if edge and self._is_boilerplate(line, edge, page_number):
+                continue
+            if is_heading(line):
+                self._start_section(line, chunks)
+                continue
+            for unit in self._units_of(line):
+                self._units.append((unit, page_number, self.count(unit)))
+                self._fresh += 1
+                if sum(tokens for _, _, tokens in self._units) > self._budget():
+                    chunks.extend(self._emit_packed())
+                    chunks.extend(self._emit_part())
+        return chunks
+
+    def flush(self) -> List[Tuple[str, int]]:
+        """Return the trailing chunks once every page has been fed."""
+        chunks = self._close_section()
+        chunks.extend(self._emit_packed())
+        return chunks
+
+    def _start_section(self, heading: str, chunks: List[Tuple[str, int]]):
+        if self._heading and not self._fresh and self._heading_tokens < self.max_tokens // 4:
+            # Nested headings with no text in between ("ZONE UB" / "ARTICLE UB 10")
+            heading = f"{self._heading}\n{heading}"
+        else:
+            chunks.extend(self._close_section())
+            if _MAJOR_HEADING_RE.match(heading):
+                self._zone += 1
+        self._heading = heading
+        self._heading_tokens = self.count(heading)
+
+    def _is_boilerplate(self, line: str, edge: str, page_number: int) -> bool:
+        # Sentences ("Non réglementé.") legitimately repeat; running headers don't end like one
+        if len(line) > BOILERPLATE_MAX_CHARS or line.endswith((".", ";", ":")):
+            return False
+        key = f"{edge}:{_DIGITS_RE.sub('#', line.lower())}"
+        first_page = self._seen_lines.setdefault(key, page_number)
+        if first_page != page_number:
+            self.boilerplate_lines += 1
+            return True
+        return False
+
+    def _budget(self) -> int:
+        return max(1, self.max_tokens - self._heading_tokens)
+
+    def _units_of(self, line: str) -> List[str]:
+        budget = self._budget()
+        if self.count(line) <= budget:
+            return [line]
+        units = []
+        for sentence in _SENTENCE_RE.split(line):
+            if self.count(sentence) <= budget:
+                units.append(sentence)
+            else:
+                units.extend(split_tokens(sentence, budget))
+        return units
+
+    def _section_text(self, units: List[Tuple[str, int, int]]) -> str:
+        body = "\n".join(unit for unit, _, _ in units)
+        return f"{self._heading}\n{body}" if self._heading else body
+
+    def _close_section(self) -> List[Tuple[str, int]]:
+        chunks: List[Tuple[str, int]] = []
+        if self._fresh and self._split:
+            chunks = self._dedup(self._section_text(self._units), self._units[0][1])
+        elif self._fresh:
+            text = self._section_text(self._units)
+            tokens = self._heading_tokens + sum(tokens for _, _, tokens in self._units)
+            # Text before the first zone heading may join it; zones never mix
+            other_zone = self._packed_zone not in (0, self._zone)
+            if other_zone or self._packed_tokens + tokens > self.max_tokens:
+                chunks = self._emit_packed()
+            self._packed.append((text, self._units[0][1]))
+            self._packed_zone = self._zone
+            self._packed_tokens += tokens
+        self._units, self._fresh, self._split = [], 0, False
+        self._heading, self._heading_tokens = None, 0
+        return chunks
+
+    def _emit_packed(self) -> List[Tuple[str, int]]:
+        if not self._packed:
+            return []
+        text = "\n".join(section for section, _ in self._packed)
+        page = self._packed[0][1]
+        self._packed, self._packed_tokens = [], 0
+        return self._dedup(text, page)
+
+    def _emit_part(self) -> List[Tuple[str, int]]:
+        """Emit the buffered part of an over-long section.
+
+        The unit that overflowed the budget is held back for the next part,
+        along with the overlap.
+        """
+        held = self._units[-1:] if len(self._units) > 1 else []
+        body = self._units[:len(self._units) - len(held)]
+
+        overlap: List[Tuple[str, int, int]] = []
+        tokens = 0
+        for unit in reversed(body):
+            if tokens + unit[2] > self.overlap_tokens:
+                break
+            overlap.insert(0, unit)
+            tokens += unit[2]
+        while overlap and sum(u[2] for u in overlap + held) > self._budget():
+            overlap.pop(0)
+        self._units = overlap + held
+        self._fresh = len(held)
+        self._split = True
+        return self._dedup(self._section_text(body), body[0][1])
+
+    def _dedup(self, text: str, page: int) -> List[Tuple[str, int]]:
+        digest = content_hash(text)
+        if digest in self._seen_chunks:
+            self.duplicates += 1
+            return []
+        self._seen_chunks.add(digest)
+        return [(text, page)]
@@ -0,0 +1,197 @@
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from chunking import count_tokens, split_tokens
+
+# Tokens of retrieved text sent to the LLM with each question
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1200))
+# Snippets whose vector similarity and BM25 score are both below this
+# fraction of the best ones of the question are left out
+CONTEXT_MIN_SCORE_RATIO = float(os.getenv("CONTEXT_MIN_SCORE_RATIO", 0.4))
+# Shortest repeated span treated as chunk overlap, and how far it is looked for
+OVERLAP_MIN_CHARS = 40
+OVERLAP_WINDOW_CHARS = 1500
+# A snippet that does not fit is cut to the remaining budget if at least this much is left
+MIN_TRUNCATED_TOKENS = 48
+
+
+def source_label(metadata: Dict[str, Any]) -> str:
+    """``"reglement.pdf (p. 12, chunk 34)"`` for the metadata of a chunk."""
+    details = []
+    if metadata.get("page") is not None:
+        details.append(f"p. {metadata['page']}")
+    if metadata.get("chunk_index") is not None:
+        details.append(f"chunk {metadata['chunk_index']}")
+    filename = metadata.get("filename") or "document"
+    return f"{filename} ({', '.join(details)})" if details else filename
+
+
+def find_overlap(previous: str, text: str) -> Optional[Tuple[int, int]]:
+    """Span near the start of ``text`` that repeats the end of ``previous``.
+
+    Chunks overlap their predecessor: character windows (documents indexed
+    before the structured chunker) start with its last characters, and a
+    continuation of the structured chunker repeats the section heading then
+    the last sentences of the previous part. The span is therefore looked
+    for at the start of each of the first lines.
+    """
+    tail = previous[-OVERLAP_WINDOW_CHARS:]
+    start = 0
+    while start < min(len(text), OVERLAP_WINDOW_CHARS):
+        probe = text[start:start + OVERLAP_MIN_CHARS]
+        if len(probe) < OVERLAP_MIN_CHARS:
+            break
+        at = tail.find(probe)
+        while at != -1:
+            if text.startswith(tail[at:], start):
+                return start, start + len(tail) - at
+            at = tail.find(probe, at + 1)
+        newline = text.find("\n", start)
+        if newline == -1:
+            break
+        start = newline + 1
+    return None
+
+
+class PackedContext:
+    """Context sent to the LLM and what was left out of it."""
+
+    def __init__(self, text: str = "", sources: Optional[List[str]] = None,
+                 tokens: int = 0, tokens_saved: int = 0):
+        self.text = text
+        self.sources = sources or []
+        self.tokens = tokens
+        self.tokens_saved = tokens_saved
+
+
+class ContextPacker:
+    """Turns scored search hits into the context of a prompt.
+
+    Hits (``{"text", "metadata", "similarity", "keyword_score"}``, best
+    first, as returned by :meth:`retrieval.RetrievalService.search_hits_many`)
+    whose similarity and keyword score are both below ``min_score_ratio`` of
+    the best ones are dropped (the fused rank score says nothing of
+    relevance: every hit of the fusion depth scores close to the best one),
+    the text a chunk shares with a neighbouring chunk of the same file is
+    kept only once, and the remaining snippets are added in rank order until
+    ``budget`` tokens; the first one that no longer fits is cut if enough of
+    the budget is left.
+    ``tokens_saved`` compares with sending every hit whole.
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET, min_score_ratio: float = CONTEXT_MIN_SCORE_RATIO,
+                 count: Callable[[str], int] = count_tokens):
+        self.budget = budget
+        self.min_score_ratio = min_score_ratio
+        self.count = count
+        self._lock = threading.Lock()
+        self._stats = {
+            "prompts": 0,
+            "snippets_retrieved": 0,
+            "snippets_used": 0,
+            "dropped_low_score": 0,
+            "dropped_duplicate": 0,
+            "dropped_budget": 0,
+            "truncated": 0,
+            "overlap_chars_removed": 0,
+            "tokens_packed": 0,
+            "tokens_saved": 0,
+        }
+
+    def pack(self, hits: List[Dict[str, Any]]) -> PackedContext:
+        counts = dict.fromkeys(self._stats, 0)
+        counts["prompts"] = 1
+        counts["snippets_retrieved"] = len(hits)
+        if not hits:
+            self._add(counts)
+            return PackedContext()
+        full_tokens = sum(self.count(f"[Snippet {i+1}]: {hit['text']}") for i, hit in enumerate(hits))
+
+        kept = [hits[0], *(hit for hit in hits[1:] if self._relevant(hit, hits))]
+        counts["dropped_low_score"] = len(hits) - len(kept)
+
+        snippets: List[Tuple[str, Dict[str, Any]]] = []
+        for hit in kept:
+            text, metadata = hit["text"], hit.get("metadata") or {}
+            for previous, previous_metadata in snippets:
+                if previous_metadata.get("filename") != metadata.get("filename"):
+                    continue
+                text, removed = self._without_overlap(previous, text)
+                counts["overlap_chars_removed"] += removed
+            if text.strip():
+                snippets.append((text, metadata))
+            else:
+                counts["dropped_duplicate"] += 1
+
+        parts: List[str] = []
+        sources: List[str] = []
+        used = 0
+        for i, (text, metadata) in enumerate(snippets):
+            label = source_label(metadata)
+            header = f"[Snippet {len(parts)+1} - {label}]: "
+            tokens = self.count(header + text)
+            if used + tokens > self.budget:
+                room = self.budget - used - self.count(header)
+                if room < MIN_TRUNCATED_TOKENS:
+                    counts["dropped_budget"] += 1
+                    continue
+                text = split_tokens(text, room)[0].rstrip() + " […]"
+                tokens = self.count(header + text)
+                counts["truncated"] += 1
+                counts["dropped_budget"] += len(snippets) - i - 1
+                parts.append(header + text)
+                sources.append(label)
+                used += tokens
+                break
+            parts.append(header + text)
+            sources.append(label)
+            used += tokens
+
+        counts["snippets_used"] = len(parts)
+        counts["tokens_packed"] = used
+        counts["tokens_saved"] = max(0, full_tokens - used)
+        self._add(counts)
+        return PackedContext("\n\n".join(parts), sources, used, counts["tokens_saved"])
+
+    def _relevant(self, hit: Dict[str, Any], hits: List[Dict[str, Any]]) -> bool:
+        """Whether one of the hit's relevance signals is close enough to the best one."""
+        signals = [name for name in ("similarity", "keyword_score") if hit.get(name) is not None]
+        if not signals:
+            return True
+        for name in signals:
+            best = max(h[name] for h in hits if h.get(name) is not None)
+            if best <= 0 or hit[name] >= best * self.min_score_ratio:
+                return True
+        return False
+
+    @staticmethod
+    def _without_overlap(previous: str, text: str) -> Tuple[str, int]:
+        """``text`` minus what it repeats of ``previous``, and the characters removed."""
+        if text.strip() in previous:
+            return "", len(text)
+        span = find_overlap(previous, text)
+        if span is not None:
+            start, end = span
+            remaining = text[:start] + text[end:].lstrip()
+            return remaining, len(text) - len(remaining)
+        # ``text`` comes right before ``previous`` in the document
+        span = find_overlap(text, previous)
+        if span is not None:
+            start, end = span
+            remaining = text[:len(text) - (end - start)].rstrip()
+            return remaining, len(text) - len(remaining)
+        return text, 0
+
+    def _add(self, counts: Dict[str, int]):
+        with self._lock:
+            for name, value in counts.items():
+                self._stats[name] += value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["budget"] = self.budget
+        stats["avg_tokens_packed"] = round(stats["tokens_packed"] / stats["prompts"], 1) if stats["prompts"] else 0.0
+        stats["avg_tokens_saved"] = round(stats["tokens_saved"] / stats["prompts"], 1) if stats["prompts"] else 0.0
+        return stats
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from periodic import cancel, periodic
+
+logger = logging.getLogger(__name__)
+
+DELETE_PAGE_SIZE = int(os.getenv("DELETE_PAGE_SIZE", 500))
+# Past this delay the DELETE request returns 202 and the job goes on alone
+DELETE_SYNC_SECONDS = float(os.getenv("DELETE_SYNC_SECONDS", 2.0))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 3600))
+JOB_HISTORY_SIZE = 200
+
+
+class DeletionJob:
+    """Progress of the deletion of one session's chunks."""
+
+    def __init__(self, session_id: str):
+        self.job_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.status = "running"
+        self.deleted = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "deleted": self.deleted,
+            "elapsed": (self.finished_at or time.time()) - self.created_at,
+            "error": self.error,
+        }
+
+
+class DeletionManager:
+    """Deletes chunks page by page, off the event loop.
+
+    Only ids are fetched (``include=[]``), ``page_size`` at a time, and each
+    page is deleted before the next is read, so neither Chroma nor the worker
+    ever holds a whole session in memory. A sweeper deletes session chunks
+    whose ``expires_at`` has passed. After every deletion ``on_deleted`` is
+    awaited with the affected session ids so cached answers can be dropped.
+    """
+
+    def __init__(
+        self,
+        service,
+        on_deleted: Optional[Callable[[Set[str]], Awaitable[None]]] = None,
+        page_size: int = DELETE_PAGE_SIZE,
+        sweep_interval: float = SESSION_SWEEP_INTERVAL,
+        executor: Optional[Executor] = None,
+    ):
+        self.service = service
+        self.on_deleted = on_deleted
+        self.page_size = page_size
+        self.sweep_interval = sweep_interval
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="deletion")
+        self.jobs: "OrderedDict[str, DeletionJob]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self.sweeps = 0
+        self.expired = 0
+
+    def get(self, job_id: str) -> Optional[DeletionJob]:
+        return self.jobs.get(job_id)
+
+    def submit(self, session_id: str) -> DeletionJob:
+        """Start deleting every chunk of ``session_id`` in the background."""
+        job = DeletionJob(session_id)
+        self.jobs[job.job_id] = job
+        self._prune()
+        task = asyncio.create_task(self._run(job))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+        return job
+
+    async def wait(self, job: DeletionJob, timeout: Optional[float] = None) -> bool:
+        """Wait up to ``timeout`` seconds; True once the job is finished."""
+        task = self._tasks.get(job.job_id)
+        if task is not None:
+            await asyncio.wait({task}, timeout=timeout)
+        return job.finished
+
+    async def _run(self, job: DeletionJob):
+        try:
+            async for deleted, _ in self._delete_pages({"session_id": job.session_id}):
+                job.deleted += deleted
+            if job.deleted:
+                await self._notify({job.session_id})
+            job.status = "done"
+            logger.info(f"🗑️ Session {job.session_id}: {job.deleted} chunks supprimés")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Erreur suppression session {job.session_id}: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        """Delete the session chunks whose ``expires_at`` is past."""
+        where = {"expires_at": {"$lt": int(now or time.time())}}
+        deleted = 0
+        sessions: Set[str] = set()
+        async for count, page_sessions in self._delete_pages(where, with_sessions=True):
+            deleted += count
+            sessions.update(page_sessions)
+        self.sweeps += 1
+        self.expired += deleted
+        if deleted:
+            logger.info(f"🧹 {deleted} chunks expirés supprimés ({len(sessions)} sessions)")
+            await self._notify(sessions)
+        return deleted
+
+    async def _delete_pages(self, where: Dict[str, Any], with_sessions: bool = False):
+        loop = asyncio.get_running_loop()
+        while True:
+            count, sessions = await loop.run_in_executor(
+                self._executor, self._delete_page, where, with_sessions
+            )
+            if count:
+                yield count, sessions
+            if count < self.page_size:
+                return
+
+    def _delete_page(self, where: Dict[str, Any], with_sessions: bool) -> Tuple[int, List[str]]:
+        found = self.service.get(
+            where=where, include=["metadatas"] if with_sessions else [], limit=self.page_size
+        )
+        ids = found.get("ids") or []
+        if ids:
+            self.service.delete(ids)
+        sessions = [meta.get("session_id") for meta in found.get("metadatas") or []] if with_sessions else []
+        return len(ids), sessions
+
+    async def _notify(self, sessions: Set[str]):
+        if self.on_deleted is None:
+            return
+        try:
+            await self.on_deleted(sessions)
+        except Exception as e:
+            logger.warning(f"⚠️ Invalidation du cache impossible: {e}")
+
+    def start(self):
+        if self.sweep_interval > 0 and self._sweeper is None:
+            self._sweeper = periodic(self.sweep_interval, self.sweep)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        while len(self.jobs) > JOB_HISTORY_SIZE and finished:
+            self.jobs.pop(finished.pop(0), None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "jobs_running": sum(1 for job in self.jobs.values() if not job.finished),
+            "sweeps": self.sweeps,
+            "expired_chunks": self.expired,
+        }
+
+    async def shutdown(self):
+        await cancel(self._sweeper)
+        self._sweeper = None
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", 256))
+KEY_BYTES = 20  # sha1 digest
+
+
+class EmbeddingCache:
+    """On-disk LRU cache of embeddings keyed by a hash of the text.
+
+    Vectors live in a memory-mapped float32 matrix (``vectors.f32``), so the
+    cache survives restarts and only the rows actually read are paged in.
+    Each slot's key is stored next to it (``keys.bin``) and its last use
+    (``ticks.bin``): the hash index and the LRU order are rebuilt from those
+    files at startup, and a slot's key is cleared while it is being
+    rewritten so a crash never maps a hash to the wrong vector. The number
+    of slots is capped by ``max_mb``.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_DIR, model_name: str = "",
+                 max_mb: float = EMBEDDING_CACHE_MAX_MB):
+        self.path = path
+        self.model_name = model_name
+        self.max_mb = max_mb
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index: "OrderedDict[bytes, int]" = OrderedDict()
+        # Slots holding no entry, the next one to fill last
+        self._free: List[int] = []
+        self._tick = 0
+        self._lock = threading.Lock()
+        self._vectors = self._keys = self._ticks = None
+        self._open_existing()
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode()).digest()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _open_existing(self):
+        try:
+            with open(self._file("meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        if meta.get("model") != self.model_name:
+            logger.info("Cache d'embeddings d'un autre modèle ignoré")
+            return
+        try:
+            self._map(meta["dim"], meta["capacity"], "r+")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Cache d'embeddings illisible, recréé: {e}")
+            self.dim, self.capacity = None, 0
+            return
+        used = np.flatnonzero(self._keys.any(axis=1))
+        for slot in used[np.argsort(self._ticks[used], kind="stable")]:
+            self._index[self._keys[slot].tobytes()] = int(slot)
+        self._free = [int(slot) for slot in np.flatnonzero(~self._keys.any(axis=1))[::-1]]
+        self._tick = int(self._ticks.max(initial=0))
+
+    def _map(self, dim: int, capacity: int, mode: str):
+        os.makedirs(self.path, exist_ok=True)
+        self._vectors = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode=mode, shape=(capacity, dim))
+        self._keys = np.memmap(self._file("keys.bin"), dtype=np.uint8, mode=mode, shape=(capacity, KEY_BYTES))
+        self._ticks = np.memmap(self._file("ticks.bin"), dtype=np.uint64, mode=mode, shape=(capacity,))
+        self.dim, self.capacity = dim, capacity
+
+    def _create(self, dim: int):
+        capacity = int(self.max_mb * 1024 * 1024 // (dim * 4 + KEY_BYTES + 8))
+        if capacity <= 0:
+            return
+        self._map(dim, capacity, "w+")
+        self._free = list(range(capacity - 1, -1, -1))
+        with open(self._file("meta.json"), "w") as f:
+            json.dump({"model": self.model_name, "dim": dim, "capacity": capacity}, f)
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[List[float]]]:
+        results: List[Optional[List[float]]] = []
+        with self._lock:
+            for key in keys:
+                slot = self._index.get(key)
+                if slot is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._index.move_to_end(key)
+                self._tick += 1
+                self._ticks[slot] = self._tick
+                results.append(self._vectors[slot].tolist())
+        return results
+
+    def put_many(self, keys: Sequence[bytes], vectors: Sequence[Sequence[float]]):
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                if key in self._index:
+                    continue
+                if self.dim is None:
+                    self._create(len(vector))
+                if not self.capacity or len(vector) != self.dim:
+                    return
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    _, slot = self._index.popitem(last=False)
+                    self.evictions += 1
+                self._keys[slot] = 0
+                self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self._tick += 1
+                self._ticks[slot] = self._tick
+                self._index[key] = slot
+
+    def flush(self):
+        with self._lock:
+            for array in (self._vectors, self._keys, self._ticks):
+                if array is not None:
+                    array.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class CachedEmbeddingFunction:
+    """Wraps an embedding function so already seen texts skip the model.
+
+    Misses of one call are encoded together in a single call of ``inner``.
+    """
+
+    def __init__(self, inner: Callable[[List[str]], Any], cache: EmbeddingCache):
+        self.inner = inner
+        self.cache = cache
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        keys = [self.cache.key(text) for text in input]
+        vectors = self.cache.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = [list(map(float, v)) for v in self.inner([input[i] for i in missing])]
+            self.cache.put_many([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return vectors
@@ -0,0 +1,63 @@
+import importlib
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+
+class _LazyModule:
+    """Imports a module on first attribute access.
+
+    PyPDF2 and python-docx are only needed by extraction workers, so the app
+    itself starts without loading them.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+PyPDF2 = _LazyModule("PyPDF2")
+docx = _LazyModule("docx")
+
+SUPPORTED_TYPES = {".pdf": "pdf", ".docx": "docx", ".txt": "txt"}
+
+
+def detect_doc_type(filename: str) -> str:
+    """Return the document type for a filename, or an empty string if unsupported."""
+    for suffix, doc_type in SUPPORTED_TYPES.items():
+        if filename.lower().endswith(suffix):
+            return doc_type
+    return ""
+
+
+def pdf_page_count(path: str) -> int:
+    """Return the number of pages of a PDF stored on disk."""
+    return len(PyPDF2.PdfReader(path).pages)
+
+
+def extract_pdf_pages(path: str, start: int, stop: int) -> List[str]:
+    """Extract the text of pages ``[start, stop)`` of a PDF stored on disk.
+
+    Runs in a worker process: each worker opens its own reader on the spooled
+    file so only page texts cross the process boundary.
+    """
+    reader = PyPDF2.PdfReader(path)
+    pages = []
+    for index in range(start, stop):
+        try:
+            pages.append(reader.pages[index].extract_text() or "")
+        except Exception as e:
+            logger.error(f"Erreur extraction PDF page {index + 1}: {e}")
+            pages.append("")
+    return pages
+
+
+def extract_file(doc_type: str, path: str) -> str:
+    """Extract the text of a non-PDF document stored on disk."""
+    if doc_type == "docx":
+        return "".join(paragraph.text + "\n" for paragraph in docx.Document(path).paragraphs)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+from scopes import GLOBAL_SESSION, normalize_commune
+
+logger = logging.getLogger(__name__)
+
+GENERATION_PREFIX = "urbanisme:corpus:"
+# Seconds a worker trusts the generations it read from Redis; the worker that
+# bumps a generation sees it at once, the others within this delay
+GENERATION_REFRESH = float(os.getenv("GENERATION_REFRESH", 1.0))
+# Bumped when global documents of unknown communes change (e.g. DELETE /api/documents/global)
+ALL = "all"
+
+
+class CorpusGenerations:
+    """Version counters of the documents a question can see.
+
+    Each cached answer is stored under the generations of the documents it
+    was built from, so changing documents only makes the answers over those
+    documents unreachable; they then expire with their TTL. The counters are:
+
+    - ``global``: any global document changed (questions without a commune
+      search every commune);
+    - ``commune:<name>``: global documents of this commune changed
+      (``commune:`` for documents that apply to every commune);
+    - ``session:<id>``: documents of this session changed;
+    - ``all``: global documents changed without knowing their commune.
+
+    The counters live in Redis, shared by every worker, or in this worker
+    only without Redis.
+    """
+
+    def __init__(self, redis_client=None, refresh: float = GENERATION_REFRESH):
+        self.redis = redis_client
+        self.refresh = refresh
+        self._values: Dict[str, int] = {}
+        self._fetched: Dict[str, float] = {}
+        self.bumps: Dict[str, int] = Counter()
+        self.reads = 0
+
+    @staticmethod
+    def names(session_id: Optional[str], commune: Optional[str]) -> List[str]:
+        """Counters covering what a question of ``session_id`` about ``commune`` can see."""
+        commune = normalize_commune(commune)
+        names = [ALL] + ([f"commune:{commune}", "commune:"] if commune else ["global"])
+        if session_id and session_id != GLOBAL_SESSION:
+            names.append(f"session:{session_id}")
+        return names
+
+    async def _get(self, names: List[str]) -> List[int]:
+        now = time.monotonic()
+        stale = [name for name in names if now - self._fetched.get(name, -self.refresh) >= self.refresh]
+        if stale and self.redis is not None:
+            self.reads += 1
+            try:
+                values = await self.redis.mget([f"{GENERATION_PREFIX}{name}" for name in stale])
+            except Exception as e:
+                logger.warning(f"⚠️ Générations du corpus illisibles: {e}")
+            else:
+                for name, value in zip(stale, values):
+                    self._values[name] = int(value or 0)
+                    self._fetched[name] = now
+        return [self._values.get(name, 0) for name in names]
+
+    async def generation(self, session_id: Optional[str], commune: Optional[str]) -> str:
+        """Cache key part identifying the documents visible to a question."""
+        return ".".join(str(value) for value in await self._get(self.names(session_id, commune)))
+
+    async def bump(self, names: Iterable[str]):
+        names = list(dict.fromkeys(names))
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for name in names:
+                        pipe.incr(f"{GENERATION_PREFIX}{name}")
+                    values = await pipe.execute()
+            except Exception as e:
+                logger.warning(f"⚠️ Générations du corpus non incrémentées: {e}")
+            else:
+                now = time.monotonic()
+                for name, value in zip(names, values):
+                    self._values[name] = int(value)
+                    self._fetched[name] = now
+                    self.bumps[name.split(":")[0]] += 1
+                return
+        for name in names:
+            self._values[name] = self._values.get(name, 0) + 1
+            self.bumps[name.split(":")[0]] += 1
+
+    async def indexed(self, session_id: Optional[str], commune: Optional[str]):
+        """Documents of ``session_id`` (global ones by default) about ``commune`` changed."""
+        if session_id and session_id != GLOBAL_SESSION:
+            await self.bump([f"session:{session_id}"])
+        else:
+            await self.bump(["global", f"commune:{normalize_commune(commune)}"])
+
+    async def deleted(self, session_ids: Iterable[str]):
+        """Documents of these sessions were deleted, whatever their commune."""
+        await self.bump([ALL if session_id == GLOBAL_SESSION else f"session:{session_id}"
+                         for session_id in session_ids])
+
+    def stats(self) -> Dict[str, Any]:
+        return {"bumps": dict(self.bumps), "reads": self.reads, "tracked": len(self._values)}
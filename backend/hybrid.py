@@ -0,0 +1,250 @@
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from scopes import matches_where
+
+logger = logging.getLogger(__name__)
+
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+RRF_K = int(os.getenv("RRF_K", 60))
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 150))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Metadata kept in a reverse index, so scoped searches only score the chunks in scope
+SCOPE_FIELDS = ("session_id", "commune")
+
+# Keeps regulatory tokens such as "r+3", "ub", "10" or "l.151-19" in one piece
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.+\-/][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a au aux avec ce ces dans de des du elle en est et il la le les leur mais ne "
+    "ou par pas peut pour qu que quel quelle quelles quels qui sa se ses son sont "
+    "sur un une y l d s n c j m t".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, accent-free tokens without French stopwords."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _TOKEN_RE.findall(text) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """In-memory inverted index kept in step with the Chroma collection.
+
+    Documents are added and removed by id as chunks are indexed or deleted,
+    so the index never needs a rebuild; scores are computed at query time
+    from the posting lists of the query terms only, restricted first to the
+    chunks whose ``SCOPE_FIELDS`` match the filter.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._lengths: Dict[str, int] = {}
+        self._documents: Dict[str, str] = {}
+        self._metadatas: Dict[str, Dict[str, Any]] = {}
+        # field -> value -> ids
+        self._scopes: Dict[str, Dict[Any, Set[str]]] = {field: defaultdict(set) for field in SCOPE_FIELDS}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, ids: Sequence[str], documents: Sequence[str],
+            metadatas: Optional[Sequence[Dict[str, Any]]] = None):
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                self._remove(doc_id)
+                terms = Counter(tokenize(document))
+                for term, tf in terms.items():
+                    self._postings[term][doc_id] = tf
+                length = sum(terms.values())
+                self._lengths[doc_id] = length
+                self._total_length += length
+                self._documents[doc_id] = document
+                self._set_metadata(doc_id, metadata)
+
+    def update_metadata(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]):
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                if doc_id in self._metadatas:
+                    self._unset_metadata(doc_id)
+                    self._set_metadata(doc_id, metadata)
+
+    def remove(self, ids: Iterable[str]):
+        with self._lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        document = self._documents.pop(doc_id, None)
+        if document is None:
+            return
+        for term in set(tokenize(document)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id)
+        self._unset_metadata(doc_id)
+
+    def _set_metadata(self, doc_id: str, metadata: Optional[Dict[str, Any]]):
+        metadata = self._metadatas[doc_id] = dict(metadata or {})
+        for field, values in self._scopes.items():
+            if field in metadata:
+                values[metadata[field]].add(doc_id)
+
+    def _unset_metadata(self, doc_id: str):
+        metadata = self._metadatas.pop(doc_id, None) or {}
+        for field, values in self._scopes.items():
+            ids = values.get(metadata.get(field))
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del values[metadata[field]]
+
+    def _in_scope(self, where: Dict[str, Any]) -> Optional[Set[str]]:
+        """Ids matching the ``SCOPE_FIELDS`` clauses of ``where`` (None: no such clause)."""
+        found: Optional[Set[str]] = None
+        for key, condition in where.items():
+            if key == "$and":
+                subsets = [self._in_scope(clause) for clause in condition]
+            elif key in self._scopes:
+                values = condition["$in"] if isinstance(condition, dict) and "$in" in condition else (
+                    [condition] if not isinstance(condition, dict) else None
+                )
+                if values is None:
+                    continue
+                subsets = [set().union(*(self._scopes[key].get(value, ()) for value in values))]
+            else:
+                continue
+            for subset in subsets:
+                if subset is not None:
+                    found = subset if found is None else found & subset
+        return found
+
+    def document(self, doc_id: str) -> Optional[str]:
+        return self._documents.get(doc_id)
+
+    def metadata(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self._metadatas.get(doc_id)
+
+    def search(self, query: str, top_k: int,
+               where: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """Best ``(id, score)`` pairs for ``query`` among documents matching ``where``."""
+        with self._lock:
+            n = len(self._lengths)
+            if not n:
+                return []
+            avgdl = self._total_length / n
+            scope = self._in_scope(where) if where else None
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                if scope is None:
+                    matches = postings.items()
+                elif len(scope) < len(postings):
+                    matches = [(doc_id, postings[doc_id]) for doc_id in scope if doc_id in postings]
+                else:
+                    matches = [(doc_id, tf) for doc_id, tf in postings.items() if doc_id in scope]
+                for doc_id, tf in matches:
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avgdl)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            if where:
+                # Clauses on other fields, e.g. expires_at
+                scores = {i: s for i, s in scores.items() if matches_where(where, self._metadatas[i])}
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+def rrf_scores(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> Dict[str, float]:
+    """Reciprocal rank fusion score of every id of several ranked lists."""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1 / (k + rank)
+    return dict(scores)
+
+
+def rrf_fuse(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[str]:
+    """Reciprocal rank fusion of several ranked id lists."""
+    scores = rrf_scores(rankings, k)
+    return sorted(scores, key=lambda doc_id: scores[doc_id], reverse=True)
+
+
+class Reranker:
+    """Optional cross-encoder rescoring of fused candidates under a time budget.
+
+    The model is only loaded when ``RERANK_MODEL`` is set and
+    sentence-transformers is installed. The observed cost per candidate
+    decides how many of the top candidates can be rescored within
+    ``RERANK_BUDGET_MS``; the rest keep their fused order.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, budget_ms: float = RERANK_BUDGET_MS, model=None):
+        self.model_name = model_name
+        self.budget = budget_ms / 1000
+        self.model = model
+        self.cost_per_candidate: Optional[float] = None
+        self.calls = 0
+        self.skipped = 0
+        self.total_seconds = 0.0
+        if self.model is None and model_name:
+            try:
+                from sentence_transformers import CrossEncoder
+                self.model = CrossEncoder(model_name)
+            except Exception as e:
+                logger.warning(f"⚠️ Reranker {model_name} indisponible: {e}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.model is not None
+
+    def rerank(self, query: str, candidates: List[Tuple[str, str]], top_k: int) -> List[Tuple[str, str]]:
+        """Reorder ``(id, text)`` candidates and keep ``top_k``."""
+        if not self.enabled or len(candidates) <= 1:
+            return candidates[:top_k]
+        budget_size = len(candidates)
+        if self.cost_per_candidate:
+            budget_size = int(self.budget / self.cost_per_candidate)
+        if budget_size < 2:
+            self.skipped += 1
+            return candidates[:top_k]
+
+        head, tail = candidates[:budget_size], candidates[budget_size:]
+        start = time.perf_counter()
+        scores = self.model.predict([(query, text) for _, text in head])
+        elapsed = time.perf_counter() - start
+
+        cost = elapsed / len(head)
+        self.cost_per_candidate = cost if self.cost_per_candidate is None else (
+            0.8 * self.cost_per_candidate + 0.2 * cost
+        )
+        self.calls += 1
+        self.total_seconds += elapsed
+        ranked = [c for _, c in sorted(zip(scores, head), key=lambda pair: pair[0], reverse=True)]
+        return (ranked + tail)[:top_k]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name if self.enabled else None,
+            "calls": self.calls,
+            "skipped": self.skipped,
+            "avg_ms": round(self.total_seconds / self.calls * 1000, 1) if self.calls else 0.0,
+        }
@@ -0,0 +1,140 @@
+"""Index a directory of documents offline.
+
+Walks ``directory`` for PDF, DOCX and TXT files and indexes them with the
+same pipeline as ``POST /api/upload/batch``: files are extracted in
+parallel, and their chunks are embedded and inserted into Chroma in large
+batches that span files::
+
+    python -m backend.ingest ./plu_saint_denis --commune "Saint-Denis"
+
+Files are identified by their path relative to ``directory``, so running
+the command again only re-embeds the chunks that changed.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from typing import List, Optional, Tuple
+
+# backend modules import each other by flat name (``from chunking import ...``)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from extraction import detect_doc_type  # noqa: E402
+from ingestion import BULK_EMBEDDING_BATCH_SIZE, IngestionBatch, IngestionManager, file_sha256  # noqa: E402
+
+PROGRESS_INTERVAL = 2.0
+
+
+def collect_files(directory: str) -> List[Tuple[str, str, str, int, str]]:
+    """``(filename, doc_type, path, size, doc_hash)`` of the supported files, sorted."""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            doc_type = detect_doc_type(name)
+            if not doc_type:
+                continue
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, directory).replace(os.sep, "/")
+            files.append((filename, doc_type, path, os.path.getsize(path), file_sha256(path)))
+    return files
+
+
+async def ingest(files: List[Tuple[str, str, str, int, str]], service, session_id: Optional[str] = None,
+                 commune: Optional[str] = None, batch_size: int = BULK_EMBEDDING_BATCH_SIZE,
+                 progress: bool = True) -> IngestionBatch:
+    """Index ``files`` in place through ``service`` and return the finished batch."""
+    manager = IngestionManager(service, bulk_batch_size=batch_size)
+    batch = manager.submit_batch(files, session_id, commune=commune, remove_files=False)
+    drained = asyncio.ensure_future(manager.drain())
+    try:
+        while not drained.done():
+            await asyncio.wait([drained], timeout=PROGRESS_INTERVAL)
+            if progress and not drained.done():
+                report = batch.report()
+                print(
+                    f"  {report['files_done'] + report['files_failed']}/{report['files']} fichiers, "
+                    f"{report['pages']} pages, {report['chunks']} chunks "
+                    f"({report['chunks_per_s']} chunks/s)",
+                    flush=True,
+                )
+        await drained
+    finally:
+        await manager.shutdown()
+    return batch
+
+
+async def bump_generations(session_id: Optional[str], commune: Optional[str]) -> bool:
+    """Tell the API workers, through Redis, that the documents of this scope changed."""
+    import redis.asyncio as aioredis
+    from generations import CorpusGenerations
+
+    client = aioredis.Redis(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        password=os.getenv("REDIS_PASSWORD", None),
+        decode_responses=True,
+    )
+    try:
+        await client.ping()
+        await CorpusGenerations(client).indexed(session_id, commune)
+        return True
+    except Exception:
+        return False
+    finally:
+        await client.close()
+
+
+def print_report(batch: IngestionBatch):
+    report = batch.report()
+    for job in batch.jobs:
+        if job.status == "failed":
+            print(f"  ❌ {job.filename}: {job.error}")
+    print(
+        f"{report['files_done']}/{report['files']} fichiers indexés en {report['elapsed']:.1f}s "
+        f"({report['files_failed']} échecs)\n"
+        f"  pages  : {report['pages']} ({report['pages_per_s']} pages/s)\n"
+        f"  chunks : {report['chunks']} ({report['chunks_per_s']} chunks/s), "
+        f"{report['chunks_added']} ajoutés, {report['chunks_unchanged']} inchangés, "
+        f"{report['embeddings_reused']} embeddings réutilisés\n"
+        f"  lots d'embeddings : {report['embed_batches']}"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--session", default=None, help="session cible (par défaut : documents globaux)")
+    parser.add_argument("--commune", default=None)
+    parser.add_argument("--batch-size", type=int, default=BULK_EMBEDDING_BATCH_SIZE,
+                        help="chunks par lot d'embeddings et d'insertion")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO)
+    files = collect_files(args.directory)
+    if not files:
+        print(f"Aucun document PDF, DOCX ou TXT dans {args.directory}")
+        return 1
+    print(f"{len(files)} documents à indexer depuis {args.directory}")
+
+    # Through the shared service when the API runs with RETRIEVAL_SERVICE_URL:
+    # a second process must not open the Chroma store
+    from retrieval import create_retrieval_service
+    service = create_retrieval_service()
+    service.warm_up()
+    try:
+        batch = asyncio.run(ingest(files, service, args.session, args.commune, args.batch_size,
+                                   progress=not args.quiet))
+    finally:
+        service.embedding_cache.flush()
+    print_report(batch)
+    if any(job.chunks_added or job.chunks_removed for job in batch.jobs):
+        if not asyncio.run(bump_generations(args.session, args.commune)):
+            print("⚠️ Redis injoignable : les réponses déjà en cache resteront servies jusqu'à CACHE_TTL")
+    return 1 if any(job.status == "failed" for job in batch.jobs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
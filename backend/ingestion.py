@@ -0,0 +1,640 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from chunking import StructuredChunker, content_hash
+from extraction import extract_file, extract_pdf_pages, pdf_page_count
+from metrics import UPLOAD_STAGES
+from scopes import GLOBAL_SESSION, normalize_commune, session_expiry
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", min(2, os.cpu_count() or 1)))
+MAX_PENDING_UPLOADS = int(os.getenv("MAX_PENDING_UPLOADS", 8))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+# Batches mix chunks of several files, so they can be much larger
+BULK_EMBEDDING_BATCH_SIZE = int(os.getenv("BULK_EMBEDDING_BATCH_SIZE", 256))
+BULK_FILES_IN_FLIGHT = int(os.getenv("BULK_FILES_IN_FLIGHT", max(1, EXTRACTION_WORKERS) * 2))
+PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 16))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+SPOOL_READ_SIZE = 1024 * 1024
+JOB_HISTORY_SIZE = 200
+
+
+class IngestionQueueFull(Exception):
+    """Raised when too many uploads are already waiting to be indexed."""
+
+
+async def spool_upload(file) -> Tuple[str, int, str]:
+    """Copy an ``UploadFile`` to a temporary file in fixed-size reads.
+
+    Returns the path, the number of bytes written and the SHA-256 of the
+    content; the caller owns the file.
+    """
+    suffix = os.path.splitext(file.filename or "")[1]
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = await file.read(SPOOL_READ_SIZE)
+                if not block:
+                    break
+                out.write(block)
+                digest.update(block)
+                size += len(block)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path, size, digest.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file on disk, read in the same blocks as uploads."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(SPOOL_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestionJob:
+    """Progress of one upload through extraction, chunking and embedding."""
+
+    def __init__(self, filename: str, doc_type: str, size: int, session_id: Optional[str],
+                 commune: Optional[str] = None, doc_hash: Optional[str] = None):
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.doc_type = doc_type
+        self.size = size
+        self.session_id = session_id
+        self.commune = commune
+        self.doc_hash = doc_hash
+        self.batch_id: Optional[str] = None
+        self.status = "queued"
+        self.pages_total = 0
+        self.pages_extracted = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        # Re-indexing summary against the chunks already stored for this file
+        self.chunks_unchanged = 0
+        self.chunks_added = 0
+        self.chunks_removed = 0
+        # Communes of the chunks added or removed, whose answers are now stale
+        self.communes_changed: Set[str] = set()
+        self.embeddings_reused = 0
+        self.stage_times: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.created_at = time.time()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "pages_total": self.pages_total,
+            "pages_extracted": self.pages_extracted,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "stage_times": dict(self.stage_times),
+            "elapsed": time.time() - self.created_at,
+            "error": self.error,
+            "result": self.result,
+        }
+
+
+class IngestionBatch:
+    """Several files indexed together, with a throughput report."""
+
+    def __init__(self, jobs: List[IngestionJob]):
+        self.batch_id = uuid.uuid4().hex
+        self.jobs = jobs
+        self.embed_batches = 0
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        for job in jobs:
+            job.batch_id = self.batch_id
+
+    @property
+    def finished(self) -> bool:
+        return all(job.finished for job in self.jobs)
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.created_at
+        pages = sum(job.pages_extracted for job in self.jobs)
+        chunks = sum(job.chunks_embedded for job in self.jobs)
+        return {
+            "files": len(self.jobs),
+            "files_done": sum(job.status == "done" for job in self.jobs),
+            "files_failed": sum(job.status == "failed" for job in self.jobs),
+            "pages": pages,
+            "chunks": chunks,
+            "chunks_added": sum(job.chunks_added for job in self.jobs),
+            "chunks_unchanged": sum(job.chunks_unchanged for job in self.jobs),
+            "embeddings_reused": sum(job.embeddings_reused for job in self.jobs),
+            "embed_batches": self.embed_batches,
+            "elapsed": round(elapsed, 3),
+            "pages_per_s": round(pages / elapsed, 1) if elapsed else 0.0,
+            "chunks_per_s": round(chunks / elapsed, 1) if elapsed else 0.0,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "batch_id": self.batch_id,
+            "status": "done" if self.finished else "running",
+            "jobs": [job.to_dict() for job in self.jobs],
+            "report": self.report(),
+        }
+
+
+class _File:
+    """Per-file state while a batch goes through the pipeline."""
+
+    def __init__(self, job: IngestionJob, path: str):
+        self.job = job
+        self.path = path
+        self.chunker = StructuredChunker()
+        self.existing: Dict[str, Dict[str, Any]] = {}
+        # Chunks stored by this run, by id, until the file is marked complete
+        self.seen: Dict[str, Dict[str, Any]] = {}
+        self.queued = 0
+
+
+class IngestionManager:
+    """Runs uploads in the background on bounded worker pools.
+
+    Text extraction is CPU bound and runs in a process pool; embedding and
+    ``collection.add`` run on a dedicated thread so the event loop stays free
+    for queries. The app passes its ``RetrievalService`` as ``collection`` so
+    the keyword index is updated along with Chroma.
+
+    Chunks are content-addressed: re-uploading a file to the same session
+    only embeds the chunks that changed and deletes the ones that
+    disappeared, an identical re-upload is not even extracted, and a chunk
+    already embedded for another session is copied with its stored vector.
+
+    Single uploads and batches (the batch endpoint and ``python -m
+    backend.ingest``) share one pipeline: files are extracted concurrently
+    and their chunks are embedded and inserted together, ``batch_size``
+    chunks at a time for a single upload and ``bulk_batch_size`` across
+    the files of a batch. ``on_indexed`` is awaited with each job whose
+    chunks changed.
+    """
+
+    def __init__(
+        self,
+        collection,
+        extract_executor: Optional[Executor] = None,
+        embed_executor: Optional[Executor] = None,
+        max_pending: int = MAX_PENDING_UPLOADS,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        bulk_batch_size: int = BULK_EMBEDDING_BATCH_SIZE,
+        on_indexed: Optional[Callable[[IngestionJob], Awaitable[None]]] = None,
+    ):
+        self.collection = collection
+        self.on_indexed = on_indexed
+        self._extract_executor = extract_executor or ProcessPoolExecutor(
+            max_workers=EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._embed_executor = embed_executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="embedding"
+        )
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.bulk_batch_size = bulk_batch_size
+        self.jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self.batches: "OrderedDict[str, IngestionBatch]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def pending(self) -> int:
+        """Uploads still running; a batch counts as one."""
+        return len({job.batch_id or job.job_id for job in self.jobs.values() if not job.finished})
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self.jobs.get(job_id)
+
+    def get_batch(self, batch_id: str) -> Optional[IngestionBatch]:
+        return self.batches.get(batch_id)
+
+    def submit(self, filename: str, doc_type: str, path: str, size: int, session_id: Optional[str],
+               commune: Optional[str] = None, doc_hash: Optional[str] = None) -> IngestionJob:
+        """Register a spooled upload and start processing it in the background.
+
+        The job takes ownership of ``path`` and deletes it once indexed.
+        """
+        if self.pending() >= self.max_pending:
+            raise IngestionQueueFull(f"{self.max_pending} uploads déjà en cours")
+
+        job = IngestionJob(filename, doc_type, size, session_id, commune, doc_hash)
+        self.jobs[job.job_id] = job
+        self._prune()
+        self._start(job.job_id, self._run([_File(job, path)], self.batch_size))
+        return job
+
+    def submit_batch(self, files: List[Tuple[str, str, str, int, Optional[str]]], session_id: Optional[str],
+                     commune: Optional[str] = None, remove_files: bool = True) -> IngestionBatch:
+        """Index ``(filename, doc_type, path, size, doc_hash)`` files as one batch.
+
+        With ``remove_files`` the batch takes ownership of the paths, as
+        :meth:`submit` does; the CLI indexes files in place and keeps them.
+        """
+        if self.pending() >= self.max_pending:
+            raise IngestionQueueFull(f"{self.max_pending} uploads déjà en cours")
+
+        items = []
+        for filename, doc_type, path, size, doc_hash in files:
+            job = IngestionJob(filename, doc_type, size, session_id, commune, doc_hash)
+            self.jobs[job.job_id] = job
+            items.append(_File(job, path))
+        batch = IngestionBatch([item.job for item in items])
+        self.batches[batch.batch_id] = batch
+        self._prune()
+        self._start(batch.batch_id, self._run(items, self.bulk_batch_size, batch, remove_files))
+        return batch
+
+    def _start(self, key: str, coro):
+        task = asyncio.create_task(coro)
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    async def drain(self):
+        """Wait for every running upload and batch to finish."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, files: List[_File], batch_size: int, batch: Optional[IngestionBatch] = None,
+                   remove_files: bool = True):
+        upload_date = datetime.now().isoformat()
+        loop = asyncio.get_running_loop()
+        producers: List[asyncio.Task] = []
+        try:
+            active = []
+            for file in files:
+                file.job.stage_times = {"extraction": 0.0, "chunking": 0.0, "embedding": 0.0}
+                try:
+                    file.existing = await loop.run_in_executor(self._embed_executor, self._existing, file.job)
+                except Exception as e:
+                    self._fail(file.job, e)
+                    continue
+                if self._is_unchanged(file.job, file.existing):
+                    job = file.job
+                    await loop.run_in_executor(self._embed_executor, self._refresh_expiry, job, file.existing)
+                    job.chunks_total = job.chunks_embedded = job.chunks_unchanged = len(file.existing)
+                    job.result = self._result(job, upload_date)
+                    job.status = "done"
+                    logger.info(f"📄 {job.filename} inchangé, {len(file.existing)} chunks conservés")
+                else:
+                    active.append(file)
+
+            # Chunks of every file go through one queue so embedding batches
+            # can span files; the bounded queue holds extraction back when
+            # embedding is the bottleneck.
+            queue: asyncio.Queue = asyncio.Queue(maxsize=batch_size * 2)
+            slots = asyncio.Semaphore(BULK_FILES_IN_FLIGHT)
+            producers = [asyncio.create_task(self._extract(file, queue, slots)) for file in active]
+
+            pending: List[Tuple[_File, str, int]] = []
+            closing: List[_File] = []
+            open_files = len(active)
+            while open_files:
+                file, chunk, page = await queue.get()
+                if chunk is not None:
+                    pending.append((file, chunk, page))
+                elif any(entry[0] is file for entry in pending):
+                    open_files -= 1
+                    closing.append(file)
+                else:
+                    open_files -= 1
+                    await self._finish(file, upload_date)
+                if len(pending) >= batch_size:
+                    await self._index(pending[:batch_size], upload_date, batch)
+                    del pending[:batch_size]
+                    for file in [f for f in closing if not any(entry[0] is f for entry in pending)]:
+                        closing.remove(file)
+                        await self._finish(file, upload_date)
+            while pending:
+                await self._index(pending[:batch_size], upload_date, batch)
+                del pending[:batch_size]
+            for file in closing:
+                await self._finish(file, upload_date)
+        except Exception as e:
+            for file in files:
+                if not file.job.finished:
+                    self._fail(file.job, e)
+        finally:
+            for task in producers:
+                task.cancel()
+            if remove_files:
+                for file in files:
+                    try:
+                        os.unlink(file.path)
+                    except OSError:
+                        pass
+            if batch is not None:
+                batch.finished_at = time.time()
+                report = batch.report()
+                logger.info(
+                    f"📚 Lot de {report['files']} fichiers indexé en {report['elapsed']:.2f}s: "
+                    f"{report['pages']} pages ({report['pages_per_s']}/s), "
+                    f"{report['chunks']} chunks ({report['chunks_per_s']}/s), "
+                    f"{report['embed_batches']} lots d'embeddings, {report['files_failed']} échecs"
+                )
+
+    async def _extract(self, file: _File, queue: asyncio.Queue, slots: asyncio.Semaphore):
+        """Extract and chunk one file into ``queue``, then put an end marker."""
+        job = file.job
+        try:
+            async with slots:
+                job.status = "extracting"
+                async for page_number, text in self._iter_pages(job, file.path):
+                    job.pages_extracted += 1
+                    start = time.perf_counter()
+                    chunks = file.chunker.feed(page_number, text)
+                    job.stage_times["chunking"] += time.perf_counter() - start
+                    for chunk, page in chunks:
+                        file.queued += 1
+                        await queue.put((file, chunk, page))
+
+                chunks = file.chunker.flush()
+                if file.queued == 0 and not any(chunk.strip() for chunk, _ in chunks):
+                    raise ValueError("Impossible d'extraire le texte")
+                for chunk, page in chunks:
+                    file.queued += 1
+                    await queue.put((file, chunk, page))
+        except Exception as e:
+            self._fail(job, e)
+        # Not on cancellation: the consumer is gone and the bounded queue may never drain
+        await queue.put((file, None, 0))
+
+    async def _finish(self, file: _File, upload_date: str):
+        """Delete the chunks that disappeared from the file and mark it done."""
+        job = file.job
+        if job.finished:
+            return
+        loop = asyncio.get_running_loop()
+        stale = [doc_id for doc_id in file.existing if doc_id not in file.seen]
+        if stale:
+            await loop.run_in_executor(self._embed_executor, lambda: self.collection.delete(ids=stale))
+        job.chunks_removed = len(stale)
+        job.communes_changed.update(file.existing[doc_id].get("commune", "") for doc_id in stale)
+        if job.doc_hash and file.seen:
+            await loop.run_in_executor(self._embed_executor, self._mark_complete, job, file.seen)
+
+        job.result = self._result(job, upload_date)
+        job.status = "done"
+        self._observe(job)
+        if self.on_indexed is not None and (job.chunks_added or job.chunks_removed):
+            try:
+                await self.on_indexed(job)
+            except Exception as e:
+                logger.warning(f"⚠️ Notification de fin d'indexation impossible: {e}")
+        logger.info(
+            f"📄 {job.filename} indexé: {job.pages_extracted} pages, "
+            f"{job.chunks_embedded} chunks en {time.time() - job.created_at:.2f}s "
+            f"({job.chunks_unchanged} inchangés, {job.chunks_added} ajoutés, "
+            f"{job.chunks_removed} supprimés, {job.embeddings_reused} embeddings réutilisés; "
+            f"{file.chunker.duplicates} doublons, {file.chunker.boilerplate_lines} lignes d'en-tête ignorés)"
+        )
+
+    @staticmethod
+    def _observe(job: IngestionJob):
+        for name, seconds in job.stage_times.items():
+            UPLOAD_STAGES.labels(stage="indexing" if name == "embedding" else name).observe(seconds)
+        UPLOAD_STAGES.labels(stage="total").observe(time.time() - job.created_at)
+
+    @staticmethod
+    def _fail(job: IngestionJob, error: Exception):
+        job.status = "failed"
+        job.error = str(error)
+        logger.error(f"Erreur upload {job.filename}: {error}")
+
+    async def _iter_pages(self, job: IngestionJob, path: str) -> AsyncIterator[Tuple[int, str]]:
+        """Yield ``(page_number, text)`` in order, extracting PDF page ranges in parallel.
+
+        At most two ranges per worker are in flight, so memory does not grow
+        with the size of the document.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def timed(future):
+            start = time.perf_counter()
+            result = await future
+            job.stage_times["extraction"] += time.perf_counter() - start
+            return result
+
+        if job.doc_type != "pdf":
+            job.pages_total = 1
+            yield 1, await timed(loop.run_in_executor(self._extract_executor, extract_file, job.doc_type, path))
+            return
+
+        job.pages_total = await timed(loop.run_in_executor(self._extract_executor, pdf_page_count, path))
+        window = max(1, EXTRACTION_WORKERS) * 2
+        in_flight = deque()
+        page_number = 1
+        for start in range(0, job.pages_total, PAGES_PER_TASK):
+            stop = min(start + PAGES_PER_TASK, job.pages_total)
+            in_flight.append(loop.run_in_executor(self._extract_executor, extract_pdf_pages, path, start, stop))
+            if len(in_flight) < window:
+                continue
+            for text in await timed(in_flight.popleft()):
+                yield page_number, text
+                page_number += 1
+        while in_flight:
+            for text in await timed(in_flight.popleft()):
+                yield page_number, text
+                page_number += 1
+
+    def _result(self, job: IngestionJob, upload_date: str) -> Dict[str, Any]:
+        return {
+            "filename": job.filename,
+            "doc_type": job.doc_type,
+            "size": job.size,
+            "chunks": job.chunks_total,
+            "upload_date": upload_date,
+            "unchanged": job.chunks_unchanged,
+            "added": job.chunks_added,
+            "removed": job.chunks_removed,
+        }
+
+    def _existing(self, job: IngestionJob) -> Dict[str, Dict[str, Any]]:
+        """Chunks already stored for this file in this session and commune, by id.
+
+        The same filename can hold another document in another commune (each
+        commune has its own ``reglement.pdf``), which must be left alone.
+        """
+        found = self.collection.get(
+            where={"$and": [
+                {"session_id": job.session_id or GLOBAL_SESSION},
+                {"commune": normalize_commune(job.commune)},
+                {"filename": job.filename},
+            ]},
+            include=["metadatas"],
+        )
+        return dict(zip(found.get("ids") or [], found.get("metadatas") or []))
+
+    def _refresh_expiry(self, job: IngestionJob, existing: Dict[str, Dict[str, Any]]):
+        """Push back the expiry of a session file uploaded again unchanged."""
+        expires_at = session_expiry(job.session_id)
+        if expires_at is not None and existing:
+            self.collection.update(
+                ids=list(existing),
+                metadatas=[{**meta, "expires_at": expires_at} for meta in existing.values()],
+            )
+
+    def _mark_complete(self, job: IngestionJob, stored: Dict[str, Dict[str, Any]]):
+        """Tag every chunk of the file with its hash once all of them are stored.
+
+        Chunks are written without it, so a job that fails or is cancelled
+        halfway never makes a re-upload of the same file look unchanged.
+        """
+        self.collection.update(
+            ids=list(stored),
+            metadatas=[{**meta, "doc_hash": job.doc_hash} for meta in stored.values()],
+        )
+
+    @staticmethod
+    def _is_unchanged(job: IngestionJob, existing: Dict[str, Dict[str, Any]]) -> bool:
+        return bool(job.doc_hash and existing) and all(
+            meta.get("doc_hash") == job.doc_hash for meta in existing.values()
+        )
+
+    async def _index(self, entries: List[Tuple[_File, str, int]], upload_date: str,
+                     batch: Optional[IngestionBatch] = None):
+        """Embed and store one batch of ``(file, chunk, page)``, possibly from several files."""
+        entries = [entry for entry in entries if not entry[0].job.finished]
+        if not entries:
+            return
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        documents: List[str] = []
+        ids: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        known: Set[str] = set()
+        for file, chunk, page in entries:
+            file.job.status = "embedding"
+            (doc_id,), (metadata,) = self._describe(file.job, file.job.chunks_total, [(chunk, page)], upload_date)
+            file.job.chunks_total += 1
+            file.seen[doc_id] = metadata
+            if doc_id in file.existing:
+                known.add(doc_id)
+            documents.append(chunk)
+            ids.append(doc_id)
+            metadatas.append(metadata)
+        try:
+            copied = await loop.run_in_executor(
+                self._embed_executor, self._store, documents, ids, metadatas, known
+            )
+        except Exception as e:
+            for file, _, _ in entries:
+                if not file.job.finished:
+                    self._fail(file.job, e)
+            return
+        if batch is not None:
+            batch.embed_batches += 1
+
+        share = (time.perf_counter() - start) / len(entries)
+        for (file, _, _), doc_id, metadata in zip(entries, ids, metadatas):
+            job = file.job
+            if doc_id in known:
+                job.chunks_unchanged += 1
+            else:
+                job.chunks_added += 1
+                job.communes_changed.add(metadata["commune"])
+            if metadata["chunk_hash"] in copied:
+                job.embeddings_reused += 1
+            job.chunks_embedded += 1
+            job.stage_times["embedding"] += share
+
+    def _describe(self, job: IngestionJob, offset: int, chunks: List[Tuple[str, int]], upload_date: str):
+        session = job.session_id or GLOBAL_SESSION
+        commune = normalize_commune(job.commune)
+        scope = f"{session}_{commune}" if commune else session
+        expires_at = session_expiry(session)
+        ids: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        for i, (chunk, page) in enumerate(chunks, start=offset):
+            chunk_hash = content_hash(chunk)
+            ids.append(f"{job.filename}_{chunk_hash[:16]}_{scope}")
+            metadatas.append({
+                "filename": job.filename,
+                "chunk_index": i,
+                "page": page,
+                "session_id": session,
+                "commune": commune,
+                "upload_date": upload_date,
+                # Set by _mark_complete once the whole file is stored
+                "doc_hash": "",
+                "chunk_hash": chunk_hash,
+            })
+            if expires_at is not None:
+                metadatas[-1]["expires_at"] = expires_at
+        return ids, metadatas
+
+    def _store(self, documents: List[str], ids: List[str], metadatas: List[Dict[str, Any]],
+               existing: Set[str]) -> Set[str]:
+        """Write one batch: refresh known chunks, embed only the new ones.
+
+        Returns the hashes of the new chunks stored with an existing vector.
+        """
+        known = [i for i, doc_id in enumerate(ids) if doc_id in existing]
+        if known:
+            self.collection.update(ids=[ids[i] for i in known], metadatas=[metadatas[i] for i in known])
+
+        new = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+        vectors = self._stored_embeddings([metadatas[i]["chunk_hash"] for i in new]) if new else {}
+        copied = [i for i in new if metadatas[i]["chunk_hash"] in vectors]
+        fresh = [i for i in new if metadatas[i]["chunk_hash"] not in vectors]
+        if copied:
+            self.collection.add(
+                documents=[documents[i] for i in copied],
+                ids=[ids[i] for i in copied],
+                metadatas=[metadatas[i] for i in copied],
+                embeddings=[vectors[metadatas[i]["chunk_hash"]] for i in copied],
+            )
+        if fresh:
+            self.collection.add(
+                documents=[documents[i] for i in fresh],
+                ids=[ids[i] for i in fresh],
+                metadatas=[metadatas[i] for i in fresh],
+            )
+        return {metadatas[i]["chunk_hash"] for i in copied}
+
+    def _stored_embeddings(self, hashes: List[str]) -> Dict[str, Any]:
+        """Vectors already computed for these chunk contents, in any session."""
+        found = self.collection.get(
+            where={"chunk_hash": {"$in": hashes}}, include=["embeddings", "metadatas"]
+        )
+        embeddings = found.get("embeddings")
+        if embeddings is None:
+            return {}
+        return {meta["chunk_hash"]: vector for meta, vector in zip(found.get("metadatas") or [], embeddings)}
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        while len(self.jobs) > JOB_HISTORY_SIZE and finished:
+            self.jobs.pop(finished.pop(0), None)
+        finished = [batch_id for batch_id, batch in self.batches.items() if batch.finished]
+        while len(self.batches) > JOB_HISTORY_SIZE and finished:
+            self.batches.pop(finished.pop(0), None)
+
+    async def shutdown(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self._extract_executor.shutdown(wait=False, cancel_futures=True)
+        self._embed_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Mapping, Optional, Set, Tuple
+
+from periodic import cancel, periodic
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS_PREFIX = "urbanisme:jobs:"
+JOB_STATUS_INTERVAL = float(os.getenv("JOB_STATUS_INTERVAL", 1.0))
+# Seconds a finished job can still be looked up from another worker
+JOB_STATUS_TTL = int(os.getenv("JOB_STATUS_TTL", 3600))
+
+
+class JobBoard:
+    """Upload and deletion progress shared by the workers through Redis.
+
+    A job runs in the worker that received it, but its status can be asked
+    of any worker. Each worker writes its jobs to Redis when they start,
+    then every ``interval`` seconds until they finish; a worker that does
+    not know a job reads it there. Without Redis only local jobs are found.
+    """
+
+    def __init__(self, redis_client=None, interval: float = JOB_STATUS_INTERVAL, ttl: int = JOB_STATUS_TTL):
+        self.redis = redis_client
+        self.interval = interval
+        self.ttl = ttl
+        self._sources: Dict[str, Callable[[], Mapping[str, Any]]] = {}
+        # Finished jobs already written with their final status
+        self._final: Set[Tuple[str, str]] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, kind: str, jobs: Callable[[], Mapping[str, Any]]):
+        """Publish the jobs (``to_dict()`` and ``finished``) returned by ``jobs``, by id."""
+        self._sources[kind] = jobs
+
+    @staticmethod
+    def _key(kind: str, job_id: str) -> str:
+        return f"{JOB_STATUS_PREFIX}{kind}:{job_id}"
+
+    async def _write(self, entries: Dict[Tuple[str, str], Dict[str, Any]]) -> bool:
+        if self.redis is None or not entries:
+            return False
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for (kind, job_id), data in entries.items():
+                    pipe.set(self._key(kind, job_id), json.dumps(data), ex=self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Statut des jobs non partagé: {e}")
+            return False
+        return True
+
+    async def publish(self, kind: str, job_id: str, job):
+        """Write one job now, e.g. before answering the request that started it."""
+        if await self._write({(kind, job_id): job.to_dict()}) and job.finished:
+            self._final.add((kind, job_id))
+
+    async def flush(self):
+        if self.redis is None:
+            return
+        entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        finished: Set[Tuple[str, str]] = set()
+        for kind, source in self._sources.items():
+            for job_id, job in list(source().items()):
+                if (kind, job_id) in self._final:
+                    continue
+                entries[(kind, job_id)] = job.to_dict()
+                if job.finished:
+                    finished.add((kind, job_id))
+        if await self._write(entries):
+            self._final.update(finished)
+        # Forget the jobs pruned from the local history
+        live = {(kind, job_id) for kind, source in self._sources.items() for job_id in source()}
+        self._final &= live
+
+    async def get(self, kind: str, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status written by any worker, or None."""
+        if self.redis is None:
+            return None
+        try:
+            raw = await self.redis.get(self._key(kind, job_id))
+        except Exception as e:
+            logger.warning(f"⚠️ Statut du job {job_id} illisible: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def start(self):
+        if self.redis is not None and self._task is None:
+            self._task = periodic(self.interval, self.flush)
+
+    async def stop(self):
+        await cancel(self._task)
+        self._task = None
+        await self.flush()
@@ -0,0 +1,273 @@
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+# Quota of the Groq account, split evenly between the uvicorn workers
+# (WEB_CONCURRENCY): each one only knows its own bucket
+GROQ_REQUESTS_PER_MINUTE = float(os.getenv("GROQ_REQUESTS_PER_MINUTE", 30))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", 4))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", 3))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+# h2 is only needed for HTTP/2; without it httpx falls back to HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class TokenBucket:
+    """Async token bucket: callers wait in FIFO order instead of failing."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute / 6)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Take one token, sleeping until one is available. Returns the wait in seconds."""
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return time.monotonic() - start
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class LLMMetrics:
+    """Per-call latency and outcome counters for the LLM client."""
+
+    def __init__(self, window: int = 500):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.queue_wait = 0.0
+        self.latencies: deque = deque(maxlen=window)
+        self.first_token_latencies: deque = deque(maxlen=window)
+
+    def record(self, latency: float, ok: bool):
+        self.calls += 1
+        if ok:
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+
+    def summary(self) -> Dict[str, Any]:
+        def pct(values, p: float) -> Optional[float]:
+            ordered = sorted(values)
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3)
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "queue_wait_total": round(self.queue_wait, 3),
+            "latency_p50": pct(self.latencies, 0.50),
+            "latency_p95": pct(self.latencies, 0.95),
+            "first_token_p50": pct(self.first_token_latencies, 0.50),
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return the delay requested by a ``Retry-After`` header, in seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class GroqClient:
+    """App-lifetime Groq client with keep-alive pooling, rate limiting and retries."""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = GROQ_BASE_URL,
+        requests_per_minute: float = GROQ_REQUESTS_PER_MINUTE / WEB_CONCURRENCY,
+        max_concurrency: int = GROQ_MAX_CONCURRENCY,
+        max_retries: int = GROQ_MAX_RETRIES,
+        timeout: float = 60.0,
+        transport=None,
+    ):
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.metrics = LLMMetrics()
+        self._bucket = TokenBucket(requests_per_minute)
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_concurrency * 2, max_keepalive_connections=max_concurrency),
+            http2=HTTP2_AVAILABLE and transport is None,
+            transport=transport,
+        )
+
+    async def reserve(self) -> float:
+        """Take the rate-limit token of the next call made with ``reserved=True``.
+
+        Returns the wait, so callers can keep queueing out of the latency
+        they measure.
+        """
+        wait = await self._bucket.acquire()
+        self.metrics.queue_wait += wait
+        return wait
+
+    async def chat(self, payload: Dict[str, Any], reserved: bool = False) -> Dict[str, Any]:
+        """POST a chat completion, retrying 429/5xx responses with jittered backoff."""
+        attempt = 0
+        while True:
+            if reserved:
+                reserved = False
+            else:
+                self.metrics.queue_wait += await self._bucket.acquire()
+            start = time.perf_counter()
+            try:
+                async with self._concurrency:
+                    response = await self._client.post("/chat/completions", json=payload)
+            except httpx.TransportError as e:
+                self.metrics.record(time.perf_counter() - start, ok=False)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, None)
+                logger.warning(f"⚠️ Groq injoignable ({e}), nouvel essai dans {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    self.metrics.record(time.perf_counter() - start, ok=response.status_code < 400)
+                    response.raise_for_status()
+                    return response.json()
+                self.metrics.record(time.perf_counter() - start, ok=False)
+                delay = self._backoff(attempt, response.headers.get("retry-after"))
+                logger.warning(f"⚠️ Groq HTTP {response.status_code}, nouvel essai dans {delay:.1f}s")
+            attempt += 1
+            self.metrics.retries += 1
+            await asyncio.sleep(delay)
+
+    async def stream_chat(self, payload: Dict[str, Any], reserved: bool = False) -> AsyncIterator[str]:
+        """Stream a chat completion, yielding content deltas as Groq emits them.
+
+        Retries follow :meth:`chat` but only happen before the first token.
+        """
+        attempt = 0
+        emitted = False
+        while True:
+            if reserved:
+                reserved = False
+            else:
+                self.metrics.queue_wait += await self._bucket.acquire()
+            start = time.perf_counter()
+            delay = None
+            async with self._concurrency:
+                try:
+                    async with self._client.stream(
+                        "POST", "/chat/completions", json={**payload, "stream": True}
+                    ) as response:
+                        if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                            delay = self._backoff(attempt, response.headers.get("retry-after"))
+                            logger.warning(f"⚠️ Groq HTTP {response.status_code}, nouvel essai dans {delay:.1f}s")
+                        else:
+                            if response.status_code >= 400:
+                                await response.aread()
+                            response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:"):].strip()
+                                if data == "[DONE]":
+                                    break
+                                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                                if not delta:
+                                    continue
+                                if not emitted:
+                                    self.metrics.first_token_latencies.append(time.perf_counter() - start)
+                                    emitted = True
+                                yield delta
+                            self.metrics.record(time.perf_counter() - start, ok=True)
+                            return
+                except httpx.TransportError as e:
+                    if emitted or attempt >= self.max_retries:
+                        self.metrics.record(time.perf_counter() - start, ok=False)
+                        raise
+                    delay = self._backoff(attempt, None)
+                    logger.warning(f"⚠️ Groq injoignable ({e}), nouvel essai dans {delay:.1f}s")
+                except httpx.HTTPStatusError:
+                    self.metrics.record(time.perf_counter() - start, ok=False)
+                    raise
+            self.metrics.record(time.perf_counter() - start, ok=False)
+            attempt += 1
+            self.metrics.retries += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: Optional[str]) -> float:
+        requested = parse_retry_after(retry_after)
+        if requested is not None:
+            # Honour the server's delay and spread the retries a little
+            return min(RETRY_MAX_DELAY, requested) + random.uniform(0, RETRY_BASE_DELAY)
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_client: Optional[GroqClient] = None
+
+
+def get_llm_client(api_key: str) -> GroqClient:
+    """Return the shared client, creating it on first use outside the app."""
+    global _client
+    if _client is None or _client.api_key != api_key:
+        _client = GroqClient(api_key)
+    return _client
+
+
+def set_llm_client(client: Optional[GroqClient]):
+    """Install (or clear) the shared client; called by the app lifespan."""
+    global _client
+    _client = client
+
+
+def build_messages(question: str, context: str) -> List[Dict[str, str]]:
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "Tu es un assistant expert en urbanisme et architecture. "
+                "Utilise le contexte fourni pour répondre de manière précise."
+            ),
+        }
+    ]
+    if context:
+        messages.append({"role": "user", "content": f"Contexte:\n{context}\n\nQuestion: {question}"})
+    else:
+        messages.append({"role": "user", "content": question})
+    return messages
@@ -0,0 +1,322 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from chunking import count_tokens
+from llm_client import GroqClient, build_messages
+from metrics import LLM_CALLS, LLM_LATENCY, LLM_ROUTES, LLM_THROUGHPUT, record, record_tokens
+
+logger = logging.getLogger(__name__)
+
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "llama-3.1-8b-instant")
+LLM_LARGE_MODEL = os.getenv("LLM_LARGE_MODEL", "llama-3.3-70b-versatile")
+LLM_FAST_MAX_TOKENS = int(os.getenv("LLM_FAST_MAX_TOKENS", 512))
+LLM_LARGE_MAX_TOKENS = int(os.getenv("LLM_LARGE_MAX_TOKENS", 1024))
+# Seconds an answer may take, fallbacks included (until the first token when streaming)
+LLM_LATENCY_SLO = float(os.getenv("LLM_LATENCY_SLO", 8))
+# Short questions over a small context go to the fast model
+LLM_ROUTE_QUESTION_CHARS = int(os.getenv("LLM_ROUTE_QUESTION_CHARS", 160))
+LLM_ROUTE_CONTEXT_TOKENS = int(os.getenv("LLM_ROUTE_CONTEXT_TOKENS", 400))
+# The large model is avoided while its typical latency is above this share of the SLO...
+LLM_SLOW_RATIO = float(os.getenv("LLM_SLOW_RATIO", 0.6))
+# ...except for one question in LLM_PROBE_EVERY, to notice when it is fast again
+LLM_PROBE_EVERY = int(os.getenv("LLM_PROBE_EVERY", 10))
+LATENCY_ALPHA = 0.2
+# Time kept for the fast model before its latency was observed
+INITIAL_FAST_LATENCY = 1.0
+OFFLINE_MODEL = "simulation"
+
+
+def generate_mock_response(question: str) -> str:
+    """Génère des réponses simulées améliorées"""
+    q_lower = question.lower()
+
+    # Base de réponses plus élaborées
+    responses = {
+        "hauteur": """D'après la réglementation en vigueur :
+
+        • Zone UA (centre-ville) : 15m max (R+4)
+        • Zone UB (urbain mixte) : 12m max (R+3)
+        • Zone UC (pavillonnaire) : 9m max (R+2)
+        • Zone UE (activités) : 12m max sauf dérogation
+
+        La hauteur se mesure depuis le terrain naturel jusqu'au faîtage.""",
+
+        "emprise": """L'emprise au sol maximale autorisée :
+
+        • Zone UA : 80% de la parcelle
+        • Zone UB : 60% de la parcelle
+        • Zone UC : 40% de la parcelle
+        • Zone N/A : 20% maximum
+
+        Incluant toutes constructions et annexes.""",
+
+        "recul": """Les règles de recul obligatoires :
+
+        • Voirie : 5m minimum (3m en UA)
+        • Limites séparatives : H/2 min 3m
+        • Fond de parcelle : 5m minimum
+        • Entre bâtiments : H+3m minimum""",
+
+        "default": """Je peux vous aider sur :
+
+        • Règles de hauteur et gabarit
+        • Emprise au sol et COS
+        • Distances et prospects
+        • Zonage PLU/PLUi
+        • Autorisations d'urbanisme
+
+        Précisez votre question ou uploadez vos documents PLU."""
+    }
+
+    for key, response in responses.items():
+        if key in q_lower:
+            return response
+
+    return responses["default"]
+
+
+class ModelStats:
+    """Latency and token throughput observed for one model."""
+
+    def __init__(self, model: str, window: int = 500):
+        self.model = model
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        # Exponential moving average, timeouts included, used for routing
+        self.latency: Optional[float] = None
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.throughputs: Deque[float] = deque(maxlen=window)
+
+    def _smooth(self, seconds: float):
+        self.latency = seconds if self.latency is None else self.latency + LATENCY_ALPHA * (seconds - self.latency)
+
+    def observe(self, seconds: float, completion_tokens: int):
+        self.calls += 1
+        self._smooth(seconds)
+        self.latencies.append(seconds)
+        LLM_CALLS.labels(model=self.model, outcome="ok").inc()
+        LLM_LATENCY.labels(model=self.model).observe(seconds)
+        if seconds > 0 and completion_tokens:
+            self.throughputs.append(completion_tokens / seconds)
+            LLM_THROUGHPUT.labels(model=self.model).observe(completion_tokens / seconds)
+
+    def failed(self, seconds: float, timeout: bool):
+        self.calls += 1
+        if timeout:
+            self.timeouts += 1
+            # The model took at least this long
+            self._smooth(seconds)
+        else:
+            self.errors += 1
+        LLM_CALLS.labels(model=self.model, outcome="timeout" if timeout else "error").inc()
+
+    def summary(self) -> Dict[str, Any]:
+        def p50(values) -> Optional[float]:
+            ordered = sorted(values)
+            return round(ordered[len(ordered) // 2], 3) if ordered else None
+
+        return {
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "latency_avg": round(self.latency, 3) if self.latency is not None else None,
+            "latency_p50": p50(self.latencies),
+            "tokens_per_second_p50": p50(self.throughputs),
+        }
+
+
+class LLMAnswer:
+    """Text of an answer, the model that wrote it and why that model was used."""
+
+    def __init__(self):
+        self.text = ""
+        self.model = ""
+        self.reason = ""
+        # "fast" when the fast model stood in for the large one, "offline" for the simulated answer
+        self.fallback: Optional[str] = None
+
+    @property
+    def offline(self) -> bool:
+        return self.fallback == "offline"
+
+
+class ModelRouter:
+    """Sends each question to a fast small model or a larger one.
+
+    Short questions over a small context go to the fast model, the others to
+    the large one unless its recent latency is too close to the SLO. A call
+    that misses the SLO, or fails, falls back to the fast model (the large
+    model's call is cut early enough to leave it the time it usually takes),
+    then to the offline answer. Without a client every answer is offline.
+
+    The wait for the client's rate limiter is not the model's latency: it
+    moves the deadline back and stays out of the latency statistics, so
+    quota pressure does not push questions to the fast model.
+    """
+
+    def __init__(self, fast_model: str = LLM_FAST_MODEL, large_model: str = LLM_LARGE_MODEL,
+                 slo: float = LLM_LATENCY_SLO, question_chars: int = LLM_ROUTE_QUESTION_CHARS,
+                 context_tokens: int = LLM_ROUTE_CONTEXT_TOKENS, slow_ratio: float = LLM_SLOW_RATIO,
+                 probe_every: int = LLM_PROBE_EVERY,
+                 offline: Callable[[str], str] = generate_mock_response):
+        self.fast_model = fast_model
+        self.large_model = large_model
+        self.slo = slo
+        self.question_chars = question_chars
+        self.context_tokens = context_tokens
+        self.slow_ratio = slow_ratio
+        self.probe_every = max(1, probe_every)
+        self.offline = offline
+        self.max_tokens = {large_model: LLM_LARGE_MAX_TOKENS, fast_model: LLM_FAST_MAX_TOKENS}
+        self.models = {model: ModelStats(model) for model in (fast_model, large_model)}
+        self.routes: Dict[str, int] = Counter()
+        self.fallbacks: Dict[str, int] = Counter()
+        self.queue_wait = 0.0
+        self._avoided = 0
+
+    def choose(self, question: str, context: str) -> Tuple[str, str]:
+        """``(model, reason)`` for a question and its retrieved context."""
+        if self.large_model == self.fast_model:
+            return self.fast_model, "single"
+        if len(question) <= self.question_chars and count_tokens(context) <= self.context_tokens:
+            return self.fast_model, "simple"
+        latency = self.models[self.large_model].latency
+        if latency is not None and latency > self.slo * self.slow_ratio:
+            self._avoided += 1
+            if self._avoided % self.probe_every:
+                return self.fast_model, "large_slow"
+            return self.large_model, "probe"
+        return self.large_model, "complex"
+
+    def payload(self, model: str, question: str, context: str) -> Dict[str, Any]:
+        return {
+            "model": model,
+            "messages": build_messages(question, context),
+            "temperature": 0.3,
+            "max_tokens": self.max_tokens[model],
+        }
+
+    def _plan(self, answer: LLMAnswer, question: str, context: str) -> List[str]:
+        answer.model, answer.reason = self.choose(question, context)
+        self.routes[answer.reason] += 1
+        LLM_ROUTES.labels(model=answer.model, reason=answer.reason).inc()
+        return [answer.model] if answer.model == self.fast_model else [answer.model, self.fast_model]
+
+    def _budget(self, model: str, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if model != self.fast_model:
+            # Leave the fast model the time it usually takes
+            remaining -= self.models[self.fast_model].latency or INITIAL_FAST_LATENCY
+        return remaining
+
+    async def _reserve(self, client: GroqClient) -> float:
+        wait = await client.reserve()
+        self.queue_wait += wait
+        record("llm_queue_wait", wait)
+        return wait
+
+    def _failed(self, model: str, start: float, error: BaseException):
+        timeout = isinstance(error, asyncio.TimeoutError)
+        self.models[model].failed(time.perf_counter() - start, timeout)
+        reason = f"pas de réponse en {self.slo:.0f}s" if timeout else error
+        logger.warning(f"⚠️ {model}: {reason}")
+
+    def _answered(self, answer: LLMAnswer, model: str):
+        if model != answer.model:
+            self.fallbacks["fast"] += 1
+            answer.model, answer.fallback = model, "fast"
+
+    def _offline(self, answer: LLMAnswer, question: str):
+        if answer.reason:
+            self.fallbacks["offline"] += 1
+        answer.model, answer.fallback = OFFLINE_MODEL, "offline"
+        answer.text = self.offline(question)
+
+    async def complete(self, client: Optional[GroqClient], question: str, context: str) -> LLMAnswer:
+        answer = LLMAnswer()
+        models = self._plan(answer, question, context) if client is not None else []
+        deadline = time.monotonic() + self.slo
+        for model in models:
+            if self._budget(model, deadline) <= 0:
+                continue
+            payload = self.payload(model, question, context)
+            deadline += await self._reserve(client)
+            start = time.perf_counter()
+            try:
+                data = await asyncio.wait_for(client.chat(payload, reserved=True), self._budget(model, deadline))
+            except Exception as e:
+                self._failed(model, start, e)
+                continue
+            text = data["choices"][0]["message"]["content"]
+            usage = data.get("usage") or {}
+            completion = usage.get("completion_tokens") or count_tokens(text)
+            self.models[model].observe(time.perf_counter() - start, completion)
+            record_tokens(
+                usage.get("prompt_tokens") or sum(count_tokens(m["content"]) for m in payload["messages"]),
+                completion,
+            )
+            self._answered(answer, model)
+            answer.text = text
+            return answer
+        self._offline(answer, question)
+        return answer
+
+    async def stream(self, client: Optional[GroqClient], question: str, context: str,
+                     answer: Optional[LLMAnswer] = None) -> AsyncIterator[str]:
+        """Yield the answer token by token, filling ``answer`` as it goes.
+
+        The SLO applies until the first token: past it the answer can no
+        longer move to another model.
+        """
+        answer = answer if answer is not None else LLMAnswer()
+        models = self._plan(answer, question, context) if client is not None else []
+        deadline = time.monotonic() + self.slo
+        for model in models:
+            if self._budget(model, deadline) <= 0:
+                continue
+            payload = self.payload(model, question, context)
+            deadline += await self._reserve(client)
+            start = time.perf_counter()
+            tokens = client.stream_chat(payload, reserved=True)
+            try:
+                parts = [await asyncio.wait_for(tokens.__anext__(), self._budget(model, deadline))]
+            except StopAsyncIteration:
+                parts = []
+            except Exception as e:
+                await tokens.aclose()
+                self._failed(model, start, e)
+                continue
+            self._answered(answer, model)
+            if parts:
+                yield parts[0]
+            try:
+                async for token in tokens:
+                    parts.append(token)
+                    yield token
+            except Exception as e:
+                self._failed(model, start, e)
+                raise
+            answer.text = "".join(parts)
+            # Streamed chunks carry no usage: count with the chunker's tokenizer
+            completion = count_tokens(answer.text)
+            self.models[model].observe(time.perf_counter() - start, completion)
+            record_tokens(sum(count_tokens(m["content"]) for m in payload["messages"]), completion)
+            return
+        self._offline(answer, question)
+        yield answer.text
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fast_model": self.fast_model,
+            "large_model": self.large_model,
+            "slo": self.slo,
+            "routes": dict(self.routes),
+            "fallbacks": dict(self.fallbacks),
+            "queue_wait_total": round(self.queue_wait, 3),
+            "models": {model: stats.summary() for model, stats in self.models.items()},
+        }
@@ -1,22 +1,41 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import json
-import redis
+import redis.asyncio as aioredis
 import hashlib
-from typing import Optional, List
+from typing import Any, Optional, List, Dict, Set, Tuple
 import os
 from dotenv import load_dotenv
+import asyncio
 import logging
-import time
-import chromadb
-from chromadb.utils import embedding_functions
-import PyPDF2
-import io
-import docx
-from groq import Groq
-from datetime import datetime
-from rag_utils import retrieve_context, generate_llm_answer
+from contextlib import asynccontextmanager
+from admission import AdmissionController, AdmissionRejected, DeadlineExceeded, Ticket
+from context_packing import ContextPacker, PackedContext
+from deletion import DELETE_SYNC_SECONDS, DeletionManager
+from extraction import detect_doc_type
+from generations import CorpusGenerations
+from ingestion import IngestionManager, IngestionQueueFull, spool_upload
+from job_status import JobBoard
+from rag_utils import (
+    embed_batcher, embed_question, generate_llm_answer, model_router, retrieve_context_batched,
+    search_batcher, stream_llm_answer
+)
+from llm_client import GroqClient, get_llm_client, set_llm_client
+from llm_router import LLMAnswer
+import metrics
+from metrics import CONTEXT_TOKENS, QUERY_RESULTS, UPLOAD_STAGES, LoopLagMonitor, MetricsWriter, stage, trace
+from retrieval import create_retrieval_service, get_retrieval_service, set_retrieval_service
+from scopes import GLOBAL_SESSION, build_where, normalize_commune
+from semantic_cache import SemanticCache
+from query_log import CacheWarmer, QueryLog
+from singleflight import SingleFlight
+from startup import StartupState
+from stats import StatsRecorder
 
 # Configuration
 load_dotenv()
@@ -30,7 +49,83 @@ if origins_env:
 else:
     allowed_origins = ["*"]
 
-app = FastAPI(title="Assistant Urbanisme AI", version="2.0.0")
+ingestion_manager: Optional[IngestionManager] = None
+deletion_manager: Optional[DeletionManager] = None
+semantic_cache = SemanticCache()
+# Nombre de questions traitées en parallèle, file équitable par session
+admission = AdmissionController()
+context_packer = ContextPacker()
+loop_lag = LoopLagMonitor()
+# Valeurs de ce worker partagées avec les autres pour /metrics (METRICS_SHARED_DIR)
+metrics_writer = MetricsWriter()
+# Vivant dès l'import, prêt une fois le préchauffage terminé
+startup = StartupState()
+startup.record("import", time.perf_counter() - IMPORT_STARTED)
+
+async def warm_up():
+    """Charge ChromaDB et le modèle d'embeddings en arrière-plan"""
+    global ingestion_manager, deletion_manager
+    try:
+        # Un seul modèle d'embeddings et un seul client ChromaDB par worker,
+        # ou par machine avec RETRIEVAL_SERVICE_URL (service partagé)
+        with startup.phase("retrieval"):
+            service = await asyncio.to_thread(create_retrieval_service)
+        with startup.phase("first_encode"):
+            await asyncio.to_thread(service.warm_up)
+        set_retrieval_service(service)
+        ingestion_manager = IngestionManager(service, on_indexed=documents_indexed)
+        # Suppression paginée et purge des sessions expirées
+        deletion_manager = DeletionManager(service, on_deleted=invalidate_session_cache)
+        deletion_manager.start()
+        startup.mark_ready()
+    except Exception as e:
+        startup.fail(e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await connect_redis()
+    stats_recorder.start()
+    job_board.start()
+    loop_lag.start()
+    metrics_writer.start()
+    query_log.start()
+    if cache_enabled:
+        cache_warmer.start()
+    # Client HTTP Groq partagé (keep-alive, limitation de débit, retries)
+    if GROQ_API_KEY:
+        set_llm_client(GroqClient(GROQ_API_KEY))
+    warmup_task = asyncio.create_task(warm_up())
+    yield
+    warmup_task.cancel()
+    await cache_warmer.stop()
+    # Plus de nouveau travail pendant l'arrêt
+    was_ready, startup.ready = startup.ready, False
+    if ingestion_manager is not None:
+        await ingestion_manager.shutdown()
+    if deletion_manager is not None:
+        await deletion_manager.shutdown()
+    embed_batcher.shutdown()
+    search_batcher.shutdown()
+    if GROQ_API_KEY:
+        await get_llm_client(GROQ_API_KEY).aclose()
+        set_llm_client(None)
+    if was_ready:
+        get_retrieval_service().embedding_cache.flush()
+    set_retrieval_service(None)
+    await stats_recorder.stop()
+    await job_board.stop()
+    await query_log.stop()
+    await loop_lag.stop()
+    await metrics_writer.stop()
+    await r.close()
+
+def require_ready():
+    """503 tant que le préchauffage n'est pas terminé"""
+    if not startup.ready:
+        detail = startup.error or "Service en cours de démarrage"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+app = FastAPI(title="Assistant Urbanisme AI", version="2.0.0", lifespan=lifespan)
 
 # CORS pour le frontend
 app.add_middleware(
@@ -40,42 +135,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Redis pour le cache
-try:
-    r = redis.Redis(
-        host=os.getenv('REDIS_HOST', 'localhost'),
-        port=int(os.getenv('REDIS_PORT', 6379)),
-        password=os.getenv('REDIS_PASSWORD', None),
-        decode_responses=True
-    )
-    r.ping()
-    cache_enabled = True
-    logger.info("✅ Redis connecté - Cache activé")
-except Exception as e:
-    cache_enabled = False
-    logger.warning(f"⚠️ Redis non disponible - Mode sans cache: {e}")
+# Redis pour le cache (client asynchrone, pool de connexions)
+r = aioredis.Redis(
+    host=os.getenv('REDIS_HOST', 'localhost'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    password=os.getenv('REDIS_PASSWORD', None),
+    decode_responses=True,
+    max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+)
+cache_enabled = False
+
+# Déduplication des requêtes identiques en cours (verrou Redis entre workers)
+singleflight = SingleFlight()
+# Générations des documents (globaux, par commune, par session) dans les clés de cache
+corpus = CorpusGenerations()
+# Compteurs d'usage agrégés localement puis envoyés à Redis par lots
+stats_recorder = StatsRecorder()
+# Journal des questions, et préchauffage des réponses aux plus fréquentes
+query_log = QueryLog()
+# Progression des uploads et suppressions, lisible depuis n'importe quel worker
+job_board = JobBoard()
+job_board.track("upload", lambda: ingestion_manager.jobs if ingestion_manager else {})
+job_board.track("batch", lambda: ingestion_manager.batches if ingestion_manager else {})
+job_board.track("deletion", lambda: deletion_manager.jobs if deletion_manager else {})
+
+async def connect_redis():
+    global cache_enabled
+    try:
+        await r.ping()
+        cache_enabled = True
+        logger.info("✅ Redis connecté - Cache activé")
+    except Exception as e:
+        cache_enabled = False
+        logger.warning(f"⚠️ Redis non disponible - Mode sans cache: {e}")
+    singleflight.redis = r if cache_enabled else None
+    corpus.redis = r if cache_enabled else None
+    stats_recorder.redis = r if cache_enabled else None
+    job_board.redis = r if cache_enabled else None
 
 # Configuration Groq
 GROQ_API_KEY = os.getenv('GROQ_API_KEY', '')
 if GROQ_API_KEY:
-    groq_client = Groq(api_key=GROQ_API_KEY)
     logger.info("✅ Groq configuré")
 else:
-    groq_client = None
     logger.warning("⚠️ Groq non configuré - Mode simulation")
 
-# Configuration ChromaDB pour le RAG
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="all-MiniLM-L6-v2"
-)
-
-# Collection pour les documents d'urbanisme
-collection = chroma_client.get_or_create_collection(
-    name="urbanisme_docs",
-    embedding_function=embedding_function
-)
-
 # Modèles Pydantic
 class QueryRequest(BaseModel):
     question: str
@@ -83,6 +187,8 @@ class QueryRequest(BaseModel):
     parcelle: Optional[str] = None
     use_context: bool = True
     session_id: Optional[str] = None
+    # Renvoie le détail des temps par étape dans la réponse
+    include_timings: bool = False
 
 class QueryResponse(BaseModel):
     answer: str
@@ -91,6 +197,7 @@ class QueryResponse(BaseModel):
     processing_time: Optional[float] = None
     confidence: Optional[float] = None
     sources_used: Optional[List[str]] = None
+    timings: Optional[Dict[str, float]] = None
 
 class DocumentInfo(BaseModel):
     filename: str
@@ -98,6 +205,30 @@ class DocumentInfo(BaseModel):
     size: int
     chunks: int
     upload_date: str
+    # Par rapport à la version déjà indexée du même fichier dans la session
+    unchanged: int = 0
+    added: int = 0
+    removed: int = 0
+
+class UploadJobStatus(BaseModel):
+    job_id: str
+    filename: str
+    status: str
+    pages_total: int = 0
+    pages_extracted: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    stage_times: Dict[str, float] = {}
+    elapsed: float = 0.0
+    error: Optional[str] = None
+    result: Optional[DocumentInfo] = None
+
+class UploadBatchStatus(BaseModel):
+    batch_id: str
+    status: str
+    jobs: List[UploadJobStatus]
+    # Débit du lot : pages/s, chunks/s, nombre de lots d'embeddings...
+    report: Dict[str, Any]
 
 class StatsResponse(BaseModel):
     total_queries: int
@@ -106,94 +237,36 @@ class StatsResponse(BaseModel):
     documents_indexed: int
     cache_enabled: bool
     ai_model: str
+    llm: Optional[Dict[str, Any]] = None
+    llm_routing: Optional[Dict[str, Any]] = None
+    semantic_cache: Optional[Dict[str, Any]] = None
+    context_packing: Optional[Dict[str, Any]] = None
+    coalescing: Optional[Dict[str, int]] = None
+    corpus_generations: Optional[Dict[str, Any]] = None
+    query_log: Optional[Dict[str, Any]] = None
+    cache_warming: Optional[Dict[str, Any]] = None
+    admission: Optional[Dict[str, Any]] = None
+    retrieval_batching: Optional[Dict[str, Any]] = None
+    embedding_cache: Optional[Dict[str, Any]] = None
+    deletion: Optional[Dict[str, Any]] = None
 
 # Fonctions utilitaires
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extrait le texte d'un PDF"""
-    try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        logger.error(f"Erreur extraction PDF: {e}")
-        return ""
-
-def extract_text_from_docx(file_content: bytes) -> str:
-    """Extrait le texte d'un DOCX"""
-    try:
-        buffer = io.BytesIO(file_content)
-        doc = docx.Document(buffer)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    except Exception as e:
-        logger.error(f"Erreur extraction DOCX: {e}")
-        return ""
-
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-    """Divise le texte en chunks avec overlap"""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start = end - overlap
-    return chunks
-
-async def query_groq(prompt: str, context: str = "") -> str:
-    """Interroge Groq avec le contexte RAG"""
-    if not groq_client:
-        return generate_mock_response(prompt)
-    
-    try:
-        messages = [
-            {
-                "role": "system",
-                "content": """Tu es un assistant expert en urbanisme et architecture. 
-                Tu utilises le contexte fourni pour répondre de manière précise et technique.
-                Si le contexte ne contient pas l'information, tu l'indiques clairement."""
-            }
-        ]
-        
-        if context:
-            messages.append({
-                "role": "user",
-                "content": f"Contexte des documents:\n{context}\n\nQuestion: {prompt}"
-            })
-        else:
-            messages.append({
-                "role": "user",
-                "content": prompt
-            })
-        
-        completion = groq_client.chat.completions.create(
-            model="mixtral-8x7b-32768",
-            messages=messages,
-            temperature=0.3,
-            max_tokens=1024
-        )
-        
-        return completion.choices[0].message.content
-        
-    except Exception as e:
-        logger.error(f"Erreur Groq: {e}")
-        return generate_mock_response(prompt)
-
 def get_cache_key(query: str) -> str:
     """Génère une clé de cache unique"""
     return f"urbanisme:{hashlib.md5(query.encode()).hexdigest()}"
 
+# Les réponses ne deviennent pas obsolètes : un changement de documents
+# change leur clé (génération du corpus), le TTL ne fait que libérer la place
+CACHE_TTL = int(os.getenv("CACHE_TTL", 7 * 86400))
+
+async def answer_cache_key(request: QueryRequest) -> Tuple[str, str]:
+    """Clé de cache de la réponse, et génération des documents visibles par la requête"""
+    generation = await corpus.generation(request.session_id, request.commune) if request.use_context else ""
+    return get_cache_key(f"{request_scope(request)}:{generation}:{request.question}"), generation
+
 def increment_stat(stat_name: str):
-    """Incrémente une statistique si Redis est disponible"""
-    if cache_enabled:
-        try:
-            r.incr(f"stats:{stat_name}")
-        except:
-            pass
+    """Incrémente une statistique (envoyée à Redis par lots)"""
+    stats_recorder.incr(stat_name)
 
 # Routes
 @app.get("/")
@@ -207,77 +280,248 @@ async def read_root():
 
 @app.get("/health")
 async def health_check():
-    return {
-        "status": "healthy",
+    """Liveness : répond dès le démarrage, sans attendre le modèle"""
+    health = {
+        "status": "healthy" if startup.ready else "starting",
+        "ready": startup.ready,
+        "startup": startup.to_dict(),
         "cache": "enabled" if cache_enabled else "disabled",
-        "ai_model": "groq" if groq_client else "simulation",
+        "ai_model": "groq" if GROQ_API_KEY else "simulation",
         "rag": "chromadb",
-        "documents": collection.count()
     }
+    if startup.ready:
+        service = get_retrieval_service()
+        # Appels au service de recherche (socket avec plusieurs workers) hors de la boucle
+        health["documents"] = await asyncio.to_thread(service.count)
+        health["retrieval"] = await asyncio.to_thread(service.stats)
+    return health
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métriques Prometheus (somme des workers) : temps par étape, tokens, lag de la boucle"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
-@app.post("/api/upload", response_model=DocumentInfo)
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness : 200 une fois ChromaDB et le modèle chargés, 503 avant"""
+    require_ready()
+    return {"status": "ready", "startup": startup.to_dict()}
+
+@app.post("/api/upload", response_model=UploadJobStatus, status_code=202)
 async def upload_document(
     file: UploadFile = File(...),
-    session_id: Optional[str] = None
+    session_id: Optional[str] = Form(None),
+    commune: Optional[str] = Form(None)
 ):
-    """Upload et indexe un document dans le RAG"""
+    """Reçoit un document et lance son indexation en arrière-plan"""
+    require_ready()
+    filename = file.filename
+    doc_type = detect_doc_type(filename)
+    if not doc_type:
+        raise HTTPException(status_code=400, detail="Format non supporté")
+
+    with stage("spool", UPLOAD_STAGES):
+        path, size, doc_hash = await spool_upload(file)
     try:
-        # Lire le fichier
-        content = await file.read()
-        filename = file.filename
-        
-        # Extraire le texte selon le type
-        if filename.lower().endswith('.pdf'):
-            text = extract_text_from_pdf(content)
-            doc_type = "pdf"
-        elif filename.lower().endswith('.docx'):
-            text = extract_text_from_docx(content)
-            doc_type = "docx"
-        elif filename.lower().endswith('.txt'):
-            text = content.decode('utf-8')
-            doc_type = "txt"
-        else:
-            raise HTTPException(status_code=400, detail="Format non supporté")
-        
-        if not text:
-            raise HTTPException(status_code=400, detail="Impossible d'extraire le texte")
-        
-        # Chunker le texte
-        chunks = chunk_text(text)
-        
-        # Indexer dans ChromaDB
-        ids = []
-        documents = []
-        metadatas = []
-        
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{filename}_{i}_{session_id or 'global'}"
-            ids.append(chunk_id)
-            documents.append(chunk)
-            metadatas.append({
-                "filename": filename,
-                "chunk_index": i,
-                "session_id": session_id or "global",
-                "upload_date": datetime.now().isoformat()
-            })
-        
-        collection.add(
-            documents=documents,
-            ids=ids,
-            metadatas=metadatas
+        job = ingestion_manager.submit(
+            filename, doc_type, path, size, session_id, commune=commune, doc_hash=doc_hash
         )
-        
-        return DocumentInfo(
-            filename=filename,
-            doc_type=doc_type,
-            size=len(content),
-            chunks=len(chunks),
-            upload_date=datetime.now().isoformat()
-        )
-        
+    except IngestionQueueFull as e:
+        os.unlink(path)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+
+    await job_board.publish("upload", job.job_id, job)
+    return UploadJobStatus(**job.to_dict())
+
+@app.post("/api/upload/batch", response_model=UploadBatchStatus, status_code=202)
+async def upload_documents_batch(
+    files: List[UploadFile] = File(...),
+    session_id: Optional[str] = Form(None),
+    commune: Optional[str] = Form(None)
+):
+    """Indexe plusieurs documents d'un coup (ex. tout le PLU d'une commune)"""
+    require_ready()
+    unsupported = [f.filename for f in files if not detect_doc_type(f.filename)]
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"Format non supporté: {', '.join(unsupported)}")
+
+    spooled = []
+    try:
+        for file in files:
+            with stage("spool", UPLOAD_STAGES):
+                path, size, doc_hash = await spool_upload(file)
+            spooled.append((file.filename, detect_doc_type(file.filename), path, size, doc_hash))
+        batch = ingestion_manager.submit_batch(spooled, session_id, commune=commune)
     except Exception as e:
-        logger.error(f"Erreur upload: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        for _, _, path, _, _ in spooled:
+            os.unlink(path)
+        if isinstance(e, IngestionQueueFull):
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+        raise
+
+    await job_board.publish("batch", batch.batch_id, batch)
+    for job in batch.jobs:
+        await job_board.publish("upload", job.job_id, job)
+    return UploadBatchStatus(**batch.to_dict())
+
+@app.get("/api/upload/batch/{batch_id}", response_model=UploadBatchStatus)
+async def get_upload_batch_status(batch_id: str):
+    """Progression et débit d'une indexation par lot"""
+    require_ready()
+    batch = ingestion_manager.get_batch(batch_id)
+    # Lancé par un autre worker
+    data = batch.to_dict() if batch is not None else await job_board.get("batch", batch_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Lot inconnu")
+    return UploadBatchStatus(**data)
+
+@app.get("/api/upload/{job_id}", response_model=UploadJobStatus)
+async def get_upload_status(job_id: str):
+    """Progression d'une indexation de document"""
+    require_ready()
+    job = ingestion_manager.get(job_id)
+    data = job.to_dict() if job is not None else await job_board.get("upload", job_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Job inconnu")
+    return UploadJobStatus(**data)
+
+def request_scope(request: QueryRequest) -> str:
+    """Partie des clés de cache qui dépend des documents visibles par la requête"""
+    if not request.use_context:
+        return f"{normalize_commune(request.commune)}:False"
+    return f"{normalize_commune(request.commune)}:{request.session_id or GLOBAL_SESSION}:True"
+
+def get_semantic_response(request: QueryRequest, embedding: List[float], generation: str) -> Optional[dict]:
+    """Renvoie une réponse déjà générée pour une question similaire, sur les mêmes documents"""
+    with stage("semantic_cache"):
+        data = semantic_cache.lookup(request_scope(request), embedding, generation)
+    if data:
+        QUERY_RESULTS.labels(result="semantic_cache").inc()
+        increment_stat("cache_hits")
+        increment_stat("semantic_hits")
+        logger.info(f"💾 Cache sémantique (similarité {data.pop('similarity'):.3f})")
+    return data
+
+async def build_context(request: QueryRequest, embedding: Optional[List[float]] = None) -> PackedContext:
+    """Construit le contexte RAG pour une question, dans le budget de tokens"""
+    if not request.use_context:
+        return PackedContext()
+    hits = await retrieve_context_batched(
+        request.question,
+        query_embedding=embedding,
+        where=build_where(request.session_id, request.commune),
+    )
+    with stage("prompt_build"):
+        context = context_packer.pack(hits)
+    if hits:
+        CONTEXT_TOKENS.labels(kind="packed").observe(context.tokens)
+        CONTEXT_TOKENS.labels(kind="saved").observe(context.tokens_saved)
+    return context
+
+async def get_cached_response(cache_key: str) -> Optional[dict]:
+    """Renvoie la réponse en cache, s'il y en a une"""
+    if cache_enabled:
+        try:
+            cached_result = await r.get(cache_key)
+        except Exception:
+            logger.warning("Impossible de lire le cache")
+            return None
+        if cached_result:
+            increment_stat("cache_hits")
+            return json.loads(cached_result)
+    return None
+
+async def cache_response(cache_key: str, response_data: dict):
+    """Met une réponse en cache pour CACHE_TTL"""
+    if cache_enabled:
+        try:
+            await r.setex(cache_key, CACHE_TTL, json.dumps(response_data))
+        except:
+            logger.warning("Impossible de mettre en cache")
+
+async def invalidate_session_cache(session_ids: Set[str]):
+    """Oublie les réponses construites à partir de documents supprimés.
+
+    Les documents globaux sont visibles de toutes les sessions : leur
+    suppression invalide toutes les réponses qui utilisent le contexte.
+    Les anciennes réponses restent dans Redis, inaccessibles, jusqu'à leur
+    expiration.
+    """
+    await corpus.deleted(session_ids)
+
+def answer_source(context: PackedContext, answer: Optional[LLMAnswer] = None) -> str:
+    if answer is not None and answer.offline:
+        return "Simulation"
+    return "RAG + Groq AI" if context.text else "Groq AI"
+
+async def answer_question(request: QueryRequest, cache_key: str, generation: str, semantic: bool = True) -> dict:
+    """Cache sémantique, recherche et appel LLM pour une question absente du cache"""
+    embedding = await embed_question(request.question)
+    data = get_semantic_response(request, embedding, generation) if semantic else None
+    if data:
+        await cache_response(cache_key, data)
+        data['cached'] = True
+        return data
+
+    increment_stat("api_calls")
+
+    context = await build_context(request, embedding)
+
+    answer = await generate_llm_answer(request.question, context.text, GROQ_API_KEY)
+
+    confidence = None
+
+    response_data = {
+        "answer": answer.text,
+        "source": answer_source(context, answer),
+        "cached": False,
+        "confidence": confidence,
+        "sources_used": context.sources or None
+    }
+    if answer.offline:
+        # Réponse simulée : pas mise en cache, la question suivante retentera Groq
+        QUERY_RESULTS.labels(result="offline").inc()
+        return response_data
+    QUERY_RESULTS.labels(result="llm").inc()
+
+    await cache_response(cache_key, response_data)
+    semantic_cache.store(request_scope(request), embedding, response_data, generation)
+    return response_data
+
+def warm_request(commune: str, question: str, use_context: bool) -> QueryRequest:
+    return QueryRequest(question=question, commune=commune or None, use_context=use_context)
+
+async def is_answer_fresh(commune: str, question: str, use_context: bool) -> bool:
+    """Réponse en cache, pour les documents actuels, qui ne va pas expirer avant le prochain préchauffage"""
+    cache_key, _ = await answer_cache_key(warm_request(commune, question, use_context))
+    return await r.ttl(cache_key) > cache_warmer.interval
+
+async def warm_answer(commune: str, question: str, use_context: bool, force: bool):
+    """Recalcule une réponse fréquente, sans passer devant les questions des utilisateurs"""
+    if admission.depth():
+        raise AdmissionRejected("Questions en attente", 1)
+    request = warm_request(commune, question, use_context)
+    cache_key, generation = await answer_cache_key(request)
+    await admission.run("warmup", lambda: singleflight.do(
+        cache_key,
+        lambda: answer_question(request, cache_key, generation, semantic=not force)
+    ))
+
+cache_warmer = CacheWarmer(query_log, is_answer_fresh, warm_answer, redis_client=r)
+
+async def documents_indexed(job):
+    """Nouvelle génération des communes touchées ; documents globaux : réponses fréquentes à recalculer"""
+    for commune in job.communes_changed or {job.commune}:
+        await corpus.indexed(job.session_id, commune)
+        if not job.session_id or job.session_id == GLOBAL_SESSION:
+            cache_warmer.trigger(commune)
+
+async def wait_for_cached_response(cache_key: str) -> Optional[dict]:
+    """Réponse publiée par un autre worker pour la même question"""
+    data = await get_cached_response(cache_key)
+    if data:
+        data['cached'] = True
+    return data
 
 @app.post("/api/query", response_model=QueryResponse)
 async def query_urbanisme(request: QueryRequest):
@@ -286,142 +530,237 @@ async def query_urbanisme(request: QueryRequest):
     
     increment_stat("total")
     
-    # Vérifier le cache
-    cache_key = get_cache_key(f"{request.commune}:{request.question}:{request.use_context}")
-    
-    if cache_enabled:
-        cached_result = r.get(cache_key)
-        if cached_result:
-            increment_stat("cache_hits")
-            data = json.loads(cached_result)
+    with trace() as timings:
+        # Vérifier le cache
+        with stage("cache_lookup"):
+            cache_key, generation = await answer_cache_key(request)
+            data = await get_cached_response(cache_key)
+        if data:
+            QUERY_RESULTS.labels(result="cache").inc()
             data['cached'] = True
-            data['processing_time'] = time.time() - start_time
-            return QueryResponse(**data)
-    
-    increment_stat("api_calls")
-    
-    try:
-        context = ""
-        sources_used = []
-
-        if request.use_context:
-            snippets = retrieve_context(request.question)
-            if snippets:
-                context = "\n\n".join(f"[Snippet {i+1}]: {s}" for i, s in enumerate(snippets))
-
-        answer = await generate_llm_answer(request.question, context, GROQ_API_KEY)
-
-        confidence = None
-        
-        response_data = {
-            "answer": answer,
-            "source": "RAG + Groq AI" if context else "Groq AI",
-            "cached": False,
-            "confidence": confidence,
-            "sources_used": sources_used if sources_used else None
-        }
-        
-        # Mettre en cache pour 24h
-        if cache_enabled:
-            try:
-                r.setex(cache_key, 86400, json.dumps(response_data))
-            except:
-                logger.warning("Impossible de mettre en cache")
-        
-        response_data['processing_time'] = time.time() - start_time
-        return QueryResponse(**response_data)
-        
-    except Exception as e:
-        logger.error(f"Erreur lors du traitement: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+            return QueryResponse(**finish_query(request, data, start_time, timings))
+
+        require_ready()
+        try:
+            # Les requêtes identiques simultanées partagent une seule recherche + appel LLM
+            pending = singleflight.pending(cache_key)
+            if pending:
+                data = await pending
+            else:
+                data = await admission.run(admission_key(request), lambda: singleflight.do(
+                    cache_key,
+                    lambda: answer_question(request, cache_key, generation),
+                    wait_for_result=lambda: wait_for_cached_response(cache_key)
+                ))
+            return QueryResponse(**finish_query(request, dict(data), start_time, timings))
+
+        except AdmissionRejected as e:
+            raise overloaded(e)
+        except DeadlineExceeded as e:
+            QUERY_RESULTS.labels(result="timeout").inc()
+            raise HTTPException(status_code=504, detail=str(e))
+        except Exception as e:
+            QUERY_RESULTS.labels(result="error").inc()
+            logger.error(f"Erreur lors du traitement: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+def admission_key(request: QueryRequest) -> str:
+    """Les questions sans session partagent une même file"""
+    return request.session_id or "anonymous"
+
+def overloaded(e: AdmissionRejected) -> HTTPException:
+    """503 immédiat plutôt qu'une attente qui finirait en timeout"""
+    QUERY_RESULTS.labels(result="shed").inc()
+    logger.warning(f"⏳ Question refusée: {e.reason}")
+    return HTTPException(status_code=503, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+def finish_query(request: QueryRequest, data: dict, start_time: float, timings: Dict[str, float]) -> dict:
+    """Temps total de la requête, et son détail par étape si demandé"""
+    data['processing_time'] = time.time() - start_time
+    metrics.record("total", data['processing_time'])
+    query_log.record(request.question, request.commune, bool(request.session_id), request.use_context,
+                     bool(data.get('cached')), timings)
+    if request.include_timings:
+        data['timings'] = dict(timings)
+    return data
+
+def ndjson(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+class AdmittedStream(StreamingResponse):
+    """Flux qui rend sa place d'admission une fois envoyé, interrompu, ou jamais lu
+
+    Le générateur ne démarre pas si le client se déconnecte avant le corps :
+    son finally ne suffit pas à libérer la place.
+    """
+
+    def __init__(self, content, ticket: Ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission.release(self.ticket)
+
+@app.post("/api/query/stream")
+async def query_urbanisme_stream(request: QueryRequest):
+    """Variante streaming (NDJSON) : sources, puis tokens, puis réponse finale"""
+    start_time = time.time()
+
+    increment_stat("total")
+
+    with trace() as timings:
+        try:
+            with stage("cache_lookup"):
+                cache_key, generation = await answer_cache_key(request)
+                data = await get_cached_response(cache_key)
+            pending = singleflight.pending(cache_key)
+            if not data and pending:
+                data = dict(await pending)
+            ticket = None
+            if data:
+                QUERY_RESULTS.labels(result="cache").inc()
+            else:
+                require_ready()
+                # Libéré par AdmittedStream, ou dès maintenant si la question n'y arrive pas
+                ticket = await admission.acquire(admission_key(request))
+                try:
+                    embedding = await embed_question(request.question)
+                    data = get_semantic_response(request, embedding, generation)
+                    if data:
+                        await cache_response(cache_key, data)
+                    else:
+                        increment_stat("api_calls")
+                        context = await build_context(request, embedding)
+                except BaseException:
+                    admission.release(ticket)
+                    raise
+            if data:
+                if ticket is not None:
+                    admission.release(ticket)
+                data['cached'] = True
+                done = finish_query(request, data, start_time, timings)
+                return StreamingResponse(
+                    iter([ndjson({"type": "done", **done})]),
+                    media_type="application/x-ndjson"
+                )
+        except HTTPException:
+            raise
+        except AdmissionRejected as e:
+            raise overloaded(e)
+        except Exception as e:
+            QUERY_RESULTS.labels(result="error").inc()
+            logger.error(f"Erreur lors du traitement: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    response_data = {
+        "answer": "",
+        "source": answer_source(context),
+        "cached": False,
+        "confidence": None,
+        "sources_used": context.sources or None
+    }
+
+    async def events():
+        yield ndjson({
+            "type": "sources",
+            "source": response_data["source"],
+            "sources_used": response_data["sources_used"]
+        })
+        parts = []
+        answer = LLMAnswer()
+        try:
+            # Les étapes LLM s'ajoutent aux temps déjà mesurés pour cette requête
+            with trace(timings):
+                async for token in stream_llm_answer(request.question, context.text, GROQ_API_KEY, answer):
+                    parts.append(token)
+                    yield ndjson({"type": "token", "content": token})
+        except Exception as e:
+            QUERY_RESULTS.labels(result="error").inc()
+            logger.error(f"Erreur Groq (stream): {e}")
+            yield ndjson({"type": "error", "detail": str(e)})
+            return
+
+        response_data["answer"] = "".join(parts)
+        if answer.offline:
+            QUERY_RESULTS.labels(result="offline").inc()
+            response_data["source"] = answer_source(context, answer)
+        else:
+            QUERY_RESULTS.labels(result="llm").inc()
+            await cache_response(cache_key, response_data)
+            semantic_cache.store(request_scope(request), embedding, response_data, generation)
+        with trace(timings):
+            done = finish_query(request, dict(response_data), start_time, timings)
+        yield ndjson({"type": "done", **done})
+
+    return AdmittedStream(events(), ticket, media_type="application/x-ndjson")
 
 @app.get("/api/stats", response_model=StatsResponse)
 async def get_stats():
     """Statistiques d'utilisation"""
+    service = get_retrieval_service() if startup.ready else None
     stats = {
         "total_queries": 0,
         "cache_hits": 0,
         "api_calls": 0,
-        "documents_indexed": collection.count(),
+        "documents_indexed": await asyncio.to_thread(service.count) if service else 0,
         "cache_enabled": cache_enabled,
-        "ai_model": "groq" if groq_client else "simulation"
+        "ai_model": "groq" if GROQ_API_KEY else "simulation",
+        "llm": get_llm_client(GROQ_API_KEY).metrics.summary() if GROQ_API_KEY else None,
+        "llm_routing": model_router.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "context_packing": context_packer.stats(),
+        "coalescing": singleflight.stats(),
+        "corpus_generations": corpus.stats(),
+        "query_log": query_log.stats(),
+        "cache_warming": cache_warmer.stats() if cache_enabled else None,
+        "admission": admission.stats(),
+        "retrieval_batching": {"embed": embed_batcher.stats(), "search": search_batcher.stats()},
+        "embedding_cache": await asyncio.to_thread(service.embedding_cache.stats) if service else None,
+        "deletion": deletion_manager.stats() if deletion_manager else None
     }
     
-    if cache_enabled:
-        try:
-            stats["total_queries"] = int(r.get("stats:total") or 0)
-            stats["cache_hits"] = int(r.get("stats:cache_hits") or 0)
-            stats["api_calls"] = int(r.get("stats:api_calls") or 0)
-        except:
-            logger.warning("Impossible de récupérer les stats")
+    counters = await stats_recorder.read(["total", "cache_hits", "api_calls"])
+    stats["total_queries"] = counters["total"]
+    stats["cache_hits"] = counters["cache_hits"]
+    stats["api_calls"] = counters["api_calls"]
     
     return StatsResponse(**stats)
 
 @app.delete("/api/documents/{session_id}")
 async def clear_session_documents(session_id: str):
-    """Supprime les documents d'une session"""
+    """Supprime les documents d'une session (par pages, en arrière-plan si elle est volumineuse)"""
+    require_ready()
     try:
-        # Récupérer les IDs des documents de la session
-        results = collection.get(
-            where={"session_id": session_id}
-        )
-        
-        if results['ids']:
-            collection.delete(ids=results['ids'])
-            return {"message": f"{len(results['ids'])} documents supprimés"}
-        else:
-            return {"message": "Aucun document trouvé pour cette session"}
-            
+        job = deletion_manager.submit(session_id)
+        finished = await deletion_manager.wait(job, DELETE_SYNC_SECONDS)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def generate_mock_response(question: str) -> str:
-    """Génère des réponses simulées améliorées"""
-    q_lower = question.lower()
-    
-    # Base de réponses plus élaborées
-    responses = {
-        "hauteur": """D'après la réglementation en vigueur :
-        
-        • Zone UA (centre-ville) : 15m max (R+4)
-        • Zone UB (urbain mixte) : 12m max (R+3)  
-        • Zone UC (pavillonnaire) : 9m max (R+2)
-        • Zone UE (activités) : 12m max sauf dérogation
-        
-        La hauteur se mesure depuis le terrain naturel jusqu'au faîtage.""",
-        
-        "emprise": """L'emprise au sol maximale autorisée :
-        
-        • Zone UA : 80% de la parcelle
-        • Zone UB : 60% de la parcelle
-        • Zone UC : 40% de la parcelle
-        • Zone N/A : 20% maximum
-        
-        Incluant toutes constructions et annexes.""",
-        
-        "recul": """Les règles de recul obligatoires :
-        
-        • Voirie : 5m minimum (3m en UA)
-        • Limites séparatives : H/2 min 3m
-        • Fond de parcelle : 5m minimum
-        • Entre bâtiments : H+3m minimum""",
-        
-        "default": """Je peux vous aider sur :
-        
-        • Règles de hauteur et gabarit
-        • Emprise au sol et COS
-        • Distances et prospects
-        • Zonage PLU/PLUi
-        • Autorisations d'urbanisme
-        
-        Précisez votre question ou uploadez vos documents PLU."""
-    }
-    
-    for key, response in responses.items():
-        if key in q_lower:
-            return response
-    
-    return responses["default"]
+    if not finished:
+        # Suivi via GET /api/documents/jobs/{job_id}, sur n'importe quel worker
+        await job_board.publish("deletion", job.job_id, job)
+        return JSONResponse(status_code=202, content={
+            "message": f"Suppression en cours ({job.deleted} documents supprimés)",
+            **job.to_dict()
+        })
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.deleted:
+        return {"message": f"{job.deleted} documents supprimés"}
+    return {"message": "Aucun document trouvé pour cette session"}
+
+@app.get("/api/documents/jobs/{job_id}")
+async def get_deletion_status(job_id: str):
+    """Progression d'une suppression de session"""
+    require_ready()
+    job = deletion_manager.get(job_id)
+    data = job.to_dict() if job is not None else await job_board.get("deletion", job_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Job inconnu")
+    return data
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,360 @@
+import asyncio
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from periodic import cancel, periodic
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000)
+THROUGHPUT_BUCKETS = (10, 25, 50, 100, 200, 400, 800, 1600)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Shared by the uvicorn workers: each one writes its values there and /metrics
+# sums them, whichever worker answers (emptied by start.sh at startup). The
+# files are this module's JSON snapshots, not prometheus_client's multiprocess
+# format, hence a variable of our own
+METRICS_SHARED_DIR = os.getenv("METRICS_SHARED_DIR") or None
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 1.0))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric(ABC):
+    """Label handling shared by the metric types (``metric.labels(stage=...)``)."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._child()
+        return child
+
+    @abstractmethod
+    def _child(self):
+        """A new child with the ``state()`` and ``merge(state)`` of its values."""
+
+    @abstractmethod
+    def _samples(self, key: Tuple[str, ...], child) -> List[str]:
+        """Exposition lines of one child."""
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Values of every child, by JSON-encoded label values."""
+        with self._lock:
+            return {json.dumps(key): child.state() for key, child in self._children.items()}
+
+    def render(self, snapshots: Iterable[Dict[str, Any]]) -> List[str]:
+        """Exposition lines of the sum of ``snapshots`` (one per worker)."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        merged: Dict[Tuple[str, ...], Any] = {}
+        for snapshot in snapshots:
+            for key, state in snapshot.get(self.name, {}).items():
+                key = tuple(json.loads(key))
+                child = merged.get(key)
+                if child is None:
+                    child = merged[key] = self._child()
+                child.merge(state)
+        for key, child in sorted(merged.items()):
+            lines.extend(self._samples(key, child))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def state(self) -> float:
+        return self.value
+
+    def merge(self, state: float):
+        self.value += state
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _CounterChild()
+
+    def _samples(self, key, child):
+        return [f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def state(self) -> List[Any]:
+        return [list(self.counts), self.count, self.sum]
+
+    def merge(self, state: List[Any]):
+        counts, count, total = state
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.count += count
+        self.sum += total
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram in the Prometheus text format."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def _samples(self, key, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        le = _format_labels(self.labelnames, key, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{le} {child.count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(round(child.sum, 6))}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"metrics_{pid}.json")
+
+
+def _snapshot() -> Dict[str, Any]:
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+def write_snapshot(directory: Optional[str] = None):
+    """Save this worker's values for the other workers' ``render()``."""
+    directory = directory or METRICS_SHARED_DIR
+    if directory is None:
+        return
+    path = _snapshot_path(directory, os.getpid())
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(_snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        logger.warning(f"⚠️ Métriques non partagées: {e}")
+
+
+def _read_snapshots(directory: str) -> List[Dict[str, Any]]:
+    """Values saved by every worker, this one included (fresh)."""
+    own = _snapshot_path(directory, os.getpid())
+    snapshots = [_snapshot()]
+    for path in glob.glob(os.path.join(directory, "metrics_*.json")):
+        if path == own:
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def render(directory: Optional[str] = None) -> str:
+    """Every metric in the Prometheus text exposition format.
+
+    With ``METRICS_SHARED_DIR``, the sum over the workers; the values
+    of a stopped worker are kept, so counters never go back.
+    """
+    directory = directory or METRICS_SHARED_DIR
+    snapshots = _read_snapshots(directory) if directory is not None else [_snapshot()]
+    return "\n".join(line for metric in REGISTRY for line in metric.render(snapshots)) + "\n"
+
+
+QUERY_STAGES = Histogram(
+    "urbanisme_query_stage_seconds",
+    "Duration of each stage of a question (cache_lookup, queue_wait, embed, semantic_cache, "
+    "search, prompt_build, llm_queue_wait, llm_first_token, llm_total, total)",
+    ["stage"],
+)
+UPLOAD_STAGES = Histogram(
+    "urbanisme_upload_stage_seconds",
+    "Duration of each stage of a document upload (spool, extraction, chunking, indexing, total)",
+    ["stage"],
+)
+LLM_TOKENS = Histogram(
+    "urbanisme_llm_tokens",
+    "Tokens per LLM call (prompt, completion)",
+    ["kind"],
+    buckets=TOKEN_BUCKETS,
+)
+LLM_LATENCY = Histogram(
+    "urbanisme_llm_latency_seconds",
+    "Duration of each answered LLM call, by model",
+    ["model"],
+)
+LLM_THROUGHPUT = Histogram(
+    "urbanisme_llm_tokens_per_second",
+    "Completion tokens per second of each answered LLM call, by model",
+    ["model"],
+    buckets=THROUGHPUT_BUCKETS,
+)
+LLM_CALLS = Counter(
+    "urbanisme_llm_calls",
+    "LLM calls by model and outcome (ok, timeout, error)",
+    ["model", "outcome"],
+)
+LLM_ROUTES = Counter(
+    "urbanisme_llm_routes",
+    "Questions by the model they were routed to and why (simple, complex, large_slow, probe, single)",
+    ["model", "reason"],
+)
+CONTEXT_TOKENS = Histogram(
+    "urbanisme_context_tokens",
+    "Tokens of retrieved context per prompt (packed: sent to the LLM, saved: left out)",
+    ["kind"],
+    buckets=TOKEN_BUCKETS,
+)
+QUERY_RESULTS = Counter(
+    "urbanisme_queries",
+    "Questions by how they were answered (cache, semantic_cache, llm, offline, shed, timeout, error)",
+    ["result"],
+)
+LOOP_LAG = Histogram(
+    "urbanisme_event_loop_lag_seconds",
+    "Delay of a timer on the event loop past its deadline",
+    buckets=LOOP_LAG_BUCKETS,
+)
+
+# Stage timings of the request being served, for the optional breakdown
+_trace: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("trace", default=None)
+
+
+@contextmanager
+def trace(timings: Optional[Dict[str, float]] = None) -> Iterator[Dict[str, float]]:
+    """Collect the stages recorded in this context into ``timings``."""
+    timings = {} if timings is None else timings
+    previous = _trace.get()
+    _trace.set(timings)
+    try:
+        yield timings
+    finally:
+        # set() rather than reset(): a streamed response may be closed from another context
+        _trace.set(previous)
+
+
+def record(stage_name: str, seconds: float, histogram: Histogram = QUERY_STAGES):
+    histogram.labels(stage=stage_name).observe(seconds)
+    timings = _trace.get()
+    if timings is not None:
+        timings[stage_name] = round(timings.get(stage_name, 0.0) + seconds, 4)
+
+
+@contextmanager
+def stage(stage_name: str, histogram: Histogram = QUERY_STAGES):
+    """Time a block into ``histogram`` and the current request's trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage_name, time.perf_counter() - start, histogram)
+
+
+def record_tokens(prompt: int, completion: int):
+    LLM_TOKENS.labels(kind="prompt").observe(prompt)
+    LLM_TOKENS.labels(kind="completion").observe(completion)
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic timer fires: time the loop spent blocked."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.last = 0.0
+        self._ticked = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _tick(self):
+        now = asyncio.get_running_loop().time()
+        self.last = max(0.0, now - self._ticked - self.interval)
+        self._ticked = now
+        LOOP_LAG.labels().observe(self.last)
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._ticked = asyncio.get_running_loop().time()
+            self._task = periodic(self.interval, self._tick)
+
+    async def stop(self):
+        await cancel(self._task)
+        self._task = None
+
+
+class MetricsWriter:
+    """Saves this worker's values every ``interval`` seconds for ``render()``."""
+
+    def __init__(self, directory: Optional[str] = METRICS_SHARED_DIR,
+                 interval: float = METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _write(self):
+        await asyncio.to_thread(write_snapshot, self.directory)
+
+    def start(self):
+        if self.directory is not None and self.interval > 0 and self._task is None:
+            self._task = periodic(self.interval, self._write)
+
+    async def stop(self):
+        await cancel(self._task)
+        self._task = None
+        if self.directory is not None:
+            write_snapshot(self.directory)
@@ -0,0 +1,34 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def periodic(interval: float, fn: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+    """Background task awaiting ``fn()`` every ``interval`` seconds.
+
+    A failing call is logged and the next one still runs. Stop the task
+    with :func:`cancel`.
+    """
+
+    async def run():
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await fn()
+            except Exception as e:
+                logger.warning(f"⚠️ Tâche périodique {getattr(fn, '__qualname__', fn)} en échec: {e}")
+
+    return asyncio.create_task(run())
+
+
+async def cancel(task: Optional[asyncio.Task]):
+    """Cancel ``task`` (if any) and wait until it is done."""
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
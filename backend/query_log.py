@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from llm_client import TokenBucket
+from periodic import cancel, periodic
+from scopes import normalize_commune
+from singleflight import release_lock
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "./query_log/queries.jsonl")
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", 2.0))
+# The log is rotated past this size (one previous file is kept)
+QUERY_LOG_MAX_MB = float(os.getenv("QUERY_LOG_MAX_MB", 64))
+# Questions asked in the last QUERY_LOG_WINDOW_HOURS count as hot
+QUERY_LOG_WINDOW_HOURS = float(os.getenv("QUERY_LOG_WINDOW_HOURS", 168))
+
+CACHE_WARM_TOP_N = int(os.getenv("CACHE_WARM_TOP_N", 20))
+CACHE_WARM_MIN_COUNT = int(os.getenv("CACHE_WARM_MIN_COUNT", 2))
+# Groq calls per minute the warm-up may spend
+CACHE_WARM_PER_MINUTE = float(os.getenv("CACHE_WARM_PER_MINUTE", 6))
+CACHE_WARM_INTERVAL = float(os.getenv("CACHE_WARM_INTERVAL", 3600))
+# Uploads arriving together trigger a single warm-up
+CACHE_WARM_DEBOUNCE = float(os.getenv("CACHE_WARM_DEBOUNCE", 30))
+WARM_LOCK_KEY = "urbanisme:cache_warmer:lock"
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+class QueryLog:
+    """Append-only JSONL log of the questions answered by this worker.
+
+    One short line per question: time, question, commune, whether it used
+    the documents of a session, whether it was a cache hit, and its stage
+    timings in milliseconds. Lines are buffered and appended every
+    ``QUERY_LOG_FLUSH_INTERVAL`` seconds from a thread, in a single write so
+    workers sharing the file do not interleave their lines.
+    """
+
+    def __init__(self, path: str = QUERY_LOG_PATH, interval: float = QUERY_LOG_FLUSH_INTERVAL,
+                 max_mb: float = QUERY_LOG_MAX_MB):
+        self.path = path
+        self.interval = interval
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._pending: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+
+    def record(self, question: str, commune: Optional[str], session: bool, use_context: bool,
+               cache_hit: bool, timings: Dict[str, float]):
+        entry = {
+            "t": int(time.time()),
+            "q": question,
+            "c": normalize_commune(commune),
+            "s": int(session),
+            "x": int(use_context),
+            "h": int(cache_hit),
+            "ms": {name: int(seconds * 1000) for name, seconds in timings.items()},
+        }
+        self._pending.append(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+
+    def _write(self, lines: List[str]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        try:
+            if os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            pass
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{line}\n" for line in lines))
+
+    async def flush(self):
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self.written += len(lines)
+        except OSError as e:
+            logger.warning(f"⚠️ Journal des questions indisponible: {e}")
+
+    def entries(self, since: float = 0.0) -> Iterator[Dict[str, Any]]:
+        """Entries logged after ``since``, from the rotated file then the current one."""
+        for path in (f"{self.path}.1", self.path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        if entry.get("t", 0) >= since:
+                            yield entry
+            except FileNotFoundError:
+                continue
+
+    def top_questions(self, n: int = CACHE_WARM_TOP_N, min_count: int = CACHE_WARM_MIN_COUNT,
+                      window_hours: float = QUERY_LOG_WINDOW_HOURS) -> Dict[str, List[Tuple[str, bool, int]]]:
+        """``(question, use_context, count)`` of the most asked questions, by commune.
+
+        Questions asked within a session depend on its documents and are not
+        counted. The most frequent spelling of each question is returned.
+        """
+        counts: Dict[Tuple[str, bool, str], int] = Counter()
+        spellings: Dict[Tuple[str, bool, str], Counter] = defaultdict(Counter)
+        for entry in self.entries(since=time.time() - window_hours * 3600):
+            if entry.get("s"):
+                continue
+            key = (entry.get("c", ""), bool(entry.get("x", 1)), normalize_question(entry["q"]))
+            counts[key] += 1
+            spellings[key][entry["q"]] += 1
+        top: Dict[str, List[Tuple[str, bool, int]]] = defaultdict(list)
+        for key, count in counts.most_common():
+            commune, use_context, _ = key
+            if count >= min_count and len(top[commune]) < n:
+                top[commune].append((spellings[key].most_common(1)[0][0], use_context, count))
+        return dict(top)
+
+    def start(self):
+        if self._task is None:
+            self._task = periodic(self.interval, self.flush)
+
+    async def stop(self):
+        await cancel(self._task)
+        self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {"path": self.path, "written": self.written, "pending": len(self._pending),
+                "size_kb": round(size / 1024, 1)}
+
+
+class CacheWarmer:
+    """Keeps the answers to the most asked questions in the cache.
+
+    Every ``interval`` seconds, and ``debounce`` seconds after documents
+    were indexed, the top questions of each commune in the query log whose
+    cached answer is missing or about to expire (``is_fresh``) are answered
+    again through ``answer(commune, question, use_context, force)``. For the
+    communes whose documents changed every top question is answered again,
+    with ``force``. Answers are limited to ``rate_per_minute`` Groq calls;
+    with Redis, a lock keeps a single worker warming at a time.
+    """
+
+    def __init__(self, query_log: QueryLog, is_fresh: Callable[[str, str, bool], Awaitable[bool]],
+                 answer: Callable[[str, str, bool, bool], Awaitable[Any]], redis_client=None,
+                 top_n: int = CACHE_WARM_TOP_N, rate_per_minute: float = CACHE_WARM_PER_MINUTE,
+                 interval: float = CACHE_WARM_INTERVAL, debounce: float = CACHE_WARM_DEBOUNCE):
+        self.query_log = query_log
+        self.is_fresh = is_fresh
+        self.answer = answer
+        self.redis = redis_client
+        self.top_n = top_n
+        self.interval = interval
+        self.debounce = debounce
+        self.budget = TokenBucket(rate_per_minute, capacity=1)
+        self._forced: Set[Optional[str]] = set()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.rounds = 0
+        self.warmed = 0
+        self.fresh = 0
+        self.errors = 0
+        self.last_round: Optional[float] = None
+
+    def trigger(self, commune: Optional[str] = None):
+        """Documents of ``commune`` changed (``None``: documents of every commune)."""
+        self._forced.add(normalize_commune(commune) if commune else None)
+        self._wake.set()
+
+    async def run_once(self, forced: Optional[Set[Optional[str]]] = None) -> int:
+        forced = forced or set()
+        token = uuid.uuid4().hex
+        if self.redis is not None:
+            try:
+                if not await self.redis.set(WARM_LOCK_KEY, token, nx=True, px=max(1, int(self.interval * 1000))):
+                    return 0
+            except Exception as e:
+                logger.warning(f"⚠️ Verrou du préchauffage indisponible: {e}")
+        warmed = 0
+        try:
+            top = await asyncio.to_thread(self.query_log.top_questions, self.top_n)
+            for commune, questions in top.items():
+                # Questions without a commune see the documents of every commune
+                force = None in forced or commune in forced or (commune == "" and bool(forced))
+                for question, use_context, _ in questions:
+                    try:
+                        if not force and await self.is_fresh(commune, question, use_context):
+                            self.fresh += 1
+                            continue
+                        await self.budget.acquire()
+                        await self.answer(commune, question, use_context, force)
+                        warmed += 1
+                    except Exception as e:
+                        self.errors += 1
+                        logger.warning(f"⚠️ Préchauffage interrompu: {e}")
+                        return warmed
+        finally:
+            self.rounds += 1
+            self.warmed += warmed
+            self.last_round = time.time()
+            if self.redis is not None:
+                await release_lock(self.redis, WARM_LOCK_KEY, token)
+        if warmed:
+            logger.info(f"🔥 {warmed} réponses préchauffées")
+        return warmed
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+                # Let the other uploads of a batch arrive
+                await asyncio.sleep(self.debounce)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            forced, self._forced = self._forced, set()
+            try:
+                await self.run_once(forced)
+            except Exception as e:
+                logger.warning(f"⚠️ Préchauffage du cache impossible: {e}")
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        await cancel(self._task)
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rounds": self.rounds,
+            "warmed": self.warmed,
+            "fresh": self.fresh,
+            "errors": self.errors,
+            "pending_communes": len(self._forced),
+            "last_round": self.last_round,
+        }
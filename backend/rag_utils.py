@@ -1,82 +1,68 @@
-from typing import List
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-import httpx
 from dotenv import load_dotenv
 
-import chromadb
-from chromadb.utils import embedding_functions
+from batching import MicroBatcher
+from llm_client import get_llm_client
+from llm_router import LLMAnswer, ModelRouter
+from metrics import record, stage
+from retrieval import get_retrieval_service
 
 load_dotenv()
 
-MODEL_NAME = "all-MiniLM-L6-v2"
+# Snippets retrieved per question; the context packer keeps what fits in
+# CONTEXT_TOKEN_BUDGET, and hybrid fusion and reranking make the top few enough
+CONTEXT_TOP_K = int(os.getenv("CONTEXT_TOP_K", 6))
 
-# ChromaDB collection (shared with main.py)
+# Questions arriving within a few milliseconds share one forward pass and
+# one Chroma query (RETRIEVAL_BATCH_SIZE / RETRIEVAL_BATCH_WAIT_MS).
+embed_batcher = MicroBatcher(lambda texts: get_retrieval_service().embed(texts), name="embed")
+search_batcher = MicroBatcher(lambda queries: get_retrieval_service().search_hits_many(queries), name="search")
+# Fast or large model for each question, with the latency SLO and fallbacks
+model_router = ModelRouter()
 
-chroma_client = None
-_collection = None
 
+async def embed_question(question: str) -> List[float]:
+    """Encode a question, batched with concurrent requests."""
+    with stage("embed"):
+        return await embed_batcher.submit(question)
 
-def get_collection():
-    """Lazily initialize and return the ChromaDB collection."""
-    global chroma_client, _collection
-    if _collection is None:
-        chroma_client = chromadb.PersistentClient(path="./chroma_db")
-        embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=MODEL_NAME
-        )
-        _collection = chroma_client.get_or_create_collection(
-            name="urbanisme_docs",
-            embedding_function=embedding_function,
-        )
-    return _collection
 
+async def retrieve_context_batched(question: str, top_k: int = CONTEXT_TOP_K,
+                                   query_embedding: Optional[List[float]] = None,
+                                   where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Hybrid (vector + BM25) search going through the micro-batching queues.
 
-
-
-
-
-
-def retrieve_context(question: str, top_k: int = 5) -> List[str]:
-    """Return the most relevant snippets for a question using ChromaDB."""
+    Returns the scored hits (``id``, ``text``, ``metadata``, ``score``, ``similarity``,
+    ``keyword_score``), best first.
+    """
     try:
-        col = get_collection()
-        results = col.query(query_texts=[question], n_results=top_k)
-        return results.get("documents", [[]])[0]
+        if query_embedding is None:
+            query_embedding = await embed_question(question)
+        with stage("search"):
+            return await search_batcher.submit((question, query_embedding, top_k, where))
     except Exception:
         return []
 
 
-async def generate_llm_answer(question: str, context: str, api_key: str) -> str:
-    """Call the Groq API using httpx and return the answer."""
-    if not api_key:
-        return ""
-
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {api_key}"}
-
-    messages = [
-        {
-            "role": "system",
-            "content": (
-                "Tu es un assistant expert en urbanisme et architecture. "
-                "Utilise le contexte fourni pour r\u00e9pondre de mani\u00e8re pr\u00e9cise."
-            ),
-        }
-    ]
-    if context:
-        messages.append({"role": "user", "content": f"Contexte:\n{context}\n\nQuestion: {question}"})
-    else:
-        messages.append({"role": "user", "content": question})
-
-    payload = {
-        "model": "mixtral-8x7b-32768",
-        "messages": messages,
-        "temperature": 0.3,
-        "max_tokens": 1024,
-    }
-
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
+async def generate_llm_answer(question: str, context: str, api_key: str) -> LLMAnswer:
+    """Answer through the model router and the shared pooled client (offline without a key)."""
+    client = get_llm_client(api_key) if api_key else None
+    with stage("llm_total"):
+        return await model_router.complete(client, question, context)
+
+
+async def stream_llm_answer(question: str, context: str, api_key: str,
+                            answer: Optional[LLMAnswer] = None) -> AsyncIterator[str]:
+    """Yield the answer token by token; ``answer`` receives the model used and the text."""
+    client = get_llm_client(api_key) if api_key else None
+    start = time.perf_counter()
+    first = True
+    async for token in model_router.stream(client, question, context, answer):
+        if first:
+            record("llm_first_token", time.perf_counter() - start)
+            first = False
+        yield token
+    record("llm_total", time.perf_counter() - start)
@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import resource
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from embedding_cache import EMBEDDING_CACHE_DIR, CachedEmbeddingFunction, EmbeddingCache
+from hybrid import HYBRID_CANDIDATES, BM25Index, Reranker, rrf_scores
+from retrieval_client import RETRIEVAL_SERVICE_URL, RemoteRetrievalService
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+COLLECTION_NAME = "urbanisme_docs"
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+# "onnx" uses Chroma's ONNX export of MiniLM (onnxruntime, no torch)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+INDEX_LOAD_PAGE_SIZE = 1000
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MiB."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RetrievalService:
+    """Process-wide owner of the embedding model, Chroma client and collection.
+
+    The upload and query paths both go through the same instance so a worker
+    holds a single copy of the model and a single handle on the store. Chunks
+    are written through :meth:`add`, :meth:`update` and :meth:`delete` so the
+    BM25 keyword index stays in step with Chroma.
+
+    ChromaDB and the model are imported here rather than at module level so
+    the app can be imported (and answer ``/health``) before they are loaded;
+    :attr:`timings` records how long each part took.
+    """
+
+    def __init__(self, path: str = CHROMA_PATH, model_name: str = MODEL_NAME,
+                 collection_name: str = COLLECTION_NAME, reranker: Optional[Reranker] = None,
+                 cache_dir: str = EMBEDDING_CACHE_DIR, backend: str = EMBEDDING_BACKEND):
+        start = time.perf_counter()
+        rss_before = current_rss_mb()
+        self.timings: Dict[str, float] = {}
+
+        with self._timed("chroma"):
+            import chromadb
+            from chromadb.utils import embedding_functions
+            self.client = chromadb.PersistentClient(path=path)
+
+        with self._timed("model"):
+            if backend == "onnx":
+                model = embedding_functions.ONNXMiniLM_L6_V2()
+                model_name = f"{model_name}-onnx"
+            else:
+                model = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+        self.model_name = model_name
+
+        # The collection keeps the plain model (its persisted configuration);
+        # chunks and questions are encoded here through the on-disk cache.
+        self.embedding_cache = EmbeddingCache(cache_dir, model_name=model_name)
+        self.embedding_function = CachedEmbeddingFunction(model, self.embedding_cache)
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name,
+            embedding_function=model,
+        )
+        with self._timed("keyword_index"):
+            self.keyword_index = BM25Index()
+            self._load_keyword_index()
+        self.reranker = reranker or Reranker()
+
+        self.startup_seconds = time.perf_counter() - start
+        self.startup_rss_mb = current_rss_mb() - rss_before
+        logger.info(
+            f"✅ Service de recherche prêt en {self.startup_seconds:.2f}s "
+            f"(+{self.startup_rss_mb:.0f} Mo)"
+        )
+
+    @contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
+        yield
+        self.timings[name] = round(time.perf_counter() - start, 3)
+
+    def warm_up(self):
+        """Encode once through the model itself, bypassing the cache.
+
+        The first forward pass initialises the backend; doing it here keeps
+        that cost off the first real question.
+        """
+        with self._timed("first_encode"):
+            self.embedding_function.inner(["préchauffage"])
+
+    def _load_keyword_index(self):
+        """Fill the BM25 index from Chroma, page by page.
+
+        Chunks indexed before communes were recorded have no ``commune``
+        key, which the ``$in`` filter of :func:`scopes.build_where` never
+        matches: they are tagged ``""`` (any commune) on the way.
+        """
+        offset = 0
+        backfilled = 0
+        while True:
+            page = self.collection.get(
+                include=["documents", "metadatas"], limit=INDEX_LOAD_PAGE_SIZE, offset=offset
+            )
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            metadatas = [dict(meta or {}) for meta in page.get("metadatas") or [{} for _ in ids]]
+            untagged = [i for i, meta in enumerate(metadatas) if "commune" not in meta]
+            for i in untagged:
+                metadatas[i]["commune"] = ""
+            if untagged:
+                self.collection.update(ids=[ids[i] for i in untagged], metadatas=[metadatas[i] for i in untagged])
+                backfilled += len(untagged)
+            self.keyword_index.add(ids, page["documents"], metadatas)
+            offset += len(ids)
+        if backfilled:
+            logger.info(f"🏷️ {backfilled} chunks sans commune marqués valables pour toutes les communes")
+
+    def add(self, documents: List[str], ids: List[str], metadatas: List[Dict[str, Any]],
+            embeddings: Optional[List[Any]] = None):
+        """Store chunks; known ``embeddings`` skip the model and the cache."""
+        if embeddings is None:
+            embeddings = self.embed(documents)
+        self.collection.add(documents=documents, ids=ids, metadatas=metadatas, embeddings=embeddings)
+        self.keyword_index.add(ids, documents, metadatas)
+
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        self.collection.update(ids=ids, metadatas=metadatas)
+        self.keyword_index.update_metadata(ids, metadatas)
+
+    def get(self, **kwargs) -> Dict[str, Any]:
+        return self.collection.get(**kwargs)
+
+    def delete(self, ids: List[str]):
+        self.collection.delete(ids=ids)
+        self.keyword_index.remove(ids)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Encode texts, cached ones from disk and the rest in one forward pass."""
+        return self.embedding_function(texts)
+
+    def search_many(
+        self, queries: Sequence[Tuple[str, List[float], int, Optional[Dict[str, Any]]]]
+    ) -> List[List[str]]:
+        """Texts of :meth:`search_hits_many`."""
+        return [[hit["text"] for hit in hits] for hits in self.search_hits_many(queries)]
+
+    def search_hits_many(
+        self, queries: Sequence[Tuple[str, List[float], int, Optional[Dict[str, Any]]]]
+    ) -> List[List[Dict[str, Any]]]:
+        """Hybrid search for ``(question, embedding, top_k, where)`` tuples.
+
+        Vector hits come from one Chroma multi-query per distinct filter
+        (Chroma applies ``where`` before the vector search), keyword hits
+        from the BM25 index; both rankings are fused with RRF and the head
+        is optionally reranked by the cross-encoder. Each hit is a dict with
+        ``id``, ``text``, ``metadata``, its fused ``score`` (a rank, not a
+        relevance) and the relevance signals behind it: the cosine
+        ``similarity`` of vector hits and the BM25 ``keyword_score`` of
+        keyword hits, ``None`` when the hit came from the other search.
+        """
+        groups: Dict[str, List[int]] = {}
+        for i, (_, _, _, where) in enumerate(queries):
+            groups.setdefault(json.dumps(where, sort_keys=True), []).append(i)
+
+        vector_hits: List[List[Tuple[str, str, Dict[str, Any], Optional[float]]]] = [[] for _ in queries]
+        for indexes in groups.values():
+            where = queries[indexes[0]][3]
+            found = self.collection.query(
+                query_embeddings=[queries[i][1] for i in indexes],
+                n_results=max(HYBRID_CANDIDATES, *(queries[i][2] for i in indexes)),
+                where=where or None,
+                include=["documents", "metadatas", "distances"],
+            )
+            documents = found.get("documents") or [[] for _ in indexes]
+            ids = found.get("ids") or [[] for _ in indexes]
+            metadatas = found.get("metadatas") or [[{} for _ in doc_ids] for doc_ids in ids]
+            distances = found.get("distances") or [[None for _ in doc_ids] for doc_ids in ids]
+            for i, doc_ids, docs, metas, dists in zip(indexes, ids, documents, metadatas, distances):
+                vector_hits[i] = list(zip(doc_ids, docs, metas, dists))
+
+        results = []
+        for (question, _, top_k, where), hits in zip(queries, vector_hits):
+            found = {doc_id: (text, meta or {}) for doc_id, text, meta, _ in hits}
+            # MiniLM vectors are unit length: Chroma's squared L2 distance is 2 - 2 cos
+            similarity = {doc_id: 1 - distance / 2 for doc_id, _, _, distance in hits if distance is not None}
+            keyword = dict(self.keyword_index.search(question, max(HYBRID_CANDIDATES, top_k), where))
+            scores = rrf_scores([[doc_id for doc_id, _, _, _ in hits], list(keyword)])
+            candidates = []
+            for doc_id in sorted(scores, key=lambda doc_id: scores[doc_id], reverse=True):
+                text, meta = found.get(doc_id) or (
+                    self.keyword_index.document(doc_id), self.keyword_index.metadata(doc_id)
+                )
+                if text is not None:
+                    candidates.append((doc_id, text))
+                    found[doc_id] = (text, meta or {})
+            results.append([
+                {"id": doc_id, "text": text, "metadata": found[doc_id][1], "score": scores[doc_id],
+                 "similarity": similarity.get(doc_id), "keyword_score": keyword.get(doc_id)}
+                for doc_id, text in self.reranker.rerank(question, candidates, top_k)
+            ])
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "startup_seconds": round(self.startup_seconds, 3),
+            "startup_rss_mb": round(self.startup_rss_mb, 1),
+            "startup_timings": dict(self.timings),
+            "rss_mb": round(current_rss_mb(), 1),
+            "documents": self.collection.count(),
+            "keyword_index": len(self.keyword_index),
+            "rerank": self.reranker.stats(),
+            "embedding_cache": self.embedding_cache.stats(),
+        }
+
+
+_service: Optional[RetrievalService] = None
+
+
+def create_retrieval_service():
+    """The service of this process, or a client of the shared one.
+
+    With ``RETRIEVAL_SERVICE_URL`` every worker uses the process started by
+    ``retrieval_server.py`` instead of loading its own model and store.
+    """
+    if RETRIEVAL_SERVICE_URL:
+        return RemoteRetrievalService(RETRIEVAL_SERVICE_URL)
+    return RetrievalService()
+
+
+def get_retrieval_service() -> RetrievalService:
+    """Return the shared service, creating it on first use outside the app."""
+    global _service
+    if _service is None:
+        _service = create_retrieval_service()
+    return _service
+
+
+def set_retrieval_service(service: Optional[RetrievalService]):
+    """Install (or clear) the shared service; called by the app lifespan."""
+    global _service
+    _service = service
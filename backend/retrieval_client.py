@@ -0,0 +1,146 @@
+import logging
+import os
+import queue
+import time
+from multiprocessing.connection import Client, Connection
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# unix:///chemin/vers/socket or tcp://127.0.0.1:8100
+RETRIEVAL_SERVICE_URL = os.getenv("RETRIEVAL_SERVICE_URL", "")
+# Required: the service unpickles what it receives, the key is all that guards it
+RETRIEVAL_SERVICE_KEY = os.getenv("RETRIEVAL_SERVICE_KEY", "")
+RETRIEVAL_SERVICE_TIMEOUT = float(os.getenv("RETRIEVAL_SERVICE_TIMEOUT", 60))
+# How long a worker waits for the service to load the model and Chroma
+RETRIEVAL_SERVICE_STARTUP_TIMEOUT = float(os.getenv("RETRIEVAL_SERVICE_STARTUP_TIMEOUT", 300))
+CONNECT_RETRY_DELAY = 0.2
+
+
+class RetrievalServiceError(RuntimeError):
+    """Raised in a worker when the shared retrieval service failed a call."""
+
+
+def parse_address(url: str):
+    """``multiprocessing.connection`` address of ``unix://`` or ``tcp://`` URL."""
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return parsed.path
+    if parsed.scheme == "tcp" and parsed.hostname and parsed.port:
+        return parsed.hostname, parsed.port
+    raise ValueError(f"RETRIEVAL_SERVICE_URL invalide: {url!r} (unix:///socket ou tcp://hôte:port)")
+
+
+def check_authkey(authkey: str) -> bytes:
+    """``authkey`` as bytes; refuses to connect or listen without one."""
+    if not authkey:
+        raise ValueError("RETRIEVAL_SERVICE_KEY manquante : définir un secret partagé par le service et les workers")
+    return authkey.encode()
+
+
+class _RemoteEmbeddingCache:
+    """``embedding_cache`` of a remote service: the server owns and flushes the cache."""
+
+    def __init__(self, service: "RemoteRetrievalService"):
+        self.service = service
+
+    def stats(self) -> Dict[str, Any]:
+        return self.service._call("embedding_cache_stats")
+
+    def flush(self):
+        pass
+
+
+class RemoteRetrievalService:
+    """Client of ``retrieval_server``, with the interface of ``RetrievalService``.
+
+    Every API worker talks to the one server process that holds the model,
+    the Chroma client and the BM25 index, so memory does not grow with the
+    number of workers and a single process writes to the store. Calls block
+    like the local ones (they already run in executor threads); each thread
+    borrows its own connection from a small pool.
+    """
+
+    def __init__(self, url: str = RETRIEVAL_SERVICE_URL, authkey: str = RETRIEVAL_SERVICE_KEY,
+                 timeout: float = RETRIEVAL_SERVICE_TIMEOUT):
+        self.url = url
+        self.address = parse_address(url)
+        self.authkey = check_authkey(authkey)
+        self.timeout = timeout
+        self.model_name = "remote"
+        self.embedding_cache = _RemoteEmbeddingCache(self)
+        self._pool: "queue.LifoQueue[Connection]" = queue.LifoQueue()
+
+    def _connect(self) -> Connection:
+        return Client(self.address, authkey=self.authkey)
+
+    def _call(self, method: str, *args, **kwargs) -> Any:
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            conn.send((method, args, kwargs))
+            if not conn.poll(self.timeout):
+                raise TimeoutError(f"Service de recherche: pas de réponse à {method} après {self.timeout}s")
+            status, result = conn.recv()
+        except BaseException:
+            # The connection may still hold a late reply: never reuse it
+            conn.close()
+            raise
+        self._pool.put(conn)
+        if status == "error":
+            raise RetrievalServiceError(result)
+        return result
+
+    def warm_up(self):
+        """Wait until the server answers, i.e. its model and store are loaded."""
+        deadline = time.monotonic() + RETRIEVAL_SERVICE_STARTUP_TIMEOUT
+        while True:
+            try:
+                self._call("ping")
+                return
+            except (OSError, EOFError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(CONNECT_RETRY_DELAY)
+
+    def add(self, documents: List[str], ids: List[str], metadatas: List[Dict[str, Any]],
+            embeddings: Optional[List[Any]] = None):
+        self._call("add", documents, ids, metadatas, embeddings)
+
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        self._call("update", ids, metadatas)
+
+    def get(self, **kwargs) -> Dict[str, Any]:
+        return self._call("get", **kwargs)
+
+    def delete(self, ids: List[str]):
+        self._call("delete", ids)
+
+    def count(self) -> int:
+        return self._call("count")
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return self._call("embed", list(texts))
+
+    def search_many(
+        self, queries: Sequence[Tuple[str, List[float], int, Optional[Dict[str, Any]]]]
+    ) -> List[List[str]]:
+        return [[hit["text"] for hit in hits] for hits in self.search_hits_many(queries)]
+
+    def search_hits_many(
+        self, queries: Sequence[Tuple[str, List[float], int, Optional[Dict[str, Any]]]]
+    ) -> List[List[Dict[str, Any]]]:
+        return self._call("search_hits_many", [tuple(query) for query in queries])
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._call("stats"), "remote": self.url}
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
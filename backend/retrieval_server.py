@@ -0,0 +1,182 @@
+"""Shared retrieval service for multi-worker deployments.
+
+One process loads the embedding model, ChromaDB and the BM25 index; the
+API workers started with ``RETRIEVAL_SERVICE_URL`` send it their embedding,
+search and write calls over a local socket::
+
+    export RETRIEVAL_SERVICE_KEY=$(python -c 'import secrets; print(secrets.token_hex(16))')
+    python retrieval_server.py --url unix:///tmp/urbanisme-retrieval.sock
+    RETRIEVAL_SERVICE_URL=unix:///tmp/urbanisme-retrieval.sock \\
+        uvicorn main:app --workers 4
+
+Questions arriving from different workers within a few milliseconds share
+one forward pass and one Chroma query (``RETRIEVAL_BATCH_WAIT_MS``).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection, Listener
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batching import MicroBatcher  # noqa: E402
+from retrieval_client import (  # noqa: E402
+    RETRIEVAL_SERVICE_KEY, RETRIEVAL_SERVICE_URL, check_authkey, parse_address
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URL = "unix:///tmp/urbanisme-retrieval.sock"
+
+
+class RetrievalServer:
+    """Serves one ``RetrievalService`` to several API workers.
+
+    Each worker connection is handled by its own thread. Embedding and
+    search calls go through server-side micro-batchers, so concurrent
+    questions from every worker are encoded and searched together; writes
+    and reads are forwarded to the service as they come.
+    """
+
+    METHODS = ("add", "update", "get", "delete", "count")
+
+    def __init__(self, service, url: str, authkey: str = RETRIEVAL_SERVICE_KEY):
+        self.service = service
+        self.url = url
+        self.address = parse_address(url)
+        authkey = check_authkey(authkey)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            # Left behind by a previous run
+            os.unlink(self.address)
+        self.listener = Listener(self.address, authkey=authkey)
+        self.started_at = time.time()
+        self.connections = 0
+        self.calls = 0
+        self._closed = False
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="batching", daemon=True)
+        self._loop_thread.start()
+        self.embed_batcher = MicroBatcher(service.embed, name="embed")
+        self.search_batcher = MicroBatcher(service.search_hits_many, name="search")
+
+    def _batched(self, batcher: MicroBatcher, items: List[Any]) -> List[Any]:
+        async def submit_all():
+            return await asyncio.gather(*(batcher.submit(item) for item in items))
+        return asyncio.run_coroutine_threadsafe(submit_all(), self._loop).result()
+
+    def dispatch(self, method: str, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        self.calls += 1
+        if method == "ping":
+            return True
+        if method == "embed":
+            return self._batched(self.embed_batcher, *args)
+        if method == "search_hits_many":
+            return self._batched(self.search_batcher, *args)
+        if method == "embedding_cache_stats":
+            return self.service.embedding_cache.stats()
+        if method == "stats":
+            return {**self.service.stats(), "server": self.stats()}
+        if method in self.METHODS:
+            return getattr(self.service, method)(*args, **kwargs)
+        raise ValueError(f"Méthode inconnue: {method}")
+
+    def _serve_connection(self, conn: Connection):
+        with conn:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ("ok", self.dispatch(method, args, kwargs))
+                except Exception as e:
+                    logger.warning(f"⚠️ Service de recherche - {method}: {e}")
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+
+    def serve_forever(self):
+        logger.info(f"✅ Service de recherche à l'écoute sur {self.url}")
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                if self._closed:
+                    return
+                raise
+            except Exception as e:
+                # Wrong authkey or a client that hung up during the handshake
+                logger.warning(f"⚠️ Connexion refusée: {e}")
+                continue
+            self.connections += 1
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def start(self) -> threading.Thread:
+        """Serve from a background thread (tests, embedding in another process)."""
+        thread = threading.Thread(target=self.serve_forever, name="retrieval-server", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "uptime": round(time.time() - self.started_at, 1),
+            "connections": self.connections,
+            "calls": self.calls,
+            "batching": {"embed": self.embed_batcher.stats(), "search": self.search_batcher.stats()},
+        }
+
+    def close(self):
+        self._closed = True
+        self.listener.close()
+        self.embed_batcher.shutdown()
+        self.search_batcher.shutdown()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5)
+        self._loop.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=RETRIEVAL_SERVICE_URL or DEFAULT_URL,
+                        help="unix:///chemin/socket ou tcp://hôte:port")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        # Before loading the model: nothing to serve without a key
+        check_authkey(RETRIEVAL_SERVICE_KEY)
+    except ValueError as e:
+        logger.error(f"❌ {e}")
+        return 1
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+
+    from retrieval import RetrievalService
+    service = RetrievalService()
+    service.warm_up()
+    server = RetrievalServer(service, args.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        service.embedding_cache.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
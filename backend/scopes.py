@@ -0,0 +1,54 @@
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+GLOBAL_SESSION = "global"
+# Chunks of a session no longer re-uploaded for this long are swept (0 = never)
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", 168))
+
+
+def normalize_commune(commune: Optional[str]) -> str:
+    """Canonical commune name stored in chunk metadata ("" = any commune)."""
+    return " ".join((commune or "").split()).lower()
+
+
+def session_expiry(session_id: Optional[str], now: Optional[float] = None) -> Optional[int]:
+    """``expires_at`` stored on a session's chunks, ``None`` for global ones."""
+    if not session_id or session_id == GLOBAL_SESSION or SESSION_TTL_HOURS <= 0:
+        return None
+    return int((now or time.time()) + SESSION_TTL_HOURS * 3600)
+
+
+def build_where(session_id: Optional[str] = None, commune: Optional[str] = None) -> Dict[str, Any]:
+    """Chroma metadata filter restricting a search to what a request may see.
+
+    Global documents are always visible, session documents only to their
+    session; with a commune, only documents for that commune or for no
+    particular commune are searched.
+    """
+    if session_id and session_id != GLOBAL_SESSION:
+        clauses: List[Dict[str, Any]] = [{"session_id": {"$in": [GLOBAL_SESSION, session_id]}}]
+    else:
+        clauses = [{"session_id": GLOBAL_SESSION}]
+    commune = normalize_commune(commune)
+    if commune:
+        clauses.append({"commune": {"$in": [commune, ""]}})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def matches_where(where: Dict[str, Any], metadata: Dict[str, Any]) -> bool:
+    """Evaluate a :func:`build_where` filter against one chunk's metadata."""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(clause, metadata) for clause in condition):
+                return False
+        elif isinstance(condition, dict) and "$in" in condition:
+            if metadata.get(key) not in condition["$in"]:
+                return False
+        elif isinstance(condition, dict) and "$lt" in condition:
+            value = metadata.get(key)
+            if value is None or not value < condition["$lt"]:
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
@@ -0,0 +1,106 @@
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 1000))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 86400))
+HISTOGRAM_BINS = [0.0, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0]
+
+
+class _Scope:
+    """Normalised question embeddings and answers for one commune."""
+
+    def __init__(self, dim: int, capacity: int, generation: str = ""):
+        self.generation = generation
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.entries: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.expires = np.zeros(capacity, dtype=np.float64)
+        self.next = 0
+
+
+class SemanticCache:
+    """Reuses answers to questions whose embedding is close to a previous one.
+
+    Lookups take the query embedding already computed for retrieval, so a hit
+    costs one matrix-vector product and no model call. Each scope (commune)
+    is a fixed-size ring buffer, the oldest answer being overwritten first.
+    Answers are stored with the corpus generation they were built from: a
+    lookup or store under another generation finds the scope empty.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 capacity: int = SEMANTIC_CACHE_SIZE, ttl: int = SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self._scopes: Dict[str, _Scope] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.histogram = [0] * (len(HISTOGRAM_BINS) - 1)
+
+    @staticmethod
+    def _normalise(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope: str, embedding: Sequence[float], generation: str = "") -> Optional[Dict[str, Any]]:
+        """Return a copy of the closest cached answer above the threshold."""
+        self.lookups += 1
+        entry = self._scopes.get(scope)
+        if entry is None or entry.generation != generation:
+            return None
+
+        similarities = entry.vectors @ self._normalise(embedding)
+        similarities[entry.expires < time.time()] = -np.inf
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity == -np.inf:
+            return None
+        self._record(similarity)
+        if similarity < self.threshold:
+            return None
+
+        self.hits += 1
+        return {**entry.entries[best], "similarity": similarity}
+
+    def store(self, scope: str, embedding: Sequence[float], response: Dict[str, Any], generation: str = ""):
+        vector = self._normalise(embedding)
+        entry = self._scopes.get(scope)
+        if entry is None or entry.generation != generation:
+            entry = self._scopes[scope] = _Scope(len(vector), self.capacity, generation)
+        slot = entry.next
+        entry.vectors[slot] = vector
+        entry.entries[slot] = dict(response)
+        entry.expires[slot] = time.time() + self.ttl
+        entry.next = (slot + 1) % self.capacity
+
+    def scopes(self) -> List[str]:
+        return list(self._scopes)
+
+    def clear(self, scope: Optional[str] = None):
+        if scope is None:
+            self._scopes.clear()
+        else:
+            self._scopes.pop(scope, None)
+
+    def _record(self, similarity: float):
+        for i in range(len(self.histogram)):
+            if similarity < HISTOGRAM_BINS[i + 1] or i == len(self.histogram) - 1:
+                self.histogram[i] += 1
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "similarity_histogram": {
+                f"{low:.2f}-{high:.2f}": count
+                for low, high, count in zip(HISTOGRAM_BINS, HISTOGRAM_BINS[1:], self.histogram)
+            },
+        }
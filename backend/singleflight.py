@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LOCK_TTL_MS = int(os.getenv("SINGLEFLIGHT_LOCK_TTL_MS", 30000))
+LOCK_POLL_INTERVAL = 0.05
+
+# Release the lock only if we still own it (it may have expired and been retaken)
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+async def release_lock(redis_client, key: str, token: str):
+    """Delete the lock ``key`` if it still holds ``token``, atomically; errors are ignored."""
+    try:
+        await redis_client.eval(_RELEASE_SCRIPT, 1, key, token)
+    except Exception:
+        pass
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one execution.
+
+    Inside a worker, followers await the leader's future. Across workers, the
+    leader also holds a short Redis lock (``SET NX PX``); a worker that finds
+    the lock taken polls ``wait_for_result`` until the other worker publishes
+    its answer or the lock expires, then runs the call itself.
+    """
+
+    def __init__(self, redis_client=None, lock_ttl_ms: int = LOCK_TTL_MS):
+        self.redis = redis_client
+        self.lock_ttl_ms = lock_ttl_ms
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        wait_for_result: Optional[Callable[[], Awaitable[Optional[Any]]]] = None,
+    ) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            self.followers += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.leaders += 1
+        try:
+            result = await self._run_locked(key, fn, wait_for_result)
+        except BaseException as e:
+            future.set_exception(e)
+            # Followers re-raise it; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _run_locked(self, key, fn, wait_for_result):
+        if self.redis is None or wait_for_result is None:
+            return await fn()
+
+        lock_key = f"lock:{key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis.set(lock_key, token, nx=True, px=self.lock_ttl_ms)
+        except Exception as e:
+            logger.warning(f"⚠️ Verrou Redis indisponible: {e}")
+            return await fn()
+
+        if not acquired:
+            deadline = time.monotonic() + self.lock_ttl_ms / 1000
+            while time.monotonic() < deadline:
+                # Check the lock before the result: the owner publishes first
+                lock_held = await self.redis.exists(lock_key)
+                result = await wait_for_result()
+                if result is not None:
+                    return result
+                if not lock_held:
+                    break
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+            return await fn()
+
+        try:
+            return await fn()
+        finally:
+            await release_lock(self.redis, lock_key, token)
+
+    def pending(self, key: str) -> Optional[asyncio.Future]:
+        """Return the future of an in-flight call for ``key``, if any."""
+        future = self._inflight.get(key)
+        return asyncio.shield(future) if future is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        return {"leaders": self.leaders, "followers": self.followers, "inflight": len(self._inflight)}
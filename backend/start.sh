@@ -0,0 +1,25 @@
+#!/bin/sh
+# Démarrage du conteneur. Avec WEB_CONCURRENCY > 1, un seul processus charge
+# le modèle d'embeddings et ChromaDB (retrieval_server.py) et les workers
+# uvicorn l'interrogent par une socket locale.
+set -e
+
+WORKERS="${WEB_CONCURRENCY:-1}"
+
+if [ "$WORKERS" -gt 1 ] && [ -z "$RETRIEVAL_SERVICE_URL" ]; then
+    export RETRIEVAL_SERVICE_URL="unix:///tmp/urbanisme-retrieval.sock"
+    if [ -z "$RETRIEVAL_SERVICE_KEY" ]; then
+        RETRIEVAL_SERVICE_KEY="$(python -c 'import secrets; print(secrets.token_hex(16))')"
+        export RETRIEVAL_SERVICE_KEY
+    fi
+    python retrieval_server.py &
+fi
+
+if [ "$WORKERS" -gt 1 ]; then
+    # /metrics additionne les valeurs de tous les workers
+    export METRICS_SHARED_DIR="${METRICS_SHARED_DIR:-/tmp/urbanisme-metrics}"
+    rm -rf "$METRICS_SHARED_DIR"
+    mkdir -p "$METRICS_SHARED_DIR"
+fi
+
+exec uvicorn main:app --host 0.0.0.0 --port "${PORT:-8000}" --workers "$WORKERS"
@@ -0,0 +1,43 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StartupState:
+    """Liveness/readiness of the worker and the duration of each startup phase.
+
+    The process is live as soon as the app is imported; it becomes ready once
+    the background warm-up (Chroma, embedding model, first encode) is done.
+    """
+
+    def __init__(self):
+        self.created_at = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+
+    def record(self, phase: str, seconds: float):
+        self.timings[phase] = round(seconds, 3)
+        logger.info(f"⏱️ Démarrage - {phase}: {seconds:.2f}s")
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_ready(self):
+        self.ready = True
+        self.record("ready", time.perf_counter() - self.created_at)
+
+    def fail(self, error: Exception):
+        self.error = str(error)
+        logger.error(f"❌ Échec du préchauffage: {error}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "error": self.error, "timings": dict(self.timings)}
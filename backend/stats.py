@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from typing import Dict, List, Optional
+
+from periodic import cancel, periodic
+
+logger = logging.getLogger(__name__)
+
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", 1.0))
+STATS_PREFIX = "stats:"
+
+
+class StatsRecorder:
+    """Usage counters batched locally and flushed to Redis in one MULTI.
+
+    ``incr`` never touches the network, so counting a query costs nothing on
+    the request path; a background task sends the accumulated deltas every
+    ``STATS_FLUSH_INTERVAL`` seconds with a single pipelined round trip.
+    """
+
+    def __init__(self, redis_client=None, interval: float = STATS_FLUSH_INTERVAL):
+        self.redis = redis_client
+        self.interval = interval
+        self._pending: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def incr(self, name: str, amount: int = 1):
+        self._pending[name] += amount
+
+    async def flush(self):
+        if self.redis is None or not self._pending:
+            return
+        pending, self._pending = self._pending, Counter()
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for name, amount in pending.items():
+                    pipe.incrby(f"{STATS_PREFIX}{name}", amount)
+                await pipe.execute()
+        except Exception as e:
+            # Keep the deltas for the next attempt
+            self._pending.update(pending)
+            logger.warning(f"⚠️ Impossible d'enregistrer les stats: {e}")
+
+    async def read(self, names: List[str]) -> Dict[str, int]:
+        """Current value of each counter (one MGET plus the unflushed deltas)."""
+        values = [0] * len(names)
+        if self.redis is not None:
+            try:
+                raw = await self.redis.mget([f"{STATS_PREFIX}{name}" for name in names])
+                values = [int(v or 0) for v in raw]
+            except Exception:
+                logger.warning("Impossible de récupérer les stats")
+        return {name: value + self._pending[name] for name, value in zip(names, values)}
+
+    def start(self):
+        if self.redis is not None and self._task is None:
+            self._task = periodic(self.interval, self.flush)
+
+    async def stop(self):
+        await cancel(self._task)
+        self._task = None
+        await self.flush()
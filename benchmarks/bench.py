@@ -0,0 +1,267 @@
+"""Reproducible API benchmarks.
+
+Starts the FastAPI app in-process (no server, no Groq key) with a mock LLM
+answering after a fixed delay, runs each scenario at several concurrency
+levels and writes the results as JSON so two commits can be compared::
+
+    python benchmarks/bench.py --output before.json
+    python benchmarks/bench.py --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT / "backend"
+
+QUESTIONS = [
+    "Quelle est la hauteur maximale en zone UB ?",
+    "Quelle est l'emprise au sol autorisée en zone UC ?",
+    "Quels sont les reculs obligatoires par rapport à la voirie ?",
+    "Peut-on construire une piscine en zone N ?",
+    "Combien de places de stationnement par logement ?",
+]
+
+DOCUMENT = (
+    "ARTICLE UB 10 - HAUTEUR MAXIMALE DES CONSTRUCTIONS\n"
+    "La hauteur des constructions ne peut excéder 12 mètres au faîtage (R+3).\n"
+    "ARTICLE UB 9 - EMPRISE AU SOL\n"
+    "L'emprise au sol des constructions ne peut excéder 60% de la superficie du terrain.\n"
+    "ARTICLE UB 6 - IMPLANTATION PAR RAPPORT AUX VOIES\n"
+    "Les constructions doivent être implantées avec un recul minimum de 5 mètres.\n"
+)
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile (``p`` in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered), max(1, math.ceil(p / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def summarize(scenario: str, concurrency: int, latencies: List[float], errors: int, wall_time: float) -> Dict[str, Any]:
+    """Latency percentiles and wall-clock throughput of one run."""
+    completed = len(latencies) + errors
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": completed,
+        "errors": errors,
+        "mean": statistics.mean(latencies) if latencies else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "wall_time": wall_time,
+        # Requests completed per second of wall-clock time, not per max latency
+        "throughput_rps": completed / wall_time if wall_time > 0 else None,
+    }
+
+
+def mock_llm_transport(latency_ms: float) -> httpx.MockTransport:
+    """Local stand-in for the Groq API, streaming and non-streaming."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency_ms / 1000)
+        body = json.loads(request.content)
+        answer = "D'après le règlement, la hauteur maximale est de 12 mètres."
+        if body.get("stream"):
+            events = "".join(
+                f"data: {json.dumps({'choices': [{'delta': {'content': word + ' '}}]})}\n\n"
+                for word in answer.split()
+            )
+            return httpx.Response(200, text=events + "data: [DONE]\n\n")
+        return httpx.Response(200, json={"choices": [{"message": {"content": answer}}]})
+
+    return httpx.MockTransport(handler)
+
+
+async def run_level(name: str, concurrency: int, requests: int,
+                    call: Callable[[int], Awaitable[None]]) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call(i)
+            except Exception:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(name, concurrency, latencies, errors, time.perf_counter() - start)
+
+
+class Bench:
+    """Scenarios against an in-process app."""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.run_id = uuid.uuid4().hex[:8]
+
+    async def _check(self, response: httpx.Response) -> httpx.Response:
+        response.raise_for_status()
+        return response
+
+    async def upload(self, i: int, session_id: Optional[str] = None):
+        files = {"file": (f"plu_{self.run_id}_{i}.txt", DOCUMENT * 20, "text/plain")}
+        data = {"session_id": session_id} if session_id else {}
+        job = (await self._check(await self.client.post("/api/upload", files=files, data=data))).json()
+        while job["status"] not in ("done", "failed"):
+            await asyncio.sleep(0.01)
+            job = (await self._check(await self.client.get(f"/api/upload/{job['job_id']}"))).json()
+        if job["status"] == "failed":
+            raise RuntimeError(job["error"])
+
+    async def query(self, question: str, use_context: bool, stream: bool = False):
+        payload = {"question": question, "commune": f"bench-{self.run_id}", "use_context": use_context}
+        path = "/api/query/stream" if stream else "/api/query"
+        await self._check(await self.client.post(path, json=payload))
+
+    def cold_question(self, i: int) -> str:
+        # Unique wording so neither the exact nor the semantic cache can answer
+        return f"{QUESTIONS[i % len(QUESTIONS)]} (variante {self.run_id}-{i}-{uuid.uuid4().hex[:6]})"
+
+    async def stats(self, i: int):
+        await self._check(await self.client.get("/api/stats"))
+
+    async def delete(self, i: int):
+        await self._check(await self.client.delete(f"/api/documents/bench-{self.run_id}-{i}"))
+
+
+async def run_benchmarks(levels: List[int], requests: int, llm_latency_ms: float) -> List[Dict[str, Any]]:
+    sys.path.insert(0, str(BACKEND_DIR))
+    import main
+    from llm_client import GroqClient, get_llm_client, set_llm_client
+
+    results = []
+    async with main.lifespan(main.app):
+        await get_llm_client(main.GROQ_API_KEY).aclose()
+        set_llm_client(GroqClient(
+            main.GROQ_API_KEY,
+            requests_per_minute=10 ** 9,
+            max_concurrency=max(levels),
+            transport=mock_llm_transport(llm_latency_ms),
+        ))
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            # The model loads in the background; wait until the worker is ready
+            while (await client.get("/health/ready")).status_code == 503:
+                if main.startup.error:
+                    raise RuntimeError(main.startup.error)
+                await asyncio.sleep(0.05)
+            bench = Bench(client)
+            await bench.upload(0)
+
+            for concurrency in levels:
+                n = max(requests, concurrency)
+                results.append(await run_level("upload", concurrency, max(1, n // 10), bench.upload))
+                results.append(await run_level(
+                    "query_cold_context", concurrency, n,
+                    lambda i: bench.query(bench.cold_question(i), use_context=True)))
+                results.append(await run_level(
+                    "query_cold_no_context", concurrency, n,
+                    lambda i: bench.query(bench.cold_question(i), use_context=False)))
+                results.append(await run_level(
+                    "query_stream_cold", concurrency, n,
+                    lambda i: bench.query(bench.cold_question(i), use_context=True, stream=True)))
+
+                for question in QUESTIONS:
+                    await bench.query(question, use_context=True)
+                results.append(await run_level(
+                    "query_warm", concurrency, n,
+                    lambda i: bench.query(QUESTIONS[i % len(QUESTIONS)], use_context=True)))
+
+                results.append(await run_level("stats", concurrency, n, bench.stats))
+
+                for i in range(max(1, n // 10)):
+                    await bench.upload(i, session_id=f"bench-{bench.run_id}-{i}")
+                results.append(await run_level("delete", concurrency, max(1, n // 10), bench.delete))
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current: List[Dict[str, Any]], baseline: List[Dict[str, Any]]):
+    """Print p95 and throughput deltas against a previous results file."""
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline}
+    print(f"\n{'scenario':<24}{'conc':>6}{'p95 Δ%':>10}{'rps Δ%':>10}")
+    for r in current:
+        before = previous.get((r["scenario"], r["concurrency"]))
+        if not before or not before["p95"] or not before["throughput_rps"] or r["p95"] is None:
+            continue
+        p95 = (r["p95"] - before["p95"]) / before["p95"] * 100
+        rps = (r["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100
+        print(f"{r['scenario']:<24}{r['concurrency']:>6}{p95:>+10.1f}{rps:>+10.1f}")
+
+
+def print_table(results: List[Dict[str, Any]]):
+    print(f"{'scenario':<24}{'conc':>6}{'req':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rps':>9}")
+    for r in results:
+        ms = lambda v: f"{v * 1000:9.1f}" if v is not None else f"{'-':>9}"
+        rps = f"{r['throughput_rps']:9.1f}" if r["throughput_rps"] else f"{'-':>9}"
+        print(f"{r['scenario']:<24}{r['concurrency']:>6}{r['requests']:>6}{r['errors']:>5}"
+              f"{ms(r['p50'])}{ms(r['p95'])}{ms(r['p99'])}{rps}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario and level")
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="mock LLM response delay")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="previous JSON results to diff against")
+    args = parser.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    with tempfile.TemporaryDirectory() as chroma_dir:
+        # Isolated store, query log and a fake key so the mock LLM is used, never Groq
+        os.environ["CHROMA_PATH"] = chroma_dir
+        os.environ["EMBEDDING_CACHE_DIR"] = os.path.join(chroma_dir, "embedding_cache")
+        os.environ["QUERY_LOG_PATH"] = os.path.join(chroma_dir, "query_log", "queries.jsonl")
+        os.environ["GROQ_API_KEY"] = "bench"
+        results = asyncio.run(run_benchmarks(levels, args.requests, args.llm_latency_ms))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {"concurrency": levels, "requests": args.requests, "llm_latency_ms": args.llm_latency_ms},
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print_table(results)
+    print(f"\n📄 Résultats écrits dans {args.output}")
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text())["results"])
+
+
+if __name__ == "__main__":
+    main()
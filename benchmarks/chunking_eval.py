@@ -0,0 +1,116 @@
+"""Chunking evaluation on a small labelled PLU excerpt.
+
+Chunks ``data/plu_eval.json`` with the legacy character windows and with the
+structure-aware chunker, then reports chunk counts, stored tokens and the
+share of questions whose expected passage is found in the top-k chunks::
+
+    python benchmarks/chunking_eval.py --top-k 3
+
+Ranking uses the BM25 index of the hybrid retriever, plus the embedding
+model when sentence-transformers is installed.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+from chunking import StructuredChunker, count_tokens  # noqa: E402
+from hybrid import BM25Index  # noqa: E402
+
+EVAL_SET = Path(__file__).resolve().parent / "data" / "plu_eval.json"
+
+
+def load_eval_set(path: Path = EVAL_SET) -> Dict[str, Any]:
+    return json.loads(path.read_text())
+
+
+def legacy_chunks(pages: List[str], chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+    """Character windows of ``chunk_size`` overlapping by ``overlap``, the chunking used before."""
+    text = "".join(page + "\n" for page in pages)
+    return [text[start:start + chunk_size] for start in range(0, len(text), chunk_size - overlap)]
+
+
+def structured_chunks(pages: List[str]) -> List[str]:
+    chunker = StructuredChunker()
+    chunks = []
+    for number, text in enumerate(pages, start=1):
+        chunks.extend(chunk for chunk, _ in chunker.feed(number, text))
+    chunks.extend(chunk for chunk, _ in chunker.flush())
+    return chunks
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def bm25_ranker(chunks: List[str]) -> Callable[[str, int], List[str]]:
+    index = BM25Index()
+    index.add([str(i) for i in range(len(chunks))], chunks)
+    return lambda question, k: [chunks[int(i)] for i, _ in index.search(question, k)]
+
+
+def vector_ranker(chunks: List[str]) -> Optional[Callable[[str, int], List[str]]]:
+    try:
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        return None
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    vectors = model.encode(chunks, normalize_embeddings=True)
+
+    def rank(question: str, k: int) -> List[str]:
+        scores = vectors @ model.encode([question], normalize_embeddings=True)[0]
+        return [chunks[i] for i in np.argsort(-scores)[:k]]
+
+    return rank
+
+
+def recall_at_k(rank: Callable[[str, int], List[str]], questions: List[Dict[str, str]], k: int) -> float:
+    found = sum(
+        any(_normalize(q["expected"]) in _normalize(chunk) for chunk in rank(q["question"], k))
+        for q in questions
+    )
+    return round(found / len(questions), 2)
+
+
+def evaluate(top_k: int = 3, eval_set: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    eval_set = eval_set or load_eval_set()
+    pages, questions = eval_set["pages"], eval_set["questions"]
+    document_tokens = count_tokens("\n".join(pages))
+    results = []
+    for name, chunker in (("legacy", legacy_chunks), ("structured", structured_chunks)):
+        chunks = chunker(pages)
+        stored = sum(count_tokens(chunk) for chunk in chunks)
+        row = {
+            "chunker": name,
+            "chunks": len(chunks),
+            "stored_tokens": stored,
+            "stored_ratio": round(stored / document_tokens, 2),
+            "max_chunk_tokens": max(count_tokens(chunk) for chunk in chunks),
+            f"bm25_recall@{top_k}": recall_at_k(bm25_ranker(chunks), questions, top_k),
+        }
+        vector = vector_ranker(chunks)
+        if vector is not None:
+            row[f"vector_recall@{top_k}"] = recall_at_k(vector, questions, top_k)
+        results.append(row)
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = evaluate(args.top_k)
+    columns = list(results[0])
+    print("".join(f"{c:>22}" for c in columns))
+    for row in results:
+        print("".join(f"{row.get(c, '-')!s:>22}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""pytest entry point for the benchmark suite.
+
+Skipped unless ``RUN_BENCHMARKS=1`` since it needs the full backend stack
+(ChromaDB, sentence-transformers)::
+
+    RUN_BENCHMARKS=1 pytest benchmarks -q -s
+"""
+import json
+import os
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.getenv("RUN_BENCHMARKS"), reason="RUN_BENCHMARKS not set")
+
+
+def test_benchmarks_run_without_errors(tmp_path):
+    import bench
+
+    output = tmp_path / "bench.json"
+    bench.main(["--concurrency", "1,4", "--requests", "10", "--llm-latency-ms", "50", "--output", str(output)])
+
+    results = json.loads(output.read_text())["results"]
+    assert {r["scenario"] for r in results} >= {"upload", "query_cold_context", "query_warm", "stats", "delete"}
+    assert all(r["errors"] == 0 for r in results)
@@ -46,7 +46,8 @@
 
             if (!response.ok) throw new Error("Upload failed");
 
-            const data = await response.json();
+            const job = await response.json();
+            const data = await waitForUploadJob(job.job_id);
             uploadedDocuments.push(data);
             updateDocumentsList();
 
@@ -63,6 +64,54 @@
         }
     }
 
+    async function waitForUploadJob(jobId) {
+        const uploadButton = document.querySelector(".upload-button");
+        while (true) {
+            const response = await fetch(`${API_URL}/api/upload/${jobId}`);
+            if (!response.ok) throw new Error("Upload status failed");
+
+            const job = await response.json();
+            if (job.status === "done") return job.result;
+            if (job.status === "failed") throw new Error(job.error || "Indexation failed");
+
+            uploadButton.textContent = `⏳ ${job.chunks_embedded}/${job.chunks_total || "?"}`;
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+        }
+    }
+
+    // Lit la réponse NDJSON de /api/query/stream et affiche les tokens au fil de l'eau
+    async function readAnswerStream(response, loadingId) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let answer = "";
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let newline;
+            while ((newline = buffer.indexOf("\n")) >= 0) {
+                const line = buffer.slice(0, newline).trim();
+                buffer = buffer.slice(newline + 1);
+                if (!line) continue;
+
+                const event = JSON.parse(line);
+                if (event.type === "token") {
+                    answer += event.content;
+                    const content = document.querySelector(`#msg-${loadingId} .message-content`);
+                    if (content) content.textContent = answer;
+                } else if (event.type === "done") {
+                    return event;
+                } else if (event.type === "error") {
+                    throw new Error(event.detail);
+                }
+            }
+        }
+        throw new Error("Stream interrupted");
+    }
+
     async function sendMessage() {
         const input = document.getElementById("chatInput");
         const message = input.value.trim();
@@ -81,7 +130,7 @@
         try {
             const startTime = Date.now();
 
-            const response = await fetch(`${API_URL}/api/query`, {
+            const response = await fetch(`${API_URL}/api/query/stream`, {
                 method: "POST",
                 headers: {
                     "Content-Type": "application/json",
@@ -95,7 +144,7 @@
 
             if (!response.ok) throw new Error("Query failed");
 
-            const data = await response.json();
+            const data = await readAnswerStream(response, loadingId);
             const responseTime = Date.now() - startTime;
 
             const loadingMsg = document.getElementById(`msg-${loadingId}`);
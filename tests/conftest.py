@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# backend modules import each other by flat name (``from rag_utils import ...``)
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
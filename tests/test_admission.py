@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, DeadlineExceeded
+
+
+def test_sessions_take_turns_for_freed_slots():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, max_wait=100)
+        first = await admission.acquire("a")
+        order = []
+
+        async def ask(key, n):
+            ticket = await admission.acquire(key)
+            order.append(f"{key}{n}")
+            admission.release(ticket)
+
+        # "a" sends a burst before "b" asks a single question
+        tasks = [asyncio.create_task(ask("a", n)) for n in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(ask("b", 0)))
+        await asyncio.sleep(0)
+        assert admission.stats()["queue_depth"] == 4
+        admission.release(first)
+        await asyncio.gather(*tasks)
+        return order, admission.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["a0", "b0", "a1", "a2"]
+    assert (stats["in_flight"], stats["queue_depth"], stats["queued"]) == (0, 0, 4)
+
+
+def test_sheds_when_the_estimated_wait_is_too_long():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, max_wait=5)
+        admission.service_time = 2.0
+        busy = await admission.acquire("a")
+        queued = [asyncio.create_task(admission.acquire("a")) for _ in range(2)]
+        await asyncio.sleep(0)
+        # A new session takes turns with "a": one "a" question, then its own; a third "a" is 6s away
+        assert admission.estimated_wait("b") == pytest.approx(4.0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("a")
+        for task in queued:
+            task.cancel()
+        await asyncio.gather(*queued, return_exceptions=True)
+        admission.release(busy)
+        return rejected.value, admission
+
+    rejected, admission = asyncio.run(scenario())
+    assert rejected.retry_after == 6
+    assert admission.stats()["shed_wait"] == 1
+    # Cancelled waiters did not keep a slot
+    assert (admission.in_flight, admission.depth()) == (0, 0)
+
+
+def test_full_queue_and_queue_deadline():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, max_queue=1, max_wait=100, deadline=0.05)
+        admission.service_time = 0.0
+        busy = await admission.acquire("a")
+        waiting = asyncio.create_task(admission.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected, match="pleine"):
+            await admission.acquire("c")
+        with pytest.raises(AdmissionRejected, match="Délai"):
+            await waiting
+        admission.release(busy)
+        return admission.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["shed_full"], stats["expired_in_queue"], stats["in_flight"]) == (1, 1, 0)
+
+
+def test_run_reports_deadline_but_lets_the_work_finish():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, deadline=0.05)
+        finished = []
+
+        async def slow():
+            await asyncio.sleep(0.1)
+            finished.append(True)
+            return "réponse"
+
+        with pytest.raises(DeadlineExceeded):
+            await admission.run("a", slow)
+        # Still holding its slot until the answer is ready (and cached)
+        assert admission.in_flight == 1
+        await asyncio.sleep(0.1)
+        assert await admission.run("a", lambda: asyncio.sleep(0, "ok")) == "ok"
+        return finished, admission.stats()
+
+    finished, stats = asyncio.run(scenario())
+    assert finished == [True]
+    assert (stats["deadline_exceeded"], stats["admitted"], stats["in_flight"]) == (1, 2, 0)
+
+
+def load_admitted_stream(admission):
+    import ast
+    from pathlib import Path
+
+    from starlette.responses import StreamingResponse
+
+    tree = ast.parse(Path('backend/main.py').read_text())
+    nodes = [node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == 'AdmittedStream']
+    namespace = {'StreamingResponse': StreamingResponse, 'Ticket': object, 'admission': admission}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), filename='<ast>', mode='exec'), namespace)
+    return namespace['AdmittedStream']
+
+
+def test_stream_slot_is_freed_when_the_client_leaves_before_the_body():
+    started = []
+
+    async def events():
+        started.append(True)
+        yield "token\n"
+
+    async def send(message):
+        # The client is already gone when the headers are sent
+        raise OSError("connexion fermée")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1)
+        ticket = await admission.acquire("a")
+        response = load_admitted_stream(admission)(events(), ticket, media_type="application/x-ndjson")
+        with pytest.raises(Exception):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+        return admission.stats()["in_flight"]
+
+    assert asyncio.run(scenario()) == 0
+    assert started == []
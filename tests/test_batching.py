@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+from batching import MicroBatcher
+
+
+def test_concurrent_submissions_share_one_call():
+    calls = []
+
+    def encode(texts):
+        calls.append((list(texts), threading.current_thread().name))
+        return [len(t) for t in texts]
+
+    async def scenario():
+        batcher = MicroBatcher(encode, max_batch_size=32, max_wait_ms=20, name='embed')
+        results = await asyncio.gather(*(batcher.submit('x' * i) for i in range(5)))
+        batcher.shutdown()
+        return batcher, results
+
+    batcher, results = asyncio.run(scenario())
+    assert results == [0, 1, 2, 3, 4]
+    assert len(calls) == 1
+    assert calls[0][1].startswith('embed')
+    assert batcher.stats()['avg_batch_size'] == 5
+
+
+def test_full_batch_is_sent_without_waiting():
+    sizes = []
+
+    def fn(items):
+        sizes.append(len(items))
+        return items
+
+    async def scenario():
+        batcher = MicroBatcher(fn, max_batch_size=3, max_wait_ms=10_000)
+        results = await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(6))), 2)
+        batcher.shutdown()
+        return results
+
+    assert asyncio.run(scenario()) == list(range(6))
+    assert sizes == [3, 3]
+
+
+def test_errors_fan_out_to_every_waiter():
+    def fn(items):
+        raise RuntimeError('chroma down')
+
+    async def scenario():
+        batcher = MicroBatcher(fn, max_wait_ms=1)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+        batcher.shutdown()
+        return results
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(scenario()))
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'benchmarks'))
+
+from bench import percentile, summarize
+
+
+def test_percentiles_use_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
+
+
+def test_throughput_uses_wall_clock_time():
+    result = summarize('query', 8, [0.5] * 9, errors=1, wall_time=2.0)
+    assert result['requests'] == 10
+    assert result['throughput_rps'] == 5.0
+    assert result['p99'] == 0.5
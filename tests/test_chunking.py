@@ -0,0 +1,77 @@
+import sys
+from pathlib import Path
+
+import chunking
+from chunking import StructuredChunker
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'benchmarks'))
+
+
+def run(chunker, pages):
+    chunks = []
+    for number, text in enumerate(pages, start=1):
+        chunks.extend(chunker.feed(number, text))
+    chunks.extend(chunker.flush())
+    return chunks
+
+
+def test_legacy_windows_of_the_evaluation_baseline():
+    import chunking_eval
+
+    assert [len(c) for c in chunking_eval.legacy_chunks(['x' * 1999])] == [1000, 1000, 400]
+
+
+def test_sections_are_packed_and_zones_kept_apart():
+    pages = [
+        'ZONE UB\nARTICLE UB 9 - EMPRISE\nEmprise 60 %.\nARTICLE UB 10 - HAUTEUR\nHauteur 12 m.',
+        'ZONE N\nARTICLE N 1 - INTERDICTIONS\nPiscines interdites.',
+    ]
+    chunks = run(StructuredChunker(max_tokens=200), pages)
+    assert chunks == [
+        ('ZONE UB\nARTICLE UB 9 - EMPRISE\nEmprise 60 %.\nARTICLE UB 10 - HAUTEUR\nHauteur 12 m.', 1),
+        ('ZONE N\nARTICLE N 1 - INTERDICTIONS\nPiscines interdites.', 2),
+    ]
+
+
+def test_long_section_is_split_with_heading_and_overlap():
+    sentences = [f'Phrase numero {n} du reglement.' for n in range(12)]
+    chunker = StructuredChunker(max_tokens=40, overlap_tokens=8, count=lambda text: len(text.split()))
+    chunks = run(chunker, ['ARTICLE UB 10 - HAUTEUR\n' + ' '.join(sentences)])
+    assert len(chunks) > 1
+    for text, _ in chunks:
+        assert text.startswith('ARTICLE UB 10 - HAUTEUR\n')
+        assert len(text.split()) <= 40
+    # The last sentence of a part is repeated at the start of the next one
+    first, second = chunks[0][0].splitlines(), chunks[1][0].splitlines()
+    assert second[1] == first[-1]
+    assert all(s in '\n'.join(t for t, _ in chunks) for s in sentences)
+
+
+def test_running_headers_and_duplicate_chunks_are_dropped():
+    header = 'PLU de Saint-Martin - Reglement'
+    pages = [
+        f'{header}\nTITRE I\nARTICLE UB 5 - TERRAINS\nNon reglemente.\nPage 1 / 3',
+        f'{header}\nTITRE II\nARTICLE UB 5 - TERRAINS\nNon reglemente.\nPage 2 / 3',
+        f'{header}\nTITRE III\nARTICLE UB 5 - TERRAINS\nNon reglemente.\nPage 3 / 3',
+    ]
+    chunker = StructuredChunker()
+    chunks = run(chunker, pages)
+    assert sum(header in text for text, _ in chunks) == 1
+    assert chunker.boilerplate_lines == 4
+    assert chunker.duplicates == 0
+    assert [text.count('Non reglemente.') for text, _ in chunks] == [1, 1, 1]
+
+    repeated = StructuredChunker()
+    chunks = run(repeated, ['ZONE UB\nTexte repris.', 'ZONE UC\nAutre.\nZONE UB\nTexte repris.'])
+    assert chunks == [('ZONE UB\nTexte repris.', 1), ('ZONE UC\nAutre.', 2)]
+    assert repeated.duplicates == 1
+
+
+def test_eval_set_fewer_tokens_same_recall():
+    import chunking_eval
+
+    legacy, structured = chunking_eval.evaluate(top_k=3)
+    assert structured['chunks'] <= legacy['chunks']
+    assert structured['stored_tokens'] < legacy['stored_tokens']
+    assert structured['bm25_recall@3'] >= legacy['bm25_recall@3']
+    assert structured['max_chunk_tokens'] <= chunking.CHUNK_MAX_TOKENS
@@ -1,15 +1,27 @@
 import ast
 import asyncio
-from pathlib import Path
 import types
+from pathlib import Path
+
+from deletion import DeletionManager
+from generations import CorpusGenerations
+from job_status import JobBoard
+from scopes import matches_where
 
+MAIN_FUNCTIONS = (
+    'clear_session_documents', 'invalidate_session_cache',
+)
 
-def get_clear_function(collection_stub, http_exception):
+
+def load_main_functions(**namespace):
     source = Path('backend/main.py').read_text()
     tree = ast.parse(source)
-    func_node = next(node for node in tree.body if isinstance(node, ast.AsyncFunctionDef) and node.name == 'clear_session_documents')
-    mod = ast.Module(body=[func_node], type_ignores=[])
-    code = compile(mod, filename='<ast>', mode='exec')
+    nodes = [
+        node for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name in MAIN_FUNCTIONS
+    ]
+    code = compile(ast.Module(body=nodes, type_ignores=[]), filename='<ast>', mode='exec')
+
     class DummyApp:
         def delete(self, *a, **k):
             def wrapper(fn):
@@ -17,50 +29,111 @@ def get_clear_function(collection_stub, http_exception):
             return wrapper
 
     namespace = {
-        'collection': collection_stub,
-        'HTTPException': http_exception,
+        'HTTPException': DummyHTTPException,
+        'JSONResponse': DummyJSONResponse,
+        'require_ready': lambda: None,
+        'DELETE_SYNC_SECONDS': 5,
+        'GLOBAL_SESSION': 'global',
+        'Optional': __import__('typing').Optional,
+        'Set': __import__('typing').Set,
+        'QueryRequest': object,
+        'logger': types.SimpleNamespace(warning=lambda *a: None),
         'app': DummyApp(),
+        'job_board': JobBoard(),
+        **namespace,
     }
     exec(code, namespace)
-    return namespace['clear_session_documents']
+    return namespace
 
 
-class DummyCollection:
-    def __init__(self):
-        self.get_called_with = None
-        self.deleted_ids = None
-        self.get_return = {'ids': []}
+class DummyService:
+    """Chunks by id; ``get`` returns ids (and metadatas when asked) only."""
 
-    def get(self, where):
-        self.get_called_with = where
-        return self.get_return
+    def __init__(self, rows):
+        self.rows = dict(rows)
+        self.get_calls = []
 
-    def delete(self, ids=None):
-        self.deleted_ids = ids
+    def get(self, where, include, limit):
+        self.get_calls.append((where, list(include), limit))
+        ids = [i for i, meta in self.rows.items() if matches_where(where, meta)][:limit]
+        found = {'ids': ids}
+        if 'metadatas' in include:
+            found['metadatas'] = [self.rows[i] for i in ids]
+        return found
+
+    def delete(self, ids):
+        for doc_id in ids:
+            del self.rows[doc_id]
 
 
 class DummyHTTPException(Exception):
-    def __init__(self, status_code=None, detail=None):
+    def __init__(self, status_code=None, detail=None, headers=None):
         self.status_code = status_code
         self.detail = detail
 
 
-def test_clear_session_documents_deletes_when_ids_found():
-    collection = DummyCollection()
-    collection.get_return = {'ids': ['id1', 'id2']}
-    func = get_clear_function(collection, DummyHTTPException)
-    result = asyncio.run(func('sess1'))
-    assert collection.get_called_with == {'session_id': 'sess1'}
-    assert collection.deleted_ids == ['id1', 'id2']
-    assert result['message'].startswith('2 documents supprim')
+class DummyJSONResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+def run_clear(service, session_id, **namespace):
+    async def scenario():
+        manager = DeletionManager(service, page_size=2, sweep_interval=0)
+        func = load_main_functions(deletion_manager=manager, **namespace)['clear_session_documents']
+        result = await func(session_id)
+        await manager.shutdown()
+        return result
+
+    return asyncio.run(scenario())
+
+
+def test_clear_session_documents_deletes_in_pages_of_ids():
+    rows = {f'id{i}': {'session_id': 'sess1'} for i in range(5)}
+    rows['other'] = {'session_id': 'sess2'}
+    service = DummyService(rows)
+
+    result = run_clear(service, 'sess1')
+    assert result['message'].startswith('5 documents supprim')
+    assert list(service.rows) == ['other']
+    # Ids only, never the documents, at most one page at a time
+    assert {(str(where), tuple(include), limit) for where, include, limit in service.get_calls} == {
+        ("{'session_id': 'sess1'}", (), 2)
+    }
+    assert len(service.get_calls) == 3
 
 
 def test_clear_session_documents_no_ids():
-    collection = DummyCollection()
-    collection.get_return = {'ids': []}
-    func = get_clear_function(collection, DummyHTTPException)
-    result = asyncio.run(func('sess2'))
-    assert collection.get_called_with == {'session_id': 'sess2'}
-    assert collection.deleted_ids is None
+    service = DummyService({'id1': {'session_id': 'sess1'}})
+    result = run_clear(service, 'sess2')
     assert 'Aucun document' in result['message']
+    assert list(service.rows) == ['id1']
+
+
+def test_large_session_continues_in_background():
+    service = DummyService({f'id{i}': {'session_id': 'sess1'} for i in range(4)})
+    result = run_clear(service, 'sess1', DELETE_SYNC_SECONDS=0)
+    assert result.status_code == 202
+    assert result.content['job_id']
+    assert 'en cours' in result.content['message']
+
+
+def test_deleting_a_session_invalidates_its_cached_answers():
+    corpus = CorpusGenerations()
+    functions = load_main_functions(corpus=corpus)
+
+    async def scenario():
+        scopes = [('sess1', 'x'), ('sess2', 'x'), (None, 'x'), (None, None)]
+        before = [await corpus.generation(*scope) for scope in scopes]
+
+        await functions['invalidate_session_cache']({'sess1'})
+        after_session = [await corpus.generation(*scope) for scope in scopes]
+        # Global documents are visible to every session
+        await functions['invalidate_session_cache']({'global'})
+        after_global = [await corpus.generation(*scope) for scope in scopes]
+        return before, after_session, after_global
 
+    before, after_session, after_global = asyncio.run(scenario())
+    assert [a != b for a, b in zip(before, after_session)] == [True, False, False, False]
+    assert all(a != b for a, b in zip(after_session, after_global))
@@ -0,0 +1,70 @@
+from chunking import StructuredChunker
+from context_packing import ContextPacker, find_overlap, source_label
+
+
+def words(text):
+    return len(text.split())
+
+
+def hit(text, similarity=0.8, filename="plu.pdf", chunk_index=0, page=1):
+    return {"text": text, "similarity": similarity, "keyword_score": None,
+            "metadata": {"filename": filename, "chunk_index": chunk_index, "page": page}}
+
+
+def test_character_chunk_overlap_is_sent_once():
+    text = " ".join(f"Phrase {i} du règlement de la zone UB." for i in range(60))
+    # Character windows overlapping by 200 characters
+    first, second = text[:1000], text[800:1800]
+    assert find_overlap(first, second) == (0, 200)
+
+    packed = ContextPacker(budget=10_000, count=words).pack([
+        hit(second, chunk_index=1), hit(first, 0.9, chunk_index=0),
+    ])
+    assert packed.text.count(second[:200]) == 1
+    assert packed.sources == ["plu.pdf (p. 1, chunk 1)", "plu.pdf (p. 1, chunk 0)"]
+    assert packed.tokens_saved > 0
+
+
+def test_structured_continuation_keeps_its_heading():
+    chunker = StructuredChunker(max_tokens=60, overlap_tokens=15)
+    text = "ARTICLE UB 10 - HAUTEUR\n" + " ".join(
+        f"Phrase numero {i} sur la hauteur des constructions en zone UB." for i in range(8)
+    )
+    (first, _), (second, _) = chunker.feed(1, text)[:2]
+    repeated = "Phrase numero 2 sur la hauteur des constructions en zone UB."
+
+    packer = ContextPacker(budget=10_000, count=words)
+    packed = packer.pack([hit(first), hit(second, chunk_index=1)])
+    assert packed.text.count(repeated) == 1
+    assert packed.text.count("ARTICLE UB 10 - HAUTEUR") == 2
+    assert packer.stats()["overlap_chars_removed"] == len(repeated) + 1
+
+
+def test_other_files_and_low_scores():
+    packer = ContextPacker(budget=10_000, min_score_ratio=0.5, count=words)
+    shared = "Les clôtures sur rue ne dépassent pas 1,80 m de hauteur totale."
+    packed = packer.pack([
+        hit(shared, 0.7), hit(shared, 0.6, filename="oap.pdf"), hit("Hors sujet.", 0.2),
+    ])
+    # Same text in another document is kept; the weak hit is not
+    assert packed.sources == ["plu.pdf (p. 1, chunk 0)", "oap.pdf (p. 1, chunk 0)"]
+    assert packer.stats()["dropped_low_score"] == 1
+
+
+def test_packs_to_the_token_budget():
+    snippets = [hit(" ".join([f"mot{i}"] * 100), 1.0 - i / 100, chunk_index=i * 10) for i in range(4)]
+    packer = ContextPacker(budget=300, count=words)
+    packed = packer.pack(snippets)
+    assert packed.tokens <= 300
+    assert len(packed.sources) == 3
+    assert packed.text.endswith("[…]")
+    stats = packer.stats()
+    assert (stats["truncated"], stats["dropped_budget"], stats["snippets_used"]) == (1, 1, 3)
+    assert packed.tokens_saved == stats["tokens_saved"] > 100
+
+
+def test_empty_and_labels():
+    packed = ContextPacker().pack([])
+    assert (packed.text, packed.sources, packed.tokens_saved) == ("", [], 0)
+    assert source_label({"filename": "a.txt"}) == "a.txt"
+    assert source_label({}) == "document"
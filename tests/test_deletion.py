@@ -0,0 +1,71 @@
+import asyncio
+
+import scopes
+from deletion import DeletionManager
+from scopes import matches_where
+
+
+class DummyService:
+    def __init__(self, rows):
+        self.rows = dict(rows)
+
+    def get(self, where, include, limit):
+        ids = [i for i, meta in self.rows.items() if matches_where(where, meta)][:limit]
+        return {'ids': ids, 'metadatas': [self.rows[i] for i in ids] if 'metadatas' in include else None}
+
+    def delete(self, ids):
+        for doc_id in ids:
+            del self.rows[doc_id]
+
+
+def test_sweep_deletes_expired_session_chunks_and_notifies():
+    service = DummyService({
+        'old1': {'session_id': 'a', 'expires_at': 100},
+        'old2': {'session_id': 'a', 'expires_at': 150},
+        'old3': {'session_id': 'b', 'expires_at': 199},
+        'fresh': {'session_id': 'c', 'expires_at': 500},
+        'global': {'session_id': 'global'},
+    })
+    notified = []
+
+    async def on_deleted(sessions):
+        notified.append(sessions)
+
+    async def scenario():
+        manager = DeletionManager(service, on_deleted=on_deleted, page_size=2, sweep_interval=0)
+        deleted = await manager.sweep(now=200)
+        again = await manager.sweep(now=200)
+        await manager.shutdown()
+        return manager, deleted, again
+
+    manager, deleted, again = asyncio.run(scenario())
+    assert (deleted, again) == (3, 0)
+    assert sorted(service.rows) == ['fresh', 'global']
+    assert notified == [{'a', 'b'}]
+    assert manager.stats()['expired_chunks'] == 3
+
+
+def test_failed_deletion_is_reported():
+    class BrokenService(DummyService):
+        def delete(self, ids):
+            raise RuntimeError('chroma indisponible')
+
+    async def scenario():
+        manager = DeletionManager(BrokenService({'id1': {'session_id': 's'}}), sweep_interval=0)
+        job = manager.submit('s')
+        await manager.wait(job)
+        await manager.shutdown()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == 'failed'
+    assert 'chroma' in job.error
+
+
+def test_only_session_chunks_expire(monkeypatch):
+    monkeypatch.setattr(scopes, 'SESSION_TTL_HOURS', 1)
+    assert scopes.session_expiry('sess1', now=1000) == 1000 + 3600
+    assert scopes.session_expiry('global', now=1000) is None
+    assert scopes.session_expiry(None) is None
+    monkeypatch.setattr(scopes, 'SESSION_TTL_HOURS', 0)
+    assert scopes.session_expiry('sess1') is None
@@ -1,38 +1,19 @@
-import io
-import ast
-import types
-from pathlib import Path
 from docx import Document
 
-def get_extract_function(dummy_doc):
-    source = Path('backend/main.py').read_text()
-    tree = ast.parse(source)
-    func_node = next(node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == 'extract_text_from_docx')
-    mod = ast.Module(body=[func_node], type_ignores=[])
-    code = compile(mod, filename='<ast>', mode='exec')
-    namespace = {'docx': types.SimpleNamespace(Document=dummy_doc), 'io': io, 'logger': types.SimpleNamespace(error=lambda *a, **k: None)}
-    exec(code, namespace)
-    return namespace['extract_text_from_docx']
+from extraction import extract_file
 
-def test_extract_text_from_docx_uses_bytesio():
-    captured = {}
-    def dummy_doc(file_obj):
-        captured['type'] = type(file_obj)
-        class DummyParagraph:
-            text = 'hello'
-        return types.SimpleNamespace(paragraphs=[DummyParagraph()])
-    func = get_extract_function(dummy_doc)
-    text = func(b'dummy')
-    assert text.strip() == 'hello'
-    assert captured['type'] is io.BytesIO
 
-
-def test_extract_text_from_docx_with_real_bytes():
-    buffer = io.BytesIO()
+def test_extract_file_reads_docx_paragraphs(tmp_path):
+    path = tmp_path / 'reglement.docx'
     doc = Document()
+    doc.add_paragraph("ARTICLE UB 10 - HAUTEUR")
     doc.add_paragraph("hello world")
-    doc.save(buffer)
+    doc.save(path)
+
+    assert extract_file('docx', str(path)) == "ARTICLE UB 10 - HAUTEUR\nhello world\n"
+
 
-    func = get_extract_function(Document)
-    text = func(buffer.getvalue())
-    assert "hello world" in text
+def test_extract_file_reads_text_files(tmp_path):
+    path = tmp_path / 'notice.txt'
+    path.write_text("Recul de 5 m.", encoding='utf-8')
+    assert extract_file('txt', str(path)) == "Recul de 5 m."
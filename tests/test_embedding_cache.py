@@ -0,0 +1,65 @@
+from embedding_cache import KEY_BYTES, CachedEmbeddingFunction, EmbeddingCache
+
+
+class CountingModel:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 1.0, 0.0] for t in texts]
+
+
+def test_misses_are_encoded_in_one_call_and_then_served_from_cache(tmp_path):
+    model = CountingModel()
+    embed = CachedEmbeddingFunction(model, EmbeddingCache(str(tmp_path), model_name='m'))
+    assert embed(['a', 'bb', 'a']) == [[1.0, 1.0, 0.0], [2.0, 1.0, 0.0], [1.0, 1.0, 0.0]]
+    assert embed(['bb', 'ccc']) == [[2.0, 1.0, 0.0], [3.0, 1.0, 0.0]]
+    assert model.calls == [['a', 'bb', 'a'], ['ccc']]
+    assert embed.cache.stats()['hits'] == 1
+
+
+def test_cache_survives_restart(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), model_name='m')
+    cache.put_many([cache.key('plu')], [[0.5, 0.25]])
+    cache.flush()
+
+    reopened = EmbeddingCache(str(tmp_path), model_name='m')
+    assert reopened.get_many([reopened.key('plu')]) == [[0.5, 0.25]]
+    # Another model never reads these vectors
+    other = EmbeddingCache(str(tmp_path), model_name='other')
+    assert other.get_many([other.key('plu')]) == [None]
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    dim = 4
+    max_mb = 3 * (dim * 4 + KEY_BYTES + 8) / (1024 * 1024)
+    cache = EmbeddingCache(str(tmp_path), model_name='m', max_mb=max_mb)
+    keys = [cache.key(t) for t in 'abcd']
+    cache.put_many(keys[:3], [[float(i)] * dim for i in range(3)])
+    assert cache.capacity == 3
+    cache.get_many([keys[0]])  # 'a' becomes the most recent
+    cache.put_many([keys[3]], [[3.0] * dim])
+
+    assert cache.get_many(keys) == [[0.0] * dim, None, [2.0] * dim, [3.0] * dim]
+    assert cache.stats()['evictions'] == 1
+
+    reopened = EmbeddingCache(str(tmp_path), model_name='m', max_mb=max_mb)
+    assert list(reopened._index) == [keys[0], keys[2], keys[3]]
+
+
+def test_insert_after_reopen_fills_free_slots_only(tmp_path):
+    dim = 2
+    max_mb = 4 * (dim * 4 + KEY_BYTES + 8) / (1024 * 1024)
+    cache = EmbeddingCache(str(tmp_path), model_name='m', max_mb=max_mb)
+    keys = [cache.key(t) for t in 'abcde']
+    cache.put_many(keys[:3], [[float(i)] * dim for i in range(3)])
+    # A crash while rewriting slot 0 leaves it without a key
+    cache._keys[0] = 0
+    cache.flush()
+
+    reopened = EmbeddingCache(str(tmp_path), model_name='m', max_mb=max_mb)
+    reopened.put_many(keys[3:], [[3.0] * dim, [4.0] * dim])
+    assert reopened.get_many(keys) == [None, [1.0] * dim, [2.0] * dim, [3.0] * dim, [4.0] * dim]
+    assert reopened.stats()['evictions'] == 0
+    assert sorted(reopened._index.values()) == [0, 1, 2, 3]
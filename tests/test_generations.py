@@ -0,0 +1,89 @@
+import asyncio
+
+from generations import CorpusGenerations
+from semantic_cache import SemanticCache
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.names = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def incr(self, key):
+        self.names.append(key)
+
+    async def execute(self):
+        values = []
+        for key in self.names:
+            self.redis.values[key] = self.redis.values.get(key, 0) + 1
+            values.append(self.redis.values[key])
+        return values
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.mgets = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def mget(self, keys):
+        self.mgets += 1
+        return [str(self.values[key]) if key in self.values else None for key in keys]
+
+
+def test_uploads_only_change_the_scopes_that_see_them():
+    corpus = CorpusGenerations()
+
+    async def scenario():
+        scopes = [(None, 'Saint-Denis'), (None, 'Bobigny'), (None, None), ('sess1', 'Bobigny'), ('sess2', None)]
+        before = [await corpus.generation(*scope) for scope in scopes]
+        await corpus.indexed(None, ' SAINT-DENIS ')
+        after_commune = [await corpus.generation(*scope) for scope in scopes]
+        await corpus.indexed('sess1', 'Bobigny')
+        after_session = [await corpus.generation(*scope) for scope in scopes]
+        return before, after_commune, after_session
+
+    before, after_commune, after_session = asyncio.run(scenario())
+    # Questions without a commune see the documents of every commune
+    assert [a != b for a, b in zip(before, after_commune)] == [True, False, True, False, True]
+    assert [a != b for a, b in zip(after_commune, after_session)] == [False, False, False, True, False]
+    assert corpus.stats()['bumps'] == {'global': 1, 'commune': 1, 'session': 1}
+
+
+def test_workers_share_generations_through_redis():
+    redis = FakeRedis()
+    uploader, other = CorpusGenerations(redis, refresh=0.05), CorpusGenerations(redis, refresh=0.05)
+
+    async def scenario():
+        first = await other.generation(None, 'Bobigny')
+        await other.generation(None, 'Bobigny')
+        # Read once per refresh interval
+        assert redis.mgets == 1
+        await uploader.indexed(None, 'Bobigny')
+        # The uploading worker sees its bump at once, the others after the refresh interval
+        assert await uploader.generation(None, 'Bobigny') != first
+        assert await other.generation(None, 'Bobigny') == first
+        await asyncio.sleep(0.06)
+        return first, await other.generation(None, 'Bobigny'), await uploader.generation(None, 'Bobigny')
+
+    first, refreshed, uploaded = asyncio.run(scenario())
+    assert refreshed == uploaded != first
+
+
+def test_semantic_cache_ignores_answers_of_an_older_generation():
+    cache = SemanticCache(threshold=0.9)
+    cache.store('bobigny:global:True', [1.0, 0.0], {'answer': 'ancienne'}, generation='0.1.0')
+    assert cache.lookup('bobigny:global:True', [1.0, 0.0], generation='0.1.0')['answer'] == 'ancienne'
+    assert cache.lookup('bobigny:global:True', [1.0, 0.0], generation='0.2.0') is None
+
+    cache.store('bobigny:global:True', [0.0, 1.0], {'answer': 'nouvelle'}, generation='0.2.0')
+    assert cache.lookup('bobigny:global:True', [1.0, 0.0], generation='0.2.0') is None
+    assert cache.lookup('bobigny:global:True', [0.0, 1.0], generation='0.2.0')['answer'] == 'nouvelle'
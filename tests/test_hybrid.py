@@ -0,0 +1,80 @@
+from hybrid import BM25Index, Reranker, rrf_fuse, tokenize
+
+
+def test_tokenize_keeps_regulatory_tokens():
+    assert tokenize("Hauteur R+3 en zone UB, article L.151-19") == [
+        "hauteur", "r+3", "zone", "ub", "article", "l.151-19"
+    ]
+    assert tokenize("Emprise élevée") == ["emprise", "elevee"]
+
+
+def test_bm25_ranks_exact_tokens_and_filters_scope():
+    index = BM25Index()
+    index.add(
+        ["a", "b", "c"],
+        ["zone UB hauteur R+3", "zone UC hauteur R+2", "stationnement zone UB"],
+        [{"session_id": "global"}, {"session_id": "global"}, {"session_id": "s1"}],
+    )
+    ranked = [i for i, _ in index.search("hauteur en UB", 3)]
+    assert ranked[0] == "a" and sorted(ranked) == ["a", "b", "c"]
+    assert [i for i, _ in index.search("UB", 3, {"session_id": "global"})] == ["a"]
+
+    index.remove(["a"])
+    assert len(index) == 2
+    assert [i for i, _ in index.search("R+3", 3)] == []
+
+
+def test_scoped_search_only_scores_the_chunks_in_scope():
+    from scopes import build_where
+
+    index = BM25Index()
+    index.add(
+        [f"g{i}" for i in range(50)] + ["lyon", "any", "s1"],
+        ["hauteur zone UB"] * 53,
+        [{"session_id": "global", "commune": "paris"}] * 50 + [
+            {"session_id": "global", "commune": "lyon"},
+            {"session_id": "global", "commune": ""},
+            {"session_id": "s1", "commune": "lyon"},
+        ],
+    )
+    where = build_where("s1", " Lyon ")
+    assert index._in_scope(where) == {"lyon", "any", "s1"}
+    assert sorted(i for i, _ in index.search("hauteur UB", 10, where)) == ["any", "lyon", "s1"]
+
+    index.update_metadata(["lyon"], [{"session_id": "global", "commune": "paris"}])
+    assert sorted(i for i, _ in index.search("hauteur UB", 10, where)) == ["any", "s1"]
+    index.remove(["s1"])
+    assert index._in_scope(where) == {"any"}
+
+
+def test_rrf_prefers_documents_ranked_by_both():
+    assert rrf_fuse([["a", "b", "c"], ["b", "d"]])[0] == "b"
+
+
+class DummyCrossEncoder:
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, pairs):
+        self.calls.append(len(pairs))
+        return [len(text) for _, text in pairs]
+
+
+def test_reranker_respects_budget():
+    model = DummyCrossEncoder()
+    reranker = Reranker(model_name="dummy", budget_ms=100, model=model)
+    candidates = [("a", "x"), ("b", "xxx"), ("c", "xx")]
+    assert reranker.rerank("q", candidates, 2) == [("b", "xxx"), ("c", "xx")]
+
+    # Too slow per candidate: only the head fitting in the budget is rescored
+    reranker.cost_per_candidate = 0.05
+    assert reranker.rerank("q", candidates, 3) == [("b", "xxx"), ("a", "x"), ("c", "xx")]
+    reranker.cost_per_candidate = 1.0
+    assert reranker.rerank("q", candidates, 2) == [("a", "x"), ("b", "xxx")]
+    assert model.calls[:2] == [3, 2] and reranker.stats()["skipped"] == 1
+
+
+def test_reranker_disabled_without_model():
+    reranker = Reranker(model_name="")
+    assert not reranker.enabled
+    assert reranker.rerank("q", [("a", "x"), ("b", "y")], 1) == [("a", "x")]
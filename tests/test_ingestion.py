@@ -0,0 +1,356 @@
+import asyncio
+import importlib
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+class DummyCollection:
+    """In-memory stand-in for the Chroma collection (vectors are fake)."""
+
+    def __init__(self):
+        self.added = []
+        self.rows = {}
+        self.embedded = 0
+
+    def add(self, documents, ids, metadatas, embeddings=None):
+        self.added.append((list(documents), list(ids), list(metadatas)))
+        if embeddings is None:
+            self.embedded += len(documents)
+            embeddings = [[float(len(d))] for d in documents]
+        for row in zip(ids, documents, metadatas, embeddings):
+            self.rows[row[0]] = row[1:]
+
+    def update(self, ids, metadatas):
+        for doc_id, metadata in zip(ids, metadatas):
+            document, _, embedding = self.rows[doc_id]
+            self.rows[doc_id] = (document, metadata, embedding)
+
+    def get(self, where, include=()):
+        from scopes import matches_where
+
+        ids = [i for i, (_, meta, _) in self.rows.items() if matches_where(where, meta)]
+        return {
+            'ids': ids,
+            'metadatas': [self.rows[i][1] for i in ids],
+            'embeddings': [self.rows[i][2] for i in ids] if 'embeddings' in include else None,
+        }
+
+    def delete(self, ids):
+        for doc_id in ids:
+            self.rows.pop(doc_id, None)
+
+
+class DummyPdfReader:
+    """Fake PdfReader: each line of the file on disk is one page."""
+
+    def __init__(self, path):
+        with open(path) as f:
+            self.pages = [
+                types.SimpleNamespace(extract_text=lambda line=line: line)
+                for line in f.read().splitlines()
+            ]
+
+
+@pytest.fixture()
+def ingestion(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'PyPDF2', types.SimpleNamespace(PdfReader=DummyPdfReader))
+    monkeypatch.setitem(sys.modules, 'docx', types.SimpleNamespace(Document=None))
+    for name in ('extraction', 'ingestion'):
+        sys.modules.pop(name, None)
+    return importlib.import_module('ingestion')
+
+
+def make_manager(ingestion, collection, **kwargs):
+    return ingestion.IngestionManager(
+        collection,
+        extract_executor=ThreadPoolExecutor(max_workers=1),
+        embed_executor=ThreadPoolExecutor(max_workers=1),
+        **kwargs,
+    )
+
+
+def spool(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path), len(content)
+
+
+def test_upload_job_indexes_in_batches(ingestion, tmp_path):
+    collection = DummyCollection()
+    content = ''.join(f'ARTICLE UB {n} - HAUTEUR\n' + 'mot ' * 150 + '\n' for n in range(1, 5))
+    path, size = spool(tmp_path, 'plu.txt', content)
+
+    async def scenario():
+        manager = make_manager(ingestion, collection, batch_size=2)
+        job = manager.submit('plu.txt', 'txt', path, size, 'sess1', commune=' Saint-Denis ')
+        assert job.status == 'queued'
+        await asyncio.wait_for(asyncio.gather(*manager._tasks.values()), 5)
+        await manager.shutdown()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == 'done'
+    assert job.chunks_total == 4
+    assert job.chunks_embedded == 4
+    assert set(job.stage_times) == {'extraction', 'chunking', 'embedding'}
+    assert [len(batch[0]) for batch in collection.added] == [2, 2]
+    assert collection.added[0][1][0].startswith('plu.txt_') and collection.added[0][1][0].endswith('_sess1_saint-denis')
+    assert collection.added[0][2][0]['commune'] == 'saint-denis'
+    assert collection.added[0][2][0]['expires_at'] > job.created_at
+    assert job.to_dict()['result']['chunks'] == 4
+    assert not (tmp_path / 'plu.txt').exists()
+
+
+def run_upload(ingestion, collection, path, size, filename='plu.txt', session='sess1', doc_hash=None):
+    async def scenario():
+        manager = make_manager(ingestion, collection)
+        job = manager.submit(filename, 'txt', path, size, session, doc_hash=doc_hash or str(size))
+        await asyncio.wait_for(asyncio.gather(*manager._tasks.values()), 5)
+        await manager.shutdown()
+        return job
+
+    return asyncio.run(scenario())
+
+
+def test_reupload_only_embeds_changed_chunks(ingestion, tmp_path):
+    collection = DummyCollection()
+    articles = [f'ARTICLE UB {n} - REGLE\n' + f'texte {n} ' * 60 for n in range(1, 5)]
+
+    path, size = spool(tmp_path, 'plu.txt', '\n'.join(articles))
+    first = run_upload(ingestion, collection, path, size, doc_hash='v1')
+    assert first.to_dict()['result']['added'] == 4
+    assert collection.embedded == 4
+
+    # Same content again: nothing is extracted nor embedded
+    path, size = spool(tmp_path, 'plu.txt', '\n'.join(articles))
+    same = run_upload(ingestion, collection, path, size, doc_hash='v1')
+    assert same.pages_extracted == 0
+    assert same.to_dict()['result']['unchanged'] == 4
+    assert collection.embedded == 4
+
+    # Article 2 revised, article 4 removed
+    revised = [articles[0], articles[1].replace('texte 2', 'texte 2 bis', 1), articles[2]]
+    path, size = spool(tmp_path, 'plu.txt', '\n'.join(revised))
+    job = run_upload(ingestion, collection, path, size, doc_hash='v2')
+    result = job.to_dict()['result']
+    assert (result['unchanged'], result['added'], result['removed']) == (2, 1, 2)
+    assert collection.embedded == 5
+    assert len(collection.rows) == 3
+    assert {meta['doc_hash'] for _, meta, _ in collection.rows.values()} == {'v2'}
+
+
+def test_same_filename_in_two_communes_keeps_both(ingestion, tmp_path):
+    collection = DummyCollection()
+
+    async def upload(content, commune):
+        path, size = spool(tmp_path, 'reglement.txt', content)
+        manager = make_manager(ingestion, collection, on_indexed=indexed)
+        manager.submit('reglement.txt', 'txt', path, size, None, commune=commune, doc_hash=content)
+        await asyncio.wait_for(asyncio.gather(*manager._tasks.values()), 5)
+        await manager.shutdown()
+
+    changed = []
+
+    async def indexed(job):
+        changed.append(job.communes_changed)
+
+    asyncio.run(upload('ARTICLE UB 1 - HAUTEUR\n' + 'lyon ' * 80, 'Lyon'))
+    asyncio.run(upload('ARTICLE UB 1 - HAUTEUR\n' + 'paris ' * 80, 'Paris'))
+    assert sorted(meta['commune'] for _, meta, _ in collection.rows.values()) == ['lyon', 'paris']
+
+    # A revised Lyon file replaces the Lyon chunks only
+    asyncio.run(upload('ARTICLE UB 1 - HAUTEUR\n' + 'lyon bis ' * 80, ' LYON '))
+    assert sorted(meta['commune'] for _, meta, _ in collection.rows.values()) == ['lyon', 'paris']
+    assert changed == [{'lyon'}, {'paris'}, {'lyon'}]
+
+
+class FlakyCollection(DummyCollection):
+    """Fails the ``fail_at``-th insertion, as a crash or a full disk would."""
+
+    def __init__(self, fail_at):
+        super().__init__()
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def add(self, documents, ids, metadatas, embeddings=None):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise RuntimeError('disque plein')
+        super().add(documents, ids, metadatas, embeddings)
+
+
+def test_reupload_after_a_failure_midway_indexes_the_rest(ingestion, tmp_path):
+    collection = FlakyCollection(fail_at=2)
+    content = '\n'.join(f'ARTICLE UB {n} - REGLE\n' + f'texte {n} ' * 60 for n in range(1, 5))
+
+    async def upload():
+        path, size = spool(tmp_path, 'plu.txt', content)
+        manager = make_manager(ingestion, collection, batch_size=2)
+        job = manager.submit('plu.txt', 'txt', path, size, 'sess1', doc_hash='v1')
+        await asyncio.wait_for(asyncio.gather(*manager._tasks.values()), 5)
+        await manager.shutdown()
+        return job
+
+    failed = asyncio.run(upload())
+    assert failed.status == 'failed'
+    assert len(collection.rows) == 2
+    # The chunks stored before the failure do not claim the file's hash
+    assert {meta['doc_hash'] for _, meta, _ in collection.rows.values()} == {''}
+
+    job = asyncio.run(upload())
+    assert job.status == 'done'
+    assert job.pages_extracted == 1
+    result = job.to_dict()['result']
+    assert (result['unchanged'], result['added']) == (2, 2)
+    assert len(collection.rows) == 4
+    assert {meta['doc_hash'] for _, meta, _ in collection.rows.values()} == {'v1'}
+
+
+class SlowCollection(DummyCollection):
+    def __init__(self):
+        super().__init__()
+        self.stored = threading.Event()
+
+    def add(self, documents, ids, metadatas, embeddings=None):
+        time.sleep(0.05)
+        super().add(documents, ids, metadatas, embeddings)
+        self.stored.set()
+
+
+def test_cancelling_a_job_stops_its_extraction(ingestion, tmp_path):
+    collection = SlowCollection()
+    content = '\n'.join(f'ARTICLE UB {n} - REGLE\n' + f'texte {n} ' * 60 for n in range(1, 30))
+    path, size = spool(tmp_path, 'plu.txt', content)
+
+    async def scenario():
+        manager = make_manager(ingestion, collection, batch_size=1)
+        manager.submit('plu.txt', 'txt', path, size, 'sess1', doc_hash='v1')
+        while not collection.stored.is_set():
+            await asyncio.sleep(0.01)
+        # The producer is blocked on the full queue when the job is cancelled
+        await manager.shutdown()
+        others = asyncio.all_tasks() - {asyncio.current_task()}
+        done, pending = await asyncio.wait(others, timeout=2)
+        return pending
+
+    assert not asyncio.run(scenario())
+
+
+def test_identical_file_in_other_session_reuses_embeddings(ingestion, tmp_path):
+    collection = DummyCollection()
+    content = '\n'.join(f'ARTICLE N {n} - REGLE\n' + f'texte {n} ' * 60 for n in range(1, 4))
+    path, size = spool(tmp_path, 'plu.txt', content)
+    run_upload(ingestion, collection, path, size, session='a')
+    path, size = spool(tmp_path, 'plu.txt', content)
+    job = run_upload(ingestion, collection, path, size, session='b')
+
+    assert job.to_dict()['result']['added'] == 3
+    assert job.embeddings_reused == 3
+    assert collection.embedded == 3
+    assert len(collection.rows) == 6
+
+
+def test_pdf_pages_are_extracted_in_parallel_ranges(ingestion, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, 'PAGES_PER_TASK', 2)
+    collection = DummyCollection()
+    pages = [f'Article {n} : ' + 'mot ' * 150 for n in range(1, 6)]
+    path, size = spool(tmp_path, 'plu.pdf', '\n'.join(pages))
+
+    async def scenario():
+        manager = make_manager(ingestion, collection)
+        job = manager.submit('plu.pdf', 'pdf', path, size, None)
+        await asyncio.wait_for(asyncio.gather(*manager._tasks.values()), 5)
+        await manager.shutdown()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == 'done'
+    assert job.pages_total == job.pages_extracted == 5
+    documents = [doc for batch in collection.added for doc in batch[0]]
+    metadatas = [meta for batch in collection.added for meta in batch[2]]
+    assert [doc.split(' :')[0] for doc in documents] == [f'Article {n}' for n in range(1, 6)]
+    assert [meta['page'] for meta in metadatas] == [1, 2, 3, 4, 5]
+    # Global documents never expire
+    assert all('expires_at' not in meta for meta in metadatas)
+
+
+def test_upload_job_reports_extraction_failure(ingestion, tmp_path):
+    path, size = spool(tmp_path, 'empty.txt', '')
+
+    async def scenario():
+        manager = make_manager(ingestion, DummyCollection())
+        job = manager.submit('empty.txt', 'txt', path, size, None)
+        await asyncio.wait_for(asyncio.gather(*manager._tasks.values()), 5)
+        await manager.shutdown()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == 'failed'
+    assert 'extraire' in job.error
+
+
+def test_submit_rejects_when_queue_full(ingestion, tmp_path):
+    path, size = spool(tmp_path, 'a.txt', 'a')
+
+    async def scenario():
+        manager = make_manager(ingestion, DummyCollection(), max_pending=1)
+        manager.submit('a.txt', 'txt', path, size, None)
+        with pytest.raises(ingestion.IngestionQueueFull):
+            manager.submit('b.txt', 'txt', path, size, None)
+        await asyncio.gather(*manager._tasks.values())
+        await manager.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_batch_embeds_chunks_of_several_files_together(ingestion, tmp_path):
+    collection = DummyCollection()
+    files = []
+    for name in ('reglement.txt', 'annexe.txt'):
+        content = '\n'.join(f'ARTICLE {name[0].upper()} {n} - REGLE\n' + f'{name} {n} ' * 60 for n in range(1, 4))
+        path, size = spool(tmp_path, name, content)
+        files.append((name, 'txt', path, size, name))
+    path, size = spool(tmp_path, 'vide.txt', '')
+    files.append(('vide.txt', 'txt', path, size, 'vide'))
+
+    async def scenario():
+        manager = make_manager(ingestion, collection, bulk_batch_size=8)
+        batch = manager.submit_batch(files, 'sess1', commune='Saint-Denis', remove_files=False)
+        assert manager.pending() == 1
+        await asyncio.wait_for(manager.drain(), 5)
+        await manager.shutdown()
+        return manager, batch
+
+    manager, batch = asyncio.run(scenario())
+    assert [job.status for job in batch.jobs] == ['done', 'done', 'failed']
+    assert manager.get_batch(batch.batch_id) is batch
+    # One embedding batch and one insert for both files
+    assert len(collection.added) == 1
+    assert {meta['filename'] for meta in collection.added[0][2]} == {'reglement.txt', 'annexe.txt'}
+    report = batch.to_dict()['report']
+    assert (report['files'], report['files_done'], report['files_failed']) == (3, 2, 1)
+    assert report['chunks'] == report['chunks_added'] == 6
+    assert report['embed_batches'] == 1
+    assert report['chunks_per_s'] > 0
+    assert (tmp_path / 'reglement.txt').exists()
+
+
+def test_cli_collects_supported_files_by_relative_path(ingestion, tmp_path):
+    import ingest
+
+    (tmp_path / 'annexes').mkdir()
+    (tmp_path / 'annexes' / 'notice.txt').write_text('notice')
+    (tmp_path / 'reglement.txt').write_text('règlement')
+    (tmp_path / 'plan.dwg').write_text('ignoré')
+
+    files = ingest.collect_files(str(tmp_path))
+    assert [(name, doc_type, size) for name, doc_type, _, size, _ in files] == [
+        ('reglement.txt', 'txt', len('règlement'.encode())),
+        ('annexes/notice.txt', 'txt', 6),
+    ]
+    assert files[1][4] == ingestion.file_sha256(str(tmp_path / 'annexes' / 'notice.txt'))
@@ -0,0 +1,91 @@
+import asyncio
+
+from job_status import JobBoard
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value, ex))
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        for key, value, ex in self.commands:
+            self.redis.store[key] = value
+            self.redis.ttls[key] = ex
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+        self.ttls = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        return self.store.get(key)
+
+
+class Job:
+    def __init__(self, status='running'):
+        self.status = status
+        self.done = 0
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        return {'status': self.status, 'done': self.done}
+
+
+def test_other_workers_read_the_progress_of_a_job():
+    redis = FakeRedis()
+    jobs = {}
+    worker, other = JobBoard(redis, ttl=60), JobBoard(redis)
+    worker.track('upload', lambda: jobs)
+
+    async def scenario():
+        jobs['j1'] = Job()
+        # Published as soon as it is submitted, then on every flush
+        await worker.publish('upload', 'j1', jobs['j1'])
+        seen = [await other.get('upload', 'j1')]
+        jobs['j1'].done = 3
+        await worker.flush()
+        seen.append(await other.get('upload', 'j1'))
+        jobs['j1'].status = 'done'
+        await worker.flush()
+        seen.append(await other.get('upload', 'j1'))
+        trips = redis.round_trips
+        # A finished job is written once more, then no longer
+        await worker.flush()
+        return seen, redis.round_trips - trips, await other.get('upload', 'inconnu')
+
+    seen, trips, unknown = asyncio.run(scenario())
+    assert seen == [{'status': 'running', 'done': 0}, {'status': 'running', 'done': 3}, {'status': 'done', 'done': 3}]
+    assert trips == 0
+    assert unknown is None
+    assert redis.ttls == {'urbanisme:jobs:upload:j1': 60}
+
+
+def test_without_redis_only_local_jobs_are_known():
+    board = JobBoard()
+    board.track('deletion', lambda: {'j1': Job('done')})
+
+    async def scenario():
+        await board.publish('deletion', 'j1', Job())
+        await board.flush()
+        return await board.get('deletion', 'j1')
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,145 @@
+import asyncio
+import importlib
+import json
+import sys
+import time
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+
+
+@pytest.fixture()
+def llm(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'httpx', httpx)
+    monkeypatch.delitem(sys.modules, 'llm_client', raising=False)
+    module = importlib.import_module('llm_client')
+    monkeypatch.setattr(module, 'RETRY_BASE_DELAY', 0.0)
+    return module
+
+
+def mock_server(responses):
+    """Local mock Groq endpoint replaying ``responses`` in order."""
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        status, headers = responses[min(len(seen), len(responses)) - 1]
+        body = {'choices': [{'message': {'content': 'Ok'}}]} if status == 200 else {'error': 'x'}
+        return httpx.Response(status, headers=headers, json=body)
+
+    return httpx.MockTransport(handler), seen
+
+
+def completion_payload():
+    return {'model': 'm', 'messages': [{'role': 'user', 'content': 'hauteur ?'}]}
+
+
+def test_chat_retries_429_honoring_retry_after(llm):
+    transport, seen = mock_server([(429, {'Retry-After': '0'}), (200, {})])
+
+    async def scenario():
+        client = llm.GroqClient('key', base_url='http://mock', requests_per_minute=6000, transport=transport)
+        data = await client.chat(completion_payload())
+        await client.aclose()
+        return client, data
+
+    client, data = asyncio.run(scenario())
+    assert data['choices'][0]['message']['content'] == 'Ok'
+    assert len(seen) == 2
+    assert seen[0].headers['authorization'] == 'Bearer key'
+    assert seen[0].url.path == '/chat/completions'
+    summary = client.metrics.summary()
+    assert summary['calls'] == 2
+    assert summary['retries'] == 1
+    assert summary['latency_p50'] is not None
+
+
+def test_chat_gives_up_after_max_retries(llm):
+    transport, seen = mock_server([(503, {})])
+
+    async def scenario():
+        client = llm.GroqClient('key', base_url='http://mock', requests_per_minute=6000,
+                                max_retries=2, transport=transport)
+        try:
+            await client.chat(completion_payload())
+        finally:
+            await client.aclose()
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(scenario())
+    assert len(seen) == 3
+
+
+def test_token_bucket_queues_instead_of_failing(llm):
+    async def scenario():
+        bucket = llm.TokenBucket(rate_per_minute=600, capacity=1)
+        start = time.monotonic()
+        waits = await asyncio.gather(*(bucket.acquire() for _ in range(3)))
+        return time.monotonic() - start, waits
+
+    elapsed, waits = asyncio.run(scenario())
+    assert elapsed >= 0.18
+    assert waits[0] < 0.05
+
+
+def test_workers_share_the_account_quota(llm, monkeypatch):
+    monkeypatch.setenv('GROQ_REQUESTS_PER_MINUTE', '30')
+    monkeypatch.setenv('WEB_CONCURRENCY', '4')
+    module = importlib.reload(llm)
+
+    async def scenario():
+        client = module.GroqClient('key')
+        await client.aclose()
+        return client._bucket.rate
+
+    assert asyncio.run(scenario()) == pytest.approx(7.5 / 60)
+
+
+def test_parse_retry_after(llm):
+    assert llm.parse_retry_after('2') == 2.0
+    assert llm.parse_retry_after(None) is None
+    assert llm.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_stream_chat_yields_tokens_after_retry(llm):
+    calls = []
+
+    def handler(request):
+        calls.append(json.loads(request.content))
+        if len(calls) == 1:
+            return httpx.Response(429, headers={'Retry-After': '0'})
+        events = [{'choices': [{'delta': {'content': token}}]} for token in ('Zone', ' UB')]
+        body = ''.join(f'data: {json.dumps(e)}\n\n' for e in events) + 'data: [DONE]\n\n'
+        return httpx.Response(200, text=body)
+
+    async def scenario():
+        client = llm.GroqClient('key', base_url='http://mock', requests_per_minute=6000,
+                                transport=httpx.MockTransport(handler))
+        tokens = [token async for token in client.stream_chat(completion_payload())]
+        await client.aclose()
+        return client, tokens
+
+    client, tokens = asyncio.run(scenario())
+    assert tokens == ['Zone', ' UB']
+    assert calls[-1]['stream'] is True
+    assert client.metrics.summary()['first_token_p50'] is not None
+
+
+def test_reserved_call_uses_the_token_taken_ahead(llm):
+    transport, seen = mock_server([(200, {})])
+
+    async def scenario():
+        # Capacity of one request: a second token would take 6 s
+        client = llm.GroqClient('key', base_url='http://mock', requests_per_minute=10, transport=transport)
+        client._bucket.capacity = client._bucket._tokens = 1
+        wait = await client.reserve()
+        start = time.monotonic()
+        await asyncio.wait_for(client.chat(completion_payload(), reserved=True), 1)
+        elapsed = time.monotonic() - start
+        await client.aclose()
+        return wait, elapsed
+
+    wait, elapsed = asyncio.run(scenario())
+    assert wait < 0.1 and elapsed < 1
+    assert len(seen) == 1
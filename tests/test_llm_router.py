@@ -0,0 +1,108 @@
+import asyncio
+
+from llm_router import LLMAnswer, ModelRouter, generate_mock_response
+
+LONG_QUESTION = "Quelles sont les règles de hauteur, de recul et d'emprise au sol en zone UB ? " * 3
+
+
+class FakeClient:
+    """Stands in for ``GroqClient``: a delay and an answer per model."""
+
+    def __init__(self, delays, fail=(), queue=0.0):
+        self.delays = delays
+        self.fail = set(fail)
+        self.queue = queue
+        self.models = []
+
+    async def reserve(self):
+        # Rate limiter wait
+        await asyncio.sleep(self.queue)
+        return self.queue
+
+    async def chat(self, payload, reserved=False):
+        model = payload["model"]
+        self.models.append(model)
+        await asyncio.sleep(self.delays[model])
+        if model in self.fail:
+            raise RuntimeError("HTTP 500")
+        return {"choices": [{"message": {"content": f"réponse {model}"}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 20}}
+
+    async def stream_chat(self, payload, reserved=False):
+        model = payload["model"]
+        self.models.append(model)
+        await asyncio.sleep(self.delays[model])
+        for token in ("réponse ", model):
+            yield token
+
+
+def router(**kwargs):
+    return ModelRouter(fast_model="fast", large_model="large", **kwargs)
+
+
+def test_routes_on_question_length_context_and_observed_latency():
+    r = router(slo=1.0, slow_ratio=0.5, probe_every=3)
+    assert r.choose("Hauteur en UB ?", "") == ("fast", "simple")
+    assert r.choose(LONG_QUESTION, "") == ("large", "complex")
+    assert r.choose("Hauteur en UB ?", "article " * 1000) == ("large", "complex")
+
+    r.models["large"].observe(0.8, 100)
+    # Too slow for the SLO: avoided, but still tried now and then
+    assert [r.choose(LONG_QUESTION, "")[1] for _ in range(3)] == ["large_slow", "large_slow", "probe"]
+
+
+def test_large_model_past_its_budget_falls_back_to_fast():
+    client = FakeClient({"large": 0.5, "fast": 0.01})
+    r = router(slo=0.3)
+    r.models["fast"].observe(0.05, 20)
+    answer = asyncio.run(r.complete(client, LONG_QUESTION, ""))
+
+    assert client.models == ["large", "fast"]
+    assert (answer.text, answer.model, answer.reason, answer.fallback) == ("réponse fast", "fast", "complex", "fast")
+    stats = r.stats()
+    assert stats["models"]["large"]["timeouts"] == 1
+    assert stats["models"]["fast"]["tokens_per_second_p50"] > 0
+    assert stats["fallbacks"] == {"fast": 1}
+
+
+def test_offline_answer_when_every_model_fails_or_without_client():
+    client = FakeClient({"large": 0.0, "fast": 0.0}, fail={"large", "fast"})
+    r = router(slo=1.0)
+    answer = asyncio.run(r.complete(client, "Hauteur max ?", ""))
+    assert client.models == ["fast"]
+    assert answer.offline and answer.text == generate_mock_response("Hauteur max ?")
+    assert r.stats()["models"]["fast"]["errors"] == 1
+
+    assert asyncio.run(r.complete(None, "recul ?", "")).model == "simulation"
+    # Only the failure counts as a fallback, not the missing key
+    assert r.stats()["fallbacks"] == {"offline": 1}
+
+
+def test_stream_falls_back_before_the_first_token():
+    client = FakeClient({"large": 0.5, "fast": 0.01})
+    r = router(slo=0.3)
+    r.models["fast"].observe(0.05, 20)
+
+    async def collect():
+        tokens = []
+        answer = LLMAnswer()
+        async for token in r.stream(client, LONG_QUESTION, "", answer):
+            tokens.append(token)
+        return tokens, answer
+
+    tokens, answer = asyncio.run(collect())
+    assert tokens == ["réponse ", "fast"]
+    assert (answer.text, answer.fallback) == ("réponse fast", "fast")
+    assert r.models["large"].timeouts == 1
+
+
+def test_rate_limit_wait_counts_neither_against_the_slo_nor_the_latency():
+    client = FakeClient({"large": 0.1, "fast": 0.01}, queue=0.4)
+    r = router(slo=0.3)
+    r.models["fast"].observe(0.05, 20)
+    answer = asyncio.run(r.complete(client, LONG_QUESTION, ""))
+
+    # 0.5 s in all, but only 0.1 s of it in the model
+    assert (answer.model, answer.fallback) == ("large", None)
+    assert r.models["large"].latency < 0.3
+    assert r.stats()["queue_wait_total"] == 0.4
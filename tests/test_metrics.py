@@ -0,0 +1,91 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram('test_stage_seconds', 'Test', ['stage'], buckets=(0.1, 1.0))
+    try:
+        histogram.labels(stage='embed').observe(0.05)
+        histogram.labels(stage='embed').observe(0.5)
+        histogram.labels(stage='embed').observe(3)
+        text = metrics.render()
+    finally:
+        metrics.REGISTRY.remove(histogram)
+
+    assert '# TYPE test_stage_seconds histogram' in text
+    assert 'test_stage_seconds_bucket{stage="embed",le="0.1"} 1' in text
+    assert 'test_stage_seconds_bucket{stage="embed",le="1"} 2' in text
+    assert 'test_stage_seconds_bucket{stage="embed",le="+Inf"} 3' in text
+    assert 'test_stage_seconds_sum{stage="embed"} 3.55' in text
+    assert 'test_stage_seconds_count{stage="embed"} 3' in text
+
+
+def test_trace_collects_stages_of_the_current_request():
+    before = metrics.QUERY_STAGES.labels(stage='embed').count
+    with metrics.trace() as timings:
+        with metrics.stage('embed'):
+            pass
+        metrics.record('search', 0.25)
+        metrics.record('search', 0.25)
+    metrics.record('search', 1.0)
+
+    assert set(timings) == {'embed', 'search'}
+    assert timings['search'] == 0.5
+    assert metrics.QUERY_STAGES.labels(stage='embed').count == before + 1
+
+
+def test_loop_lag_monitor_sees_blocking_calls():
+    async def scenario():
+        monitor = metrics.LoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)  # blocks the event loop
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+
+    lag = metrics.LOOP_LAG.labels()
+    count, total = lag.count, lag.sum
+    asyncio.run(scenario())
+    assert lag.count > count
+    assert lag.sum - total >= 0.08
+
+
+def test_metric_types_must_implement_their_samples():
+    class Incomplete(metrics._Metric):
+        kind = 'gauge'
+
+    with pytest.raises(TypeError):
+        Incomplete('test_incomplete', 'Test')
+
+
+def test_render_sums_the_workers_snapshots(tmp_path):
+    histogram = metrics.Histogram('test_shared_seconds', 'Test', ['stage'], buckets=(0.1, 1.0))
+    counter = metrics.Counter('test_shared', 'Test', ['result'])
+    try:
+        histogram.labels(stage='embed').observe(0.05)
+        counter.labels(result='llm').inc()
+        # Another worker's values, as MetricsWriter saves them
+        other = {
+            'test_shared_seconds': {json.dumps(['embed']): [[0, 1], 1, 0.5], json.dumps(['search']): [[1, 0], 1, 0.01]},
+            'test_shared': {json.dumps(['llm']): 2},
+        }
+        (tmp_path / 'metrics_1.json').write_text(json.dumps(other))
+        text = metrics.render(str(tmp_path))
+        metrics.write_snapshot(str(tmp_path))
+    finally:
+        metrics.REGISTRY.remove(histogram)
+        metrics.REGISTRY.remove(counter)
+
+    assert 'test_shared_seconds_bucket{stage="embed",le="0.1"} 1' in text
+    assert 'test_shared_seconds_bucket{stage="embed",le="1"} 2' in text
+    assert 'test_shared_seconds_count{stage="embed"} 2' in text
+    assert 'test_shared_seconds_sum{stage="embed"} 0.55' in text
+    assert 'test_shared_seconds_count{stage="search"} 1' in text
+    assert 'test_shared_total{result="llm"} 3' in text
+    saved = json.loads(next(p for p in tmp_path.glob('metrics_*.json') if p.name != 'metrics_1.json').read_text())
+    assert saved['test_shared'] == {json.dumps(['llm']): 1}
@@ -0,0 +1,26 @@
+import asyncio
+
+from periodic import cancel, periodic
+
+
+def test_periodic_keeps_running_after_a_failure():
+    calls = []
+
+    async def flush():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise RuntimeError('redis indisponible')
+
+    async def scenario():
+        task = periodic(0.01, flush)
+        await asyncio.sleep(0.1)
+        await cancel(task)
+        return task
+
+    task = asyncio.run(scenario())
+    assert len(calls) >= 3
+    assert task.cancelled()
+
+
+def test_cancel_accepts_a_task_never_started():
+    asyncio.run(cancel(None))
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+from query_log import CacheWarmer, QueryLog
+
+
+def make_log(tmp_path, asked):
+    log = QueryLog(path=str(tmp_path / "queries.jsonl"))
+    for question, commune, session in asked:
+        log.record(question, commune, session, True, False, {"embed": 0.0123, "total": 1.5})
+    asyncio.run(log.flush())
+    return log
+
+
+def test_entries_are_compact_lines(tmp_path):
+    log = make_log(tmp_path, [("Hauteur max en UB ?", "Saint-Denis", False)])
+    [line] = (tmp_path / "queries.jsonl").read_text().splitlines()
+    entry = json.loads(line)
+    assert entry["q"] == "Hauteur max en UB ?"
+    assert (entry["c"], entry["s"], entry["x"], entry["h"]) == ("saint-denis", 0, 1, 0)
+    assert entry["ms"] == {"embed": 12, "total": 1500}
+    assert log.stats()["written"] == 1
+
+
+def test_top_questions_by_commune(tmp_path):
+    log = make_log(tmp_path, [
+        ("Hauteur max en UB ?", "Saint-Denis", False),
+        ("hauteur max en  UB ?", "saint-denis", False),
+        ("Hauteur max en UB ?", "Saint-Denis", False),
+        ("Piscine ?", "Saint-Denis", False),
+        ("Piscine ?", "Saint-Denis", False),
+        ("Emprise au sol ?", "Saint-Denis", False),
+        # Session questions depend on its documents
+        ("Mon terrain ?", None, True),
+        ("Mon terrain ?", None, True),
+        ("Clôture ?", None, False),
+        ("Clôture ?", None, False),
+    ])
+    assert log.top_questions(n=5) == {
+        "saint-denis": [("Hauteur max en UB ?", True, 3), ("Piscine ?", True, 2)],
+        "": [("Clôture ?", True, 2)],
+    }
+    assert log.top_questions(n=1)["saint-denis"] == [("Hauteur max en UB ?", True, 3)]
+
+
+def test_warmer_refreshes_stale_answers_and_forces_changed_communes(tmp_path):
+    log = make_log(tmp_path, [("Piscine ?", "Saint-Denis", False)] * 2 + [("Clôture ?", "Bobigny", False)] * 2)
+    answered = []
+
+    async def is_fresh(commune, question, use_context):
+        return commune == "bobigny"
+
+    async def answer(commune, question, use_context, force):
+        answered.append((commune, question, force))
+
+    async def scenario():
+        warmer = CacheWarmer(log, is_fresh, answer, rate_per_minute=6000)
+        await warmer.run_once()
+        await warmer.run_once({"bobigny"})
+        return warmer.stats()
+
+    stats = asyncio.run(scenario())
+    assert answered == [
+        ("saint-denis", "Piscine ?", False),
+        ("saint-denis", "Piscine ?", False),
+        ("bobigny", "Clôture ?", True),
+    ]
+    assert (stats["rounds"], stats["warmed"], stats["fresh"]) == (2, 3, 1)
+
+
+def test_warmer_stops_when_users_are_waiting(tmp_path):
+    log = make_log(tmp_path, [("A ?", None, False)] * 2 + [("B ?", None, False)] * 2)
+
+    async def is_fresh(commune, question, use_context):
+        return False
+
+    async def answer(commune, question, use_context, force):
+        raise RuntimeError("questions en attente")
+
+    async def scenario():
+        warmer = CacheWarmer(log, is_fresh, answer, rate_per_minute=6000)
+        return await warmer.run_once(), warmer.stats()
+
+    warmed, stats = asyncio.run(scenario())
+    assert (warmed, stats["errors"]) == (0, 1)
+
+
+def test_warm_lock_outlives_a_sub_second_interval(tmp_path):
+    log = make_log(tmp_path, [("Piscine ?", None, False)] * 2)
+    answered = []
+
+    class LockRedis:
+        def __init__(self):
+            self.sets = []
+            self.store = {}
+
+        async def set(self, key, value, nx=False, ex=None, px=None):
+            # Redis rejects a zero expiry
+            assert not ex and px > 0
+            self.sets.append(px)
+            self.store[key] = value
+            return True
+
+        async def eval(self, script, numkeys, key, token):
+            if self.store.get(key) == token:
+                del self.store[key]
+
+    async def is_fresh(commune, question, use_context):
+        return False
+
+    async def answer(commune, question, use_context, force):
+        answered.append(question)
+
+    async def scenario():
+        redis = LockRedis()
+        warmer = CacheWarmer(log, is_fresh, answer, redis_client=redis, interval=0.5, rate_per_minute=6000)
+        return await warmer.run_once(), redis.sets, redis.store
+
+    warmed, sets, store = asyncio.run(scenario())
+    assert (warmed, sets, answered) == (1, [500], ["Piscine ?"])
+    # Released with a compare-and-delete once the round is over
+    assert store == {}
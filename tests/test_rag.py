@@ -43,7 +43,11 @@ def rag(monkeypatch):
         async def post(self, *a, **k):
             return None
 
-    dummy_httpx = types.SimpleNamespace(AsyncClient=_DummyAsyncClient)
+    dummy_httpx = types.SimpleNamespace(
+        AsyncClient=_DummyAsyncClient,
+        Limits=lambda **k: None,
+        Timeout=lambda *a, **k: None,
+    )
     dummy_dotenv = types.SimpleNamespace(load_dotenv=lambda: None)
 
     monkeypatch.setitem(sys.modules, 'chromadb', dummy_chromadb)
@@ -51,6 +55,8 @@ def rag(monkeypatch):
     monkeypatch.setitem(sys.modules, 'httpx', dummy_httpx)
     monkeypatch.setitem(sys.modules, 'dotenv', dummy_dotenv)
 
+    monkeypatch.delitem(sys.modules, 'retrieval', raising=False)
+    monkeypatch.delitem(sys.modules, 'llm_client', raising=False)
     rag_utils = importlib.import_module('backend.rag_utils')
     importlib.reload(rag_utils)
     return rag_utils
@@ -69,8 +75,22 @@ def test_retrieve_and_generate(monkeypatch, rag):
                                          json=lambda: {'choices': [{'message': {'content': 'Ok'}}]},
                                          raise_for_status=lambda: None)
 
-    monkeypatch.setattr(rag.httpx, 'AsyncClient', DummyClient)
+    class DummyService:
+        def embed(self, texts):
+            return [[1.0] for _ in texts]
+
+        def search_hits_many(self, queries):
+            return [[{"id": "ub10", "text": "snippet", "metadata": {}, "score": 1.0}] for _ in queries]
+
+    monkeypatch.setattr(sys.modules['llm_client'].httpx, 'AsyncClient', DummyClient)
+    monkeypatch.setattr(sys.modules['retrieval'], '_service', DummyService())
     question = 'Quelle est la hauteur maximale?'
-    context = ' '.join(rag.retrieve_context(question))
-    answer = asyncio.run(rag.generate_llm_answer(question, context, 'key'))
-    assert answer
+
+    async def scenario():
+        hits = await rag.retrieve_context_batched(question)
+        return hits, await rag.generate_llm_answer(question, ' '.join(hit['text'] for hit in hits), 'key')
+
+    hits, answer = asyncio.run(scenario())
+    assert [hit['text'] for hit in hits] == ['snippet']
+    assert answer.text == 'Ok'
+    assert answer.fallback is None
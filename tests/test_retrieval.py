@@ -0,0 +1,165 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+
+class DummyCollection:
+    def __init__(self):
+        self.queries = []
+        self.stored = {
+            "ids": ["ub10", "uc9"],
+            "documents": ["Article UB 10 : hauteur limitée à R+3", "Article UC 9 : emprise au sol"],
+            "metadatas": [{"session_id": "global"}, {"session_id": "s1"}],
+        }
+
+    def count(self):
+        return 3
+
+    def get(self, include=None, limit=None, offset=0):
+        return {key: values[offset:offset + limit] for key, values in self.stored.items()}
+
+    def delete(self, ids):
+        pass
+
+    def update(self, ids, metadatas):
+        for doc_id, meta in zip(ids, metadatas):
+            self.stored["metadatas"][self.stored["ids"].index(doc_id)] = meta
+
+    def query(self, query_embeddings, n_results, where=None, include=None):
+        self.queries.append((len(query_embeddings), n_results, where))
+        return {
+            "ids": [[f"{e[0]}-{n}" for n in range(2)] for e in query_embeddings],
+            "documents": [[f"doc {e[0]}-{n}" for n in range(2)] for e in query_embeddings],
+            # Cosine similarities 0.7 and 0.15
+            "distances": [[0.6, 1.7] for _ in query_embeddings],
+        }
+
+
+class DummyClient:
+    instances = 0
+
+    def __init__(self, *a, **k):
+        DummyClient.instances += 1
+
+    def get_or_create_collection(self, *a, **k):
+        return DummyCollection()
+
+
+@pytest.fixture()
+def retrieval(monkeypatch):
+    models = []
+    embedding_functions = types.SimpleNamespace(
+        SentenceTransformerEmbeddingFunction=lambda *a, **k: models.append(k) or object()
+    )
+    chromadb = types.SimpleNamespace(
+        PersistentClient=DummyClient,
+        utils=types.SimpleNamespace(embedding_functions=embedding_functions),
+    )
+    monkeypatch.setitem(sys.modules, 'chromadb', chromadb)
+    monkeypatch.setitem(sys.modules, 'chromadb.utils', chromadb.utils)
+    monkeypatch.delitem(sys.modules, 'retrieval', raising=False)
+    DummyClient.instances = 0
+    module = importlib.import_module('retrieval')
+    module.models = models
+    return module
+
+
+def test_service_is_shared_by_rag_utils(retrieval, monkeypatch):
+    monkeypatch.delitem(sys.modules, 'rag_utils', raising=False)
+    rag_utils = importlib.import_module('rag_utils')
+
+    service = retrieval.RetrievalService()
+    retrieval.set_retrieval_service(service)
+    assert rag_utils.get_retrieval_service() is service
+    assert retrieval.get_retrieval_service() is service
+    assert DummyClient.instances == 1
+    assert len(retrieval.models) == 1
+    retrieval.set_retrieval_service(None)
+
+
+def test_service_stats_report_startup_and_memory(retrieval):
+    stats = retrieval.RetrievalService().stats()
+    assert stats['documents'] == 3
+    assert stats['startup_seconds'] >= 0
+    assert stats['rss_mb'] > 0
+
+
+def test_build_where_scopes_session_and_commune():
+    from scopes import build_where
+
+    assert build_where() == {"session_id": "global"}
+    assert build_where("s1") == {"session_id": {"$in": ["global", "s1"]}}
+    assert build_where("s1", " Saint-Denis ") == {"$and": [
+        {"session_id": {"$in": ["global", "s1"]}},
+        {"commune": {"$in": ["saint-denis", ""]}},
+    ]}
+
+
+def test_search_many_runs_one_query_per_scope(retrieval):
+    service = retrieval.RetrievalService()
+    where_a, where_b = {"session_id": "global"}, {"session_id": {"$in": ["global", "s1"]}}
+    results = service.search_many([
+        ("piscine", [1], 2, where_a), ("piscine", [2], 1, where_b), ("piscine", [3], 1, where_a),
+    ])
+    assert results == [["doc 1-0", "doc 1-1"], ["doc 2-0"], ["doc 3-0"]]
+    n = retrieval.HYBRID_CANDIDATES
+    assert service.collection.queries == [(2, n, where_a), (1, n, where_b)]
+
+
+def test_search_many_fuses_keyword_hits_within_scope(retrieval):
+    service = retrieval.RetrievalService()
+    assert service.stats()["keyword_index"] == 2
+    where = {"session_id": "global"}
+    [results] = service.search_many([("hauteur R+3 en UB ?", [1], 2, where)])
+    # The exact-token match ranks first in BM25 and ties at the top after fusion
+    assert results[0] in ("doc 1-0", "Article UB 10 : hauteur limitée à R+3")
+    assert "Article UB 10 : hauteur limitée à R+3" in results
+    [results] = service.search_many([("emprise au sol UC", [1], 3, where)])
+    assert "Article UC 9 : emprise au sol" not in results
+
+    service.delete(["ub10"])
+    [results] = service.search_many([("hauteur R+3", [1], 3, where)])
+    assert results == ["doc 1-0", "doc 1-1"]
+
+
+def test_search_hits_carry_fused_score_and_metadata(retrieval):
+    service = retrieval.RetrievalService()
+    [hits] = service.search_hits_many([("hauteur R+3 en UB ?", [1], 3, {"session_id": "global"})])
+    by_id = {hit["id"]: hit for hit in hits}
+    # Keyword-only hit: metadata comes from the BM25 index
+    assert by_id["ub10"]["metadata"] == {"session_id": "global", "commune": ""}
+    assert by_id["1-1"]["metadata"] == {}
+    assert [hit["score"] for hit in hits] == sorted((hit["score"] for hit in hits), reverse=True)
+    from hybrid import RRF_K
+    assert by_id["1-0"]["score"] == pytest.approx(1 / (RRF_K + 1))
+    assert by_id["1-0"]["similarity"] == pytest.approx(0.7)
+    assert by_id["ub10"]["similarity"] is None and by_id["ub10"]["keyword_score"] > 0
+
+
+def test_packer_drops_fused_hits_of_low_relevance(retrieval):
+    from context_packing import ContextPacker
+
+    service = retrieval.RetrievalService()
+    [hits] = service.search_hits_many([("hauteur R+3 en UB ?", [1], 3, {"session_id": "global"})])
+    # RRF keeps the weak vector hit close to the best fused score...
+    assert min(hit["score"] for hit in hits) > 0.9 * max(hit["score"] for hit in hits)
+    packer = ContextPacker(budget=10_000, min_score_ratio=0.4)
+    packed = packer.pack(hits)
+    # ...its similarity is far below the best one: only the keyword and the close vector hits remain
+    assert packer.stats()["dropped_low_score"] == 1
+    assert "doc 1-1" not in packed.text
+    assert "doc 1-0" in packed.text and "Article UB 10" in packed.text
+
+
+def test_chunks_indexed_before_communes_stay_visible_to_commune_questions(retrieval):
+    from scopes import build_where
+
+    service = retrieval.RetrievalService()
+    # The stored metadata dicts have no "commune" key
+    assert service.collection.stored["metadatas"] == [
+        {"session_id": "global", "commune": ""}, {"session_id": "s1", "commune": ""},
+    ]
+    [results] = service.search_many([("hauteur R+3 en UB ?", [1], 3, build_where(None, "Lyon"))])
+    assert "Article UB 10 : hauteur limitée à R+3" in results
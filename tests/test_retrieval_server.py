@@ -0,0 +1,140 @@
+import json
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from retrieval_client import RemoteRetrievalService, RetrievalServiceError, parse_address
+from retrieval_server import RetrievalServer, main as server_main
+from scopes import matches_where
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+KEY = "test-key"
+
+WORKER = """
+import json, sys
+from retrieval_client import RemoteRetrievalService
+service = RemoteRetrievalService(sys.argv[1], authkey=sys.argv[2])
+service.warm_up()
+worker = sys.argv[3]
+ids = [f"{worker}-{i}" for i in range(5)]
+service.add([f"chunk {i} du worker {worker}" for i in range(5)], ids,
+            [{"session_id": worker} for _ in ids])
+embedding = service.embed(["hauteur"])[0]
+hits = service.search_hits_many([("hauteur", embedding, 3, {"session_id": worker})])[0]
+print(json.dumps({"ids": [hit["id"] for hit in hits], "count": service.count()}))
+"""
+
+
+class InMemoryService:
+    """Stands in for ``RetrievalService``: documents by id, length-based embeddings."""
+
+    def __init__(self):
+        self.rows = {}
+        self.embed_calls = []
+        self.lock = threading.Lock()
+        self.embedding_cache = type("Cache", (), {"stats": lambda self: {"entries": 0}})()
+
+    def embed(self, texts):
+        self.embed_calls.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+    def add(self, documents, ids, metadatas, embeddings=None):
+        embeddings = embeddings or self.embed(documents)
+        with self.lock:
+            for doc_id, text, meta, vector in zip(ids, documents, metadatas, embeddings):
+                self.rows[doc_id] = (text, meta, vector)
+
+    def update(self, ids, metadatas):
+        with self.lock:
+            for doc_id, meta in zip(ids, metadatas):
+                text, _, vector = self.rows[doc_id]
+                self.rows[doc_id] = (text, meta, vector)
+
+    def get(self, where=None, include=(), limit=None):
+        ids = [doc_id for doc_id, (_, meta, _) in self.rows.items() if matches_where(where or {}, meta)]
+        return {"ids": ids[:limit], "metadatas": [self.rows[i][1] for i in ids[:limit]]}
+
+    def delete(self, ids):
+        with self.lock:
+            for doc_id in ids:
+                self.rows.pop(doc_id, None)
+
+    def count(self):
+        return len(self.rows)
+
+    def search_hits_many(self, queries):
+        results = []
+        for question, embedding, top_k, where in queries:
+            found = [(doc_id, text, meta) for doc_id, (text, meta, _) in sorted(self.rows.items())
+                     if matches_where(where or {}, meta)]
+            results.append([{"id": doc_id, "text": text, "metadata": meta, "score": 1.0}
+                            for doc_id, text, meta in found[:top_k]])
+        return results
+
+    def stats(self):
+        return {"documents": len(self.rows)}
+
+
+@pytest.fixture()
+def server(tmp_path):
+    service = InMemoryService()
+    server = RetrievalServer(service, f"unix://{tmp_path}/retrieval.sock", authkey=KEY)
+    server.start()
+    yield server
+    server.close()
+
+
+def test_several_workers_share_one_service(server):
+    workers = [
+        subprocess.Popen([sys.executable, "-c", WORKER, server.url, KEY, f"w{n}"],
+                         cwd=BACKEND_DIR, stdout=subprocess.PIPE, text=True)
+        for n in range(3)
+    ]
+    outputs = [json.loads(worker.communicate(timeout=60)[0]) for worker in workers]
+    assert all(worker.returncode == 0 for worker in workers)
+
+    # Every worker wrote to, and searched, the same store
+    assert server.service.count() == 15
+    for n, output in enumerate(outputs):
+        assert output["ids"] == [f"w{n}-{i}" for i in range(3)]
+    stats = server.stats()
+    assert stats["connections"] >= 3
+    assert stats["batching"]["embed"]["items"] == 3
+
+
+def test_remote_service_mirrors_local_interface(server):
+    service = RemoteRetrievalService(server.url, authkey=KEY)
+    service.add(["Article UB 10"], ["ub10"], [{"session_id": "global"}], embeddings=[[1.0]])
+    service.update(["ub10"], [{"session_id": "s1"}])
+    assert service.get(where={"session_id": "s1"}, include=[], limit=10)["ids"] == ["ub10"]
+    assert service.search_many([("ub", [1.0], 2, None)]) == [["Article UB 10"]]
+    service.delete(["ub10"])
+    assert service.count() == 0
+    assert service.stats()["server"]["calls"] >= 5
+    assert service.embedding_cache.stats() == {"entries": 0}
+
+    # Errors raised in the server process come back to the worker
+    with pytest.raises(RetrievalServiceError, match="KeyError"):
+        service.update(["absent"], [{}])
+    assert service.count() == 0
+    service.close()
+
+
+def test_parse_address():
+    assert parse_address("unix:///tmp/r.sock") == "/tmp/r.sock"
+    assert parse_address("tcp://127.0.0.1:8100") == ("127.0.0.1", 8100)
+    with pytest.raises(ValueError):
+        parse_address("http://localhost")
+
+
+def test_no_service_without_a_key(tmp_path, monkeypatch):
+    url = "tcp://127.0.0.1:8100"
+    with pytest.raises(ValueError, match="RETRIEVAL_SERVICE_KEY"):
+        RemoteRetrievalService(url, authkey="")
+    with pytest.raises(ValueError, match="RETRIEVAL_SERVICE_KEY"):
+        RetrievalServer(InMemoryService(), f"unix://{tmp_path}/retrieval.sock", authkey="")
+    monkeypatch.setattr("retrieval_server.RETRIEVAL_SERVICE_KEY", "")
+    assert server_main(["--url", url]) == 1
@@ -0,0 +1,43 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from semantic_cache import SemanticCache
+
+
+def test_lookup_returns_answer_above_threshold():
+    cache = SemanticCache(threshold=0.9, capacity=4)
+    cache.store('Lyon:True', [1.0, 0.0, 0.1], {'answer': '12m', 'cached': False})
+
+    hit = cache.lookup('Lyon:True', [0.98, 0.0, 0.12])
+    assert hit['answer'] == '12m'
+    assert hit['similarity'] > 0.9
+
+    assert cache.lookup('Lyon:True', [0.0, 1.0, 0.0]) is None
+    assert cache.lookup('Paris:True', [1.0, 0.0, 0.1]) is None
+
+
+def test_ring_buffer_overwrites_oldest_and_ttl_expires(monkeypatch):
+    cache = SemanticCache(threshold=0.99, capacity=2, ttl=10)
+    cache.store('c', [1.0, 0.0], {'answer': 'a'})
+    cache.store('c', [0.0, 1.0], {'answer': 'b'})
+    cache.store('c', [1.0, 1.0], {'answer': 'c'})
+    assert cache.lookup('c', [1.0, 0.0]) is None
+    assert cache.lookup('c', [0.0, 1.0])['answer'] == 'b'
+
+    import semantic_cache
+    now = semantic_cache.time.time()
+    monkeypatch.setattr(semantic_cache.time, 'time', lambda: now + 11)
+    assert cache.lookup('c', [0.0, 1.0]) is None
+
+
+def test_stats_report_hit_rate_and_histogram():
+    cache = SemanticCache(threshold=0.9)
+    cache.store('c', [1.0, 0.0], {'answer': 'a'})
+    cache.lookup('c', [1.0, 0.0])
+    cache.lookup('c', [0.0, 1.0])
+    stats = cache.stats()
+    assert stats['lookups'] == 2
+    assert stats['hit_rate'] == 0.5
+    assert stats['similarity_histogram']['0.95-1.00'] == 1
+    assert stats['similarity_histogram']['0.00-0.50'] == 1
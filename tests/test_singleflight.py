@@ -0,0 +1,101 @@
+import asyncio
+
+from singleflight import SingleFlight
+
+
+class FakeRedis:
+    """Just enough of redis.asyncio.Redis for the cross-worker lock."""
+
+    def __init__(self):
+        self.store = {}
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    async def exists(self, key):
+        return int(key in self.store)
+
+    async def eval(self, script, numkeys, key, token):
+        if self.store.get(key) == token:
+            del self.store[key]
+            return 1
+        return 0
+
+
+def test_concurrent_identical_calls_run_once():
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {'answer': 'ok'}
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do('k', answer) for _ in range(10)))
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(r == {'answer': 'ok'} for r in results)
+    assert flight.stats() == {'leaders': 1, 'followers': 9, 'inflight': 0}
+
+
+def test_leader_failure_propagates_to_followers():
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError('groq down')
+
+    async def scenario():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do('k', boom) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_other_worker_waits_for_published_result():
+    redis = FakeRedis()
+    published = {}
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        return {'answer': 'fresh'}
+
+    async def other_worker_finishes():
+        await asyncio.sleep(0.1)
+        published['value'] = {'answer': 'from other worker'}
+        redis.store.pop('lock:k')
+
+    async def published_value():
+        return published.get('value')
+
+    async def scenario():
+        await redis.set('lock:k', 'other-worker', nx=True)
+        flight = SingleFlight(redis)
+        result, _ = await asyncio.gather(
+            flight.do('k', answer, wait_for_result=published_value),
+            other_worker_finishes(),
+        )
+        return result
+
+    assert asyncio.run(scenario()) == {'answer': 'from other worker'}
+    assert calls == []
+
+
+def test_lock_is_released_after_leading():
+    redis = FakeRedis()
+
+    async def answer():
+        assert 'lock:k' in redis.store
+        return 'ok'
+
+    async def nothing():
+        return None
+
+    assert asyncio.run(SingleFlight(redis).do('k', answer, wait_for_result=nothing)) == 'ok'
+    assert redis.store == {}
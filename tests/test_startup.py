@@ -0,0 +1,37 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from startup import StartupState
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+HEAVY_MODULES = ["chromadb", "sentence_transformers", "torch", "PyPDF2", "docx", "groq", "tiktoken"]
+
+
+def test_startup_state_records_phases_and_readiness():
+    state = StartupState()
+    with state.phase("retrieval"):
+        pass
+    assert not state.ready
+    state.mark_ready()
+    data = state.to_dict()
+    assert data["ready"] is True
+    assert data["error"] is None
+    assert set(data["timings"]) == {"retrieval", "ready"}
+
+
+def test_startup_state_failure_keeps_worker_unready():
+    state = StartupState()
+    state.fail(RuntimeError("modèle introuvable"))
+    assert not state.ready
+    assert state.to_dict()["error"] == "modèle introuvable"
+
+
+def test_importing_app_does_not_load_heavy_modules():
+    code = (
+        "import sys, main\n"
+        f"loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "assert not loaded, loaded\n"
+        "assert 'import' in main.startup.timings\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, check=True)
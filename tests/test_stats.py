@@ -0,0 +1,80 @@
+import asyncio
+
+from stats import StatsRecorder
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def incrby(self, key, amount):
+        self.commands.append((key, amount))
+
+    async def execute(self):
+        if self.redis.fail:
+            raise ConnectionError('redis down')
+        self.redis.round_trips += 1
+        for key, amount in self.commands:
+            self.redis.store[key] = self.redis.store.get(key, 0) + amount
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+        self.round_trips = 0
+        self.fail = False
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def mget(self, keys):
+        self.round_trips += 1
+        return [self.store.get(key) for key in keys]
+
+
+def test_counters_are_flushed_in_one_round_trip():
+    redis = FakeRedis()
+    recorder = StatsRecorder(redis)
+    for _ in range(5):
+        recorder.incr('total')
+    recorder.incr('cache_hits')
+
+    asyncio.run(recorder.flush())
+    assert redis.store == {'stats:total': 5, 'stats:cache_hits': 1}
+    assert redis.round_trips == 1
+
+
+def test_read_uses_single_mget_and_includes_unflushed():
+    redis = FakeRedis()
+    redis.store['stats:total'] = 10
+    recorder = StatsRecorder(redis)
+    recorder.incr('total', 2)
+
+    counters = asyncio.run(recorder.read(['total', 'cache_hits', 'api_calls']))
+    assert counters == {'total': 12, 'cache_hits': 0, 'api_calls': 0}
+    assert redis.round_trips == 1
+
+
+def test_failed_flush_keeps_deltas():
+    redis = FakeRedis()
+    redis.fail = True
+    recorder = StatsRecorder(redis)
+    recorder.incr('api_calls')
+    asyncio.run(recorder.flush())
+
+    redis.fail = False
+    asyncio.run(recorder.flush())
+    assert redis.store == {'stats:api_calls': 1}
+
+
+def test_without_redis_counts_locally():
+    recorder = StatsRecorder()
+    recorder.incr('total')
+    assert asyncio.run(recorder.read(['total'])) == {'total': 1}